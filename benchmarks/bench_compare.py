@@ -0,0 +1,169 @@
+"""
+Compare the benchmark suite (see `benchmarks.bench_suite`)
+against a stored baseline.
+
+Runs the suite at the same scale as the baseline and reports how much
+each stage has sped up or slowed down.  A gated stage regresses if it
+takes more than `--tolerance` times longer than in the baseline (plus
+`MIN_SLOWDOWN_SECONDS`, so that noise in very fast stages doesn't
+fail the comparison).
+
+Usage:
+
+    python -m benchmarks.bench_compare [--baseline PATH] [--tolerance T]
+                                       [--results PATH] [--update]
+
+`--results` compares results saved earlier with `bench_suite --output`
+instead of running the suite.  After a deliberate speedup (or to move
+the baseline to new hardware), `--update` saves the current results
+as the new baseline instead of comparing them.
+
+Exits with a non-zero status if any gated stage regressed.
+"""
+import argparse
+import json
+import os.path
+import sys
+from benchmarks.bench_suite import DEFAULT_SCALE, STAGES, run_suite
+
+
+# Baseline results committed with the benchmarks
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# Stages that fail the comparison if they regress
+GATED_STAGES = [
+    'diff parse', 'xml lookup', 'snippet render', 'template render'
+]
+
+# Largest acceptable slowdown, as a fraction of the baseline time
+DEFAULT_TOLERANCE = 0.5
+
+# Slowdowns shorter than this (in seconds) are never regressions
+MIN_SLOWDOWN_SECONDS = 0.01
+
+
+def load_results(path):
+    """
+    Load results saved as JSON by `save_results()`.
+    """
+    with open(path) as results_file:
+        return json.load(results_file)
+
+
+def save_results(results, path):
+    """
+    Save `results` (as returned by `run_suite()`) to `path` as JSON.
+    """
+    with open(path, 'w') as results_file:
+        json.dump(results, results_file, indent=4, sort_keys=True)
+        results_file.write('\n')
+
+
+def regressions(baseline, current, tolerance):
+    """
+    Return the list of gated stages that are more than `tolerance`
+    (a fraction of the baseline time) slower in the `current`
+    results than in the `baseline` results.
+    """
+    regressed = []
+
+    for stage in GATED_STAGES:
+        baseline_seconds = baseline['stages'][stage]
+        max_seconds = (
+            baseline_seconds * (1 + tolerance) + MIN_SLOWDOWN_SECONDS
+        )
+
+        if current['stages'][stage] > max_seconds:
+            regressed.append(stage)
+
+    return regressed
+
+
+def print_comparison(baseline, current, regressed):
+    """
+    Print a table comparing the `current` results to the `baseline`.
+    """
+    print("{0:<20} {1:>12} {2:>12} {3:>10}".format(
+        "stage", "baseline", "current", "change"
+    ))
+
+    for stage in STAGES:
+        if stage not in baseline['stages']:
+            continue
+
+        baseline_seconds = baseline['stages'][stage]
+        current_seconds = current['stages'][stage]
+
+        if baseline_seconds > 0:
+            change = "{0:+.0%}".format(current_seconds / baseline_seconds - 1)
+        else:
+            change = "-"
+
+        if stage in regressed:
+            change += " REGRESSED"
+
+        print("{0:<20} {1:>12.3f} {2:>12.3f} {3:>10}".format(
+            stage, baseline_seconds, current_seconds, change
+        ))
+
+
+def main():
+    """
+    Compare the benchmarks to the baseline, or update the baseline.
+    """
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        '--baseline', type=str, default=DEFAULT_BASELINE,
+        help="Path to the baseline results"
+    )
+    parser.add_argument(
+        '--tolerance', type=float, default=DEFAULT_TOLERANCE,
+        help="Largest acceptable slowdown, as a fraction of the baseline"
+    )
+    parser.add_argument(
+        '--results', type=str, default=None,
+        help="Path to saved results to use instead of running the suite"
+    )
+    parser.add_argument(
+        '--update', action='store_true', default=False,
+        help="Save the current results as the new baseline"
+    )
+    args = parser.parse_args()
+
+    if args.update and not os.path.exists(args.baseline):
+        baseline = None
+    else:
+        baseline = load_results(args.baseline)
+
+    # Load the results, or run the suite at the baseline's scale
+    if args.results is not None:
+        current = load_results(args.results)
+    elif baseline is not None:
+        current = run_suite(baseline['scale'], baseline['runs'])
+    else:
+        current = run_suite(dict(DEFAULT_SCALE))
+
+    if args.update:
+        save_results(current, args.baseline)
+        print("Saved baseline to {0}".format(args.baseline))
+        return
+
+    if current['scale'] != baseline['scale']:
+        print("Results are at a different scale from the baseline: "
+              "{0} != {1}".format(current['scale'], baseline['scale']))
+        sys.exit(1)
+
+    regressed = regressions(baseline, current, args.tolerance)
+    print_comparison(baseline, current, regressed)
+
+    if regressed:
+        print("Stages slower than the baseline by more than {0:.0%}: "
+              "{1}".format(args.tolerance, ", ".join(regressed)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Benchmark merging the committed, staged, and unstaged diffs
+in `GitDiffReporter`.
+
+Generates synthetic diffs that change up to 1M lines in a single
+file and reports the time per changed line.  If merging scales
+linearly, the time per line stays roughly constant as the number
+of changed lines grows.
+
+Usage:
+
+    python -m benchmarks.bench_diff_merge
+
+Exits with a non-zero status if the time per line for the largest
+diff is more than `MAX_SLOWDOWN` times the time per line for
+the smallest diff.
+"""
+import sys
+import time
+from diff_cover.diff_reporter import GitDiffReporter
+
+
+NUM_CHANGED_LINES = [1000, 10000, 100000, 1000000]
+
+# Number of lines changed in each hunk
+HUNK_SIZE = 50
+
+# Largest acceptable ratio between the time per line
+# of the largest and smallest diffs
+MAX_SLOWDOWN = 3.0
+
+
+class StubGitDiffTool(object):
+    """
+    Stand-in for `GitDiffTool` that returns pre-generated diffs.
+    """
+
+    def __init__(self, committed, staged, unstaged):
+        self._diffs = [committed, staged, unstaged]
+
+    def diff_all(self):
+        """
+        Return the committed, staged, and unstaged diffs.
+        """
+        return self._diffs
+
+
+def modify_diff(num_lines, offset):
+    """
+    Return a diff that modifies `num_lines` lines of `file.py`,
+    in hunks of `HUNK_SIZE` lines separated by `HUNK_SIZE`
+    unchanged lines.  The first hunk starts at line `offset` + 1.
+    """
+    output = ['diff --git a/file.py b/file.py']
+
+    for hunk_start in range(offset + 1, offset + 2 * num_lines, 2 * HUNK_SIZE):
+        output.append('@@ -{0},{1} +{0},{1} @@'.format(hunk_start, HUNK_SIZE))
+        output.extend(['-old'] * HUNK_SIZE)
+        output.extend(['+new'] * HUNK_SIZE)
+
+    return '\n'.join(output)
+
+
+def insert_diff(num_lines):
+    """
+    Return a diff that inserts `num_lines` lines
+    at the start of `file.py`.
+    """
+    output = [
+        'diff --git a/file.py b/file.py',
+        '@@ -0,0 +1,{0} @@'.format(num_lines)
+    ]
+    output.extend(['+new'] * num_lines)
+    return '\n'.join(output)
+
+
+def time_merge(num_lines):
+    """
+    Return the number of seconds needed to merge diffs
+    that change `num_lines` lines.
+    """
+    # Committed changes, staged changes that overlap half
+    # of each committed hunk, and unstaged changes that
+    # shift every line down.
+    tool = StubGitDiffTool(
+        modify_diff(num_lines, 0),
+        modify_diff(num_lines, HUNK_SIZE // 2),
+        insert_diff(HUNK_SIZE)
+    )
+    reporter = GitDiffReporter(git_diff=tool)
+
+    start = time.time()
+    reporter.line_ranges('file.py')
+    return time.time() - start
+
+
+def main():
+    """
+    Run the benchmark and print the results.
+    """
+    per_line_times = []
+
+    # Warm up, so the first timing doesn't include one-time costs
+    time_merge(NUM_CHANGED_LINES[0])
+
+    print("{0:>12} {1:>12} {2:>14}".format("lines", "seconds", "usec/line"))
+
+    for num_lines in NUM_CHANGED_LINES:
+        seconds = time_merge(num_lines)
+        per_line = seconds / num_lines * 1e6
+        per_line_times.append(per_line)
+        print("{0:>12} {1:>12.3f} {2:>14.3f}".format(num_lines, seconds, per_line))
+
+    slowdown = per_line_times[-1] / per_line_times[0]
+    print("Slowdown per line: {0:.2f}x".format(slowdown))
+
+    if slowdown > MAX_SLOWDOWN:
+        print("Merging does not scale linearly")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Benchmark grouping source tokens into snippets
+in `Snippet._group_tokens`.
+
+Generates a synthetic 50k-line Python module with a violation
+every `VIOLATION_INTERVAL` lines, lexes it once, and reports the
+time needed to group the tokens into snippet ranges.  Multi-line
+docstrings make sure tokens spanning several lines are included.
+
+Usage:
+
+    python -m benchmarks.bench_snippets
+
+Exits with a non-zero status if grouping takes longer
+than `MAX_SECONDS`.
+"""
+import sys
+import time
+from diff_cover.snippets import Snippet
+
+
+NUM_SRC_LINES = 50000
+
+# Number of lines between violations
+VIOLATION_INTERVAL = 20
+
+# Longest acceptable time to group the tokens, in seconds
+MAX_SECONDS = 5.0
+
+
+def synthetic_source(num_lines):
+    """
+    Return the contents of a Python module
+    with (about) `num_lines` lines.
+    """
+    # Each function is 10 lines long, including a docstring
+    function_lines = [
+        u'def func_{0}(arg):',
+        u'    """',
+        u'    Return `arg` plus {0}.',
+        u'    """',
+        u'    # Add the number',
+        u'    value = arg + {0}',
+        u'    return value',
+        u'',
+        u'',
+        u'',
+    ]
+
+    lines = []
+    for index in range(num_lines // len(function_lines)):
+        lines.extend(line.format(index) for line in function_lines)
+
+    return u'\n'.join(lines)
+
+
+def time_group_tokens(contents, violation_lines):
+    """
+    Return the number of seconds needed to group the tokens
+    of `contents` into snippets for `violation_lines`.
+    """
+    num_src_lines = len(contents.split('\n'))
+    snippet_ranges = Snippet._snippet_ranges(num_src_lines, violation_lines)
+
+    # Lex ahead of time, so we only time the grouping
+    tokens = list(Snippet._parse_src(contents, 'module.py'))
+
+    start = time.time()
+    Snippet._group_tokens(iter(tokens), snippet_ranges)
+    return time.time() - start
+
+
+def main():
+    """
+    Run the benchmark and print the results.
+    """
+    contents = synthetic_source(NUM_SRC_LINES)
+    violation_lines = range(1, NUM_SRC_LINES + 1, VIOLATION_INTERVAL)
+
+    seconds = time_group_tokens(contents, violation_lines)
+    print("{0:>12} {1:>12} {2:>12}".format("lines", "violations", "seconds"))
+    print("{0:>12} {1:>12} {2:>12.3f}".format(
+        NUM_SRC_LINES, len(violation_lines), seconds
+    ))
+
+    if seconds > MAX_SECONDS:
+        print("Grouping tokens took longer than {0} seconds".format(MAX_SECONDS))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark the startup time of the `diff-quality` command.
+
+Creates a git repository with no changes relative to `origin/master`
+and times `diff-quality --violations=pep8` in it, which measures
+the cost of starting the tool (mostly importing modules) rather
+than the cost of checking any files.
+
+Usage:
+
+    python -m benchmarks.bench_startup
+
+Exits with a non-zero status if the fastest run takes longer
+than `MAX_SECONDS`.
+"""
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+# Number of times to run the command
+NUM_RUNS = 10
+
+# Longest acceptable startup time, in seconds
+MAX_SECONDS = 0.5
+
+# Run the command-line entry point as if installed as `diff-quality`
+COMMAND = [
+    sys.executable, '-c',
+    'import sys; '
+    'sys.argv = ["diff-quality", "--violations=pep8"]; '
+    'from diff_cover.tool import main; '
+    'main()'
+]
+
+
+def create_clean_repo(repo_dir):
+    """
+    Create a git repository in `repo_dir` with a single commit,
+    which is also the commit at `origin/master`.
+    """
+    def git(*args):
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call(
+                ('git',) + args, cwd=repo_dir, stdout=devnull
+            )
+
+    git('init', '-q')
+    git('config', 'user.email', 'bench@example.com')
+    git('config', 'user.name', 'Benchmark')
+
+    with open(os.path.join(repo_dir, 'module.py'), 'w') as src_file:
+        src_file.write('x = 1\n')
+
+    git('add', 'module.py')
+    git('commit', '-q', '-m', 'Initial commit')
+    git('update-ref', 'refs/remotes/origin/master', 'HEAD')
+
+
+def time_startup(repo_dir):
+    """
+    Return the number of seconds needed to run
+    `diff-quality` in `repo_dir`.
+    """
+    # Make sure we run the package in this source tree
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    start = time.time()
+
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(COMMAND, cwd=repo_dir, env=env, stdout=devnull)
+
+    return time.time() - start
+
+
+def main():
+    """
+    Run the benchmark and print the results.
+    """
+    repo_dir = tempfile.mkdtemp()
+
+    try:
+        create_clean_repo(repo_dir)
+
+        # Warm up, so the first timing doesn't include
+        # loading files into the OS cache
+        time_startup(repo_dir)
+
+        times = [time_startup(repo_dir) for _ in range(NUM_RUNS)]
+    finally:
+        shutil.rmtree(repo_dir)
+
+    print("{0:>12} {1:>12} {2:>12}".format("runs", "fastest", "median"))
+    print("{0:>12} {1:>12.3f} {2:>12.3f}".format(
+        NUM_RUNS, min(times), sorted(times)[NUM_RUNS // 2]
+    ))
+
+    if min(times) > MAX_SECONDS:
+        print("Startup took longer than {0} seconds".format(MAX_SECONDS))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,517 @@
+"""
+Benchmark each stage of diff-cover on a synthetic repository.
+
+Generates source files, a `git diff` of them, Cobertura XML coverage
+reports (split into shards, as if produced by several test suites),
+and pep8 and pylint reports, at a scale set on the command line.
+Then times:
+
+    diff parse        `GitDiffReporter._parse_diff_str()`
+    xml parse         Parsing the coverage reports with lxml
+    xml lookup        `XmlCoverageReporter` queries for every file
+    xml streaming     `StreamingXmlCoverageReporter` queries for every file
+    quality reports   Loading the pep8 and pylint reports
+    diff violations   `DiffViolations` for every file
+    snippet render    `Snippet.load_snippets_html()` for every file
+    report            Generating the full HTML coverage report
+    template render   The template rendering part of the full report
+
+Each stage runs `--runs` times and the fastest time is kept.
+
+Usage:
+
+    python -m benchmarks.bench_suite [--files N] [--lines-per-file N]
+                                     [--hunks N] [--shards N]
+                                     [--runs N] [--output PATH]
+
+Prints a table of the results, and writes them as JSON
+to `PATH` if `--output` is given.
+"""
+import argparse
+from contextlib import contextmanager
+import json
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import time
+from lxml import etree
+from diff_cover import instrumentation
+from diff_cover.diff_reporter import GitDiffReporter
+from diff_cover.report_generator import DiffViolations, HtmlReportGenerator
+from diff_cover.snippets import Snippet
+from diff_cover.violations_reporter import XmlCoverageReporter, \
+    StreamingXmlCoverageReporter, Pep8QualityReporter, PylintQualityReporter
+from benchmarks.bench_snippets import synthetic_source
+
+
+# Default size of the synthetic repository
+DEFAULT_SCALE = {
+    'files': 50,
+    'lines_per_file': 400,
+    'hunks': 8,
+    'shards': 3,
+}
+
+# Default number of times to run each stage
+NUM_RUNS = 3
+
+# Number of lines between uncovered lines, and between
+# violations in the quality reports
+COVERAGE_INTERVAL = 7
+VIOLATION_INTERVAL = 5
+
+# Stages, in the order they are reported
+STAGES = [
+    'diff parse', 'xml parse', 'xml lookup', 'xml streaming',
+    'quality reports', 'diff violations', 'snippet render',
+    'report', 'template render',
+]
+
+
+class StubGitDiffTool(object):
+    """
+    Stand-in for `GitDiffTool` that returns a pre-generated diff.
+    """
+
+    def __init__(self, diff_str):
+        self._diffs = [diff_str, '', '']
+
+    def diff_all(self):
+        """
+        Return the committed, staged, and unstaged diffs.
+        """
+        return self._diffs
+
+
+class SyntheticRepo(object):
+    """
+    Source files and reports generated in a temporary directory.
+    """
+
+    def __init__(self, repo_dir, scale):
+        self.repo_dir = repo_dir
+        self.scale = scale
+
+        self.src_paths = [
+            os.path.join('pkg_{0}'.format(index % 10),
+                         'module_{0}.py'.format(index))
+            for index in range(scale['files'])
+        ]
+
+        self.line_ranges = self._line_ranges()
+
+        self._write_sources()
+        self.diff_str = self._diff()
+        self.coverage_paths = [
+            self._write_file('coverage_{0}.xml'.format(shard),
+                             self._coverage_xml(shard))
+            for shard in range(scale['shards'])
+        ]
+        self.pep8_path = self._write_file('pep8.txt', self._pep8_report())
+        self.pylint_path = self._write_file(
+            'pylint.txt', self._pylint_report()
+        )
+
+    def _line_ranges(self):
+        """
+        Return the `(start, end)` ranges of lines changed in each
+        file: `hunks` evenly spaced runs, each half as long
+        as the space between them.
+        """
+        num_lines = self.scale['lines_per_file']
+        interval = max(1, num_lines // max(1, self.scale['hunks']))
+        hunk_size = max(1, interval // 2)
+
+        return [
+            (start, min(num_lines, start + hunk_size - 1))
+            for start in range(1, num_lines + 1, interval)
+        ]
+
+    def _write_file(self, rel_path, contents):
+        """
+        Write `contents` to `rel_path` in the repository,
+        and return the path.
+        """
+        path = os.path.join(self.repo_dir, rel_path)
+
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        with open(path, 'w') as output_file:
+            output_file.write(contents.encode('utf-8'))
+
+        return path
+
+    def _write_sources(self):
+        """
+        Write the source files.
+        """
+        contents = synthetic_source(self.scale['lines_per_file'])
+        for src_path in self.src_paths:
+            self._write_file(src_path, contents)
+
+    def _diff(self):
+        """
+        Return a `git diff` that modifies the changed lines of every file.
+        """
+        output = []
+
+        for src_path in self.src_paths:
+            output.extend([
+                'diff --git a/{0} b/{0}'.format(src_path),
+                'index 1234567..89abcde 100644',
+                '--- a/{0}'.format(src_path),
+                '+++ b/{0}'.format(src_path),
+            ])
+
+            for (start, end) in self.line_ranges:
+                num_lines = end - start + 1
+                output.append('@@ -{0},{1} +{0},{1} @@'.format(start, num_lines))
+                output.extend(['-old'] * num_lines)
+                output.extend(['+new'] * num_lines)
+
+        return '\n'.join(output)
+
+    def _coverage_xml(self, shard):
+        """
+        Return a Cobertura XML report covering every source file.
+
+        Every `COVERAGE_INTERVAL`th line is uncovered in all shards,
+        and each shard misses a few more lines covered by the others.
+        """
+        output = [
+            '<?xml version="1.0" ?>',
+            '<coverage version="3.6">',
+            '<packages><package name=""><classes>',
+        ]
+
+        uncovered = (0, 1 + shard % (COVERAGE_INTERVAL - 1))
+
+        for src_path in self.src_paths:
+            output.append('<class filename="{0}" name="{0}">'.format(src_path))
+            output.append('<methods/><lines>')
+            output.extend(
+                '<line hits="{0}" number="{1}"/>'.format(
+                    0 if line % COVERAGE_INTERVAL in uncovered else 1, line
+                )
+                for line in range(1, self.scale['lines_per_file'] + 1)
+            )
+            output.append('</lines></class>')
+
+        output.append('</classes></package></packages></coverage>')
+        return u'\n'.join(output)
+
+    def _pep8_report(self):
+        """
+        Return a pep8 report with a violation every few lines.
+        """
+        return u'\n'.join(
+            u'{0}:{1}:1: E501 line too long (80 > 79 characters)'.format(
+                src_path, line
+            )
+            for src_path in self.src_paths
+            for line in self._violation_lines()
+        )
+
+    def _pylint_report(self):
+        """
+        Return a pylint report with a violation every few lines.
+        """
+        return u'\n'.join(
+            u'{0}:{1}: [C0111, func_{1}] Missing docstring'.format(
+                src_path, line
+            )
+            for src_path in self.src_paths
+            for line in self._violation_lines()
+        )
+
+    def _violation_lines(self):
+        """
+        Return the lines of each file with quality violations.
+        """
+        return range(1, self.scale['lines_per_file'] + 1, VIOLATION_INTERVAL)
+
+
+def time_diff_parse(repo):
+    """
+    Return the number of seconds needed to parse the diff.
+    """
+    reporter = GitDiffReporter()
+
+    start = time.time()
+    reporter._parse_diff_str(repo.diff_str)
+    return time.time() - start
+
+
+def time_xml_parse(repo):
+    """
+    Return the number of seconds needed to parse the coverage reports.
+    """
+    start = time.time()
+    for path in repo.coverage_paths:
+        etree.parse(path)
+    return time.time() - start
+
+
+def time_xml_lookup(repo):
+    """
+    Return the number of seconds needed to look up the
+    coverage of every file in the parsed coverage reports.
+    """
+    xml_roots = [etree.parse(path) for path in repo.coverage_paths]
+
+    start = time.time()
+    _query_coverage(XmlCoverageReporter(xml_roots), repo.src_paths)
+    return time.time() - start
+
+
+def time_xml_streaming(repo):
+    """
+    Return the number of seconds needed to read the coverage
+    reports incrementally and look up the coverage of every file.
+    """
+    start = time.time()
+    _query_coverage(
+        StreamingXmlCoverageReporter(repo.coverage_paths, repo.src_paths),
+        repo.src_paths
+    )
+    return time.time() - start
+
+
+def _query_coverage(coverage, src_paths):
+    """
+    Query `coverage` for the violations and measured lines of each file.
+    """
+    for src_path in src_paths:
+        coverage.violations(src_path)
+        coverage.measured_lines(src_path)
+
+
+def time_quality_reports(repo):
+    """
+    Return the number of seconds needed to load the pep8 and
+    pylint reports and look up the violations in every file.
+    """
+    start = time.time()
+
+    for (reporter_class, path) in [(Pep8QualityReporter, repo.pep8_path),
+                                   (PylintQualityReporter, repo.pylint_path)]:
+        with open(path) as report_file:
+            reporter = reporter_class('quality', [report_file])
+
+        for src_path in repo.src_paths:
+            reporter.violations(src_path)
+
+    return time.time() - start
+
+
+def time_diff_violations(repo):
+    """
+    Return the number of seconds needed to find the
+    coverage violations in the diff of every file.
+    """
+    coverage = XmlCoverageReporter(
+        [etree.parse(path) for path in repo.coverage_paths]
+    )
+    inputs = [
+        (coverage.violations(src_path), coverage.measured_lines(src_path))
+        for src_path in repo.src_paths
+    ]
+
+    start = time.time()
+    for (violations, measured_lines) in inputs:
+        DiffViolations(violations, measured_lines, repo.line_ranges)
+    return time.time() - start
+
+
+def time_snippet_render(repo):
+    """
+    Return the number of seconds needed to render
+    the snippets for the violations in every file.
+    """
+    # The lines uncovered in every coverage report
+    violation_lines = [
+        line for (start, end) in repo.line_ranges
+        for line in range(start, end + 1)
+        if line % COVERAGE_INTERVAL == 0
+    ]
+
+    start = time.time()
+    for src_path in repo.src_paths:
+        Snippet.load_snippets_html(src_path, violation_lines)
+    return time.time() - start
+
+
+def time_report(repo):
+    """
+    Return a tuple `(report_seconds, template_seconds)`: the number of
+    seconds needed to generate the HTML coverage report, and the part
+    of that spent rendering the template.
+    """
+    profiler = instrumentation.Profiler()
+    instrumentation.register(profiler)
+
+    try:
+        start = time.time()
+
+        diff = GitDiffReporter(git_diff=StubGitDiffTool(repo.diff_str))
+        coverage = StreamingXmlCoverageReporter(
+            repo.coverage_paths, diff.src_paths_changed()
+        )
+
+        with open(os.devnull, 'w') as output_file:
+            HtmlReportGenerator(coverage, diff).generate_report(output_file)
+
+        report_seconds = time.time() - start
+    finally:
+        instrumentation.unregister(profiler)
+
+    stage_seconds = dict(
+        (stage['name'], stage['wall_time'])
+        for stage in profiler.stats()['stages']
+    )
+
+    # Snippets are rendered while the template is rendered,
+    # so don't count them as part of the template
+    template_seconds = (
+        stage_seconds.get('render template', 0.0) -
+        stage_seconds.get('render snippets', 0.0)
+    )
+
+    return (report_seconds, template_seconds)
+
+
+@contextmanager
+def _working_dir(path):
+    """
+    Change to the directory `path` while the context is active.
+    """
+    old_dir = os.getcwd()
+    os.chdir(path)
+
+    try:
+        yield
+    finally:
+        os.chdir(old_dir)
+
+
+def run_suite(scale, num_runs=NUM_RUNS):
+    """
+    Generate a synthetic repository at `scale` (a dict like
+    `DEFAULT_SCALE`) and time each stage `num_runs` times.
+
+    Returns a dict of the form:
+
+        {
+            'scale': SCALE,
+            'runs': NUM_RUNS,
+            'stages': {STAGE: SECONDS, ...}
+        }
+
+    where `SECONDS` is the fastest time for the stage.
+    """
+    repo_dir = tempfile.mkdtemp()
+    timings = dict((stage, []) for stage in STAGES)
+
+    try:
+        repo = SyntheticRepo(repo_dir, scale)
+
+        # Snippets and the report load source files by relative path
+        with _working_dir(repo_dir):
+            for _ in range(num_runs):
+                timings['diff parse'].append(time_diff_parse(repo))
+                timings['xml parse'].append(time_xml_parse(repo))
+                timings['xml lookup'].append(time_xml_lookup(repo))
+                timings['xml streaming'].append(time_xml_streaming(repo))
+                timings['quality reports'].append(time_quality_reports(repo))
+                timings['diff violations'].append(time_diff_violations(repo))
+                timings['snippet render'].append(time_snippet_render(repo))
+
+                report_seconds, template_seconds = time_report(repo)
+                timings['report'].append(report_seconds)
+                timings['template render'].append(template_seconds)
+    finally:
+        shutil.rmtree(repo_dir)
+
+    return {
+        'scale': dict(scale),
+        'runs': num_runs,
+        'stages': dict(
+            (stage, min(seconds)) for (stage, seconds) in timings.items()
+        ),
+    }
+
+
+def print_results(results):
+    """
+    Print a table of `results`, as returned by `run_suite()`.
+    """
+    print(", ".join(
+        "{0}={1}".format(name, value)
+        for (name, value) in sorted(results['scale'].items())
+    ))
+    print("{0:<20} {1:>12}".format("stage", "seconds"))
+
+    for stage in STAGES:
+        print("{0:<20} {1:>12.3f}".format(stage, results['stages'][stage]))
+
+
+def add_scale_args(parser):
+    """
+    Add options for the scale of the synthetic
+    repository to the `argparse` `parser`.
+    """
+    parser.add_argument(
+        '--files', type=int, default=DEFAULT_SCALE['files'],
+        help="Number of source files changed in the diff"
+    )
+    parser.add_argument(
+        '--lines-per-file', type=int, default=DEFAULT_SCALE['lines_per_file'],
+        help="Number of lines in each source file"
+    )
+    parser.add_argument(
+        '--hunks', type=int, default=DEFAULT_SCALE['hunks'],
+        help="Number of hunks in the diff of each file"
+    )
+    parser.add_argument(
+        '--shards', type=int, default=DEFAULT_SCALE['shards'],
+        help="Number of coverage XML reports"
+    )
+    parser.add_argument(
+        '--runs', type=int, default=NUM_RUNS,
+        help="Number of times to run each stage"
+    )
+
+
+def scale_from_args(args):
+    """
+    Return the scale dict for the arguments parsed by `add_scale_args()`.
+    """
+    return dict((name, getattr(args, name)) for name in DEFAULT_SCALE)
+
+
+def main():
+    """
+    Run the benchmarks and print the results.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    add_scale_args(parser)
+    parser.add_argument(
+        '--output', type=str, default=None,
+        help="Path to write the results to as JSON"
+    )
+    args = parser.parse_args()
+
+    results = run_suite(scale_from_args(args), args.runs)
+    print_results(results)
+
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=4, sort_keys=True)
+            output_file.write('\n')
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""
+Persistent on-disk cache for results that are expensive to compute.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+
+class DiskCache(object):
+    """
+    Store JSON-serializable values in files under a directory,
+    one file per key.
+
+    When the total size of the cache exceeds a limit,
+    `evict()` removes the least recently used entries.
+    Other files in the directory are left alone.
+    """
+
+    # Default limit on the total size of the cache, in bytes
+    DEFAULT_MAX_SIZE = 50 * 1024 * 1024
+
+    # Prefix and suffix of the names of the files storing entries,
+    # so that `evict()` never touches files the cache didn't create
+    ENTRY_PREFIX = 'diff_cover-'
+    ENTRY_SUFFIX = '.json'
+
+    # Suffix of the temporary files entries are written to
+    TEMP_SUFFIX = '.tmp'
+
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        """
+        Store the cache in the directory `cache_dir`, which is
+        created if it does not exist.
+
+        `max_size` is the limit on the total size of the cache,
+        in bytes.
+        """
+        self._cache_dir = cache_dir
+        self._max_size = max_size
+
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    @staticmethod
+    def make_key(*components):
+        """
+        Return a key (string) identifying `components`, a sequence
+        of strings.  The key changes if any component changes.
+        """
+        digest = hashlib.sha1()
+
+        for component in components:
+            if isinstance(component, unicode):
+                component = component.encode('utf-8')
+
+            # Include the length so that ("ab", "c") and ("a", "bc")
+            # produce different keys
+            digest.update("{0}:".format(len(component)))
+            digest.update(component)
+
+        return digest.hexdigest()
+
+    @staticmethod
+    def hash_file(path):
+        """
+        Return a hash of the contents of the file at `path`.
+
+        Raises an `IOError` if the file could not be read.
+        """
+        with open(path, 'rb') as cached_file:
+            return hashlib.sha1(cached_file.read()).hexdigest()
+
+    def get(self, key):
+        """
+        Return the value stored for `key`, or `None` if there is
+        no value (or the stored value could not be read).
+        """
+        path = self._path(key)
+
+        try:
+            with open(path) as cache_file:
+                value = json.load(cache_file)
+        except (IOError, ValueError):
+            return None
+
+        # Mark the entry as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+        return value
+
+    def set(self, key, value):
+        """
+        Store `value` (JSON-serializable) for `key`.
+        """
+        # Write to a temporary file first, so that a concurrent
+        # reader never sees a partially written entry
+        handle, temp_path = tempfile.mkstemp(
+            prefix=self.ENTRY_PREFIX, suffix=self.TEMP_SUFFIX,
+            dir=self._cache_dir
+        )
+
+        with os.fdopen(handle, 'w') as cache_file:
+            json.dump(value, cache_file)
+
+        path = self._path(key)
+
+        try:
+            os.rename(temp_path, path)
+        except OSError:
+
+            # On Windows, we can't rename onto an existing entry,
+            # so remove it and try again.  The cache is best-effort:
+            # if another process got there first, keep its entry.
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+                os.rename(temp_path, path)
+            except OSError:
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the total
+        size of the cache is within its limit.
+
+        Only the cache's own entries are counted and removed, not
+        other files in the directory or entries still being written.
+        """
+        entries = []
+
+        for name in os.listdir(self._cache_dir):
+
+            # Skip files that aren't (complete) entries
+            if not (name.startswith(self.ENTRY_PREFIX) and
+                    name.endswith(self.ENTRY_SUFFIX)):
+                continue
+
+            path = os.path.join(self._cache_dir, name)
+
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total_size = sum(size for (_, size, _) in entries)
+
+        # Remove the oldest entries first
+        for (_, size, path) in sorted(entries):
+            if total_size <= self._max_size:
+                break
+
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+
+            total_size -= size
+
+    def _path(self, key):
+        """
+        Return the path to the file storing the value for `key`.
+        """
+        return os.path.join(
+            self._cache_dir, self.ENTRY_PREFIX + key + self.ENTRY_SUFFIX
+        )
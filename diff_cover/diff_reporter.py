@@ -3,6 +3,7 @@ Classes for querying which lines have changed based on a diff.
 """
 
 from abc import ABCMeta, abstractmethod
+from diff_cover import instrumentation
 from diff_cover.git_diff import GitDiffError
 import re
 
@@ -41,6 +42,17 @@ class BaseDiffReporter(object):
         """
         pass
 
+    def line_ranges(self, src_path):
+        """
+        Returns a list of `(start, end)` tuples representing
+        the (inclusive) runs of line numbers changed in the
+        source file at `src_path`.
+
+        Runs are in ascending order and do not overlap or touch,
+        so this is a compact form of `lines_changed()`.
+        """
+        return self._ranges_from_lines(self.lines_changed(src_path))
+
     def name(self):
         """
         Return the name of the diff, which will be included
@@ -48,6 +60,39 @@ class BaseDiffReporter(object):
         """
         return self._name
 
+    @staticmethod
+    def _ranges_from_lines(line_numbers):
+        """
+        Given an ascending list of unique line numbers, return
+        a list of `(start, end)` tuples for each run of
+        consecutive lines.
+        """
+        ranges = []
+
+        for line in line_numbers:
+
+            # If this line continues the last run, extend it
+            if ranges and ranges[-1][1] == line - 1:
+                ranges[-1] = (ranges[-1][0], line)
+
+            # Otherwise, start a new run
+            else:
+                ranges.append((line, line))
+
+        return ranges
+
+    @staticmethod
+    def _lines_from_ranges(line_ranges):
+        """
+        Given a list of `(start, end)` tuples, return
+        the list of line numbers they cover.
+        """
+        return [
+            line
+            for (start, end) in line_ranges
+            for line in xrange(start, end + 1)
+        ]
+
 
 class GitDiffReporter(BaseDiffReporter):
     """
@@ -56,25 +101,36 @@ class GitDiffReporter(BaseDiffReporter):
 
     NAME = 'origin/master...HEAD, staged, and unstaged changes'
 
-    def __init__(self, git_diff=None):
+    def __init__(self, git_diff=None, use_merge_base=False):
         """
         Configure the reporter to use `git_diff` as the wrapper
         for the `git diff` tool.  (Should have same interface
         as `git_diff.GitDiffTool`
+
+        If `use_merge_base` is True, run a single `git diff`
+        between the working tree and the merge-base with
+        origin/master, instead of merging the committed,
+        staged, and unstaged diffs.
         """
         super(GitDiffReporter, self).__init__(self.NAME)
 
         self._git_diff_tool = git_diff
+        self._use_merge_base = use_merge_base
 
         # Cache diff information as a dictionary
-        # with file path keys and line number list values
+        # with file path keys and line range list values
         self._diff_dict = None
 
+        # Cache the line numbers expanded from those
+        # ranges for each file `lines_changed()` is called for
+        self._lines_dict = dict()
+
     def clear_cache(self):
         """
         Reset the git diff result cache.
         """
         self._diff_dict = None
+        self._lines_dict = dict()
 
     def src_paths_changed(self):
         """
@@ -93,6 +149,18 @@ class GitDiffReporter(BaseDiffReporter):
         See base class docstring.
         """
 
+        if src_path not in self._lines_dict:
+            self._lines_dict[src_path] = self._lines_from_ranges(
+                self.line_ranges(src_path)
+            )
+
+        return self._lines_dict[src_path]
+
+    def line_ranges(self, src_path):
+        """
+        See base class docstring.
+        """
+
         # Get the diff dictionary (cached)
         diff_dict = self._git_diff()
 
@@ -104,10 +172,10 @@ class GitDiffReporter(BaseDiffReporter):
         """
         Run `git diff` and returns a dict in which the keys
         are changed file paths and the values are lists of
-        line numbers.
+        `(start, end)` line ranges.
 
-        Guarantees that each line number within a file
-        is unique (no repeats) and in ascending order.
+        Guarantees that the ranges within a file are in
+        ascending order and do not overlap.
 
         Returns a cached result if called multiple times.
 
@@ -117,197 +185,348 @@ class GitDiffReporter(BaseDiffReporter):
         # If we do not have a cached result, execute `git diff`
         if self._diff_dict is None:
 
-            result_dict = dict()
+            with instrumentation.stage('git diff'):
+                if self._use_merge_base:
+                    result_dict = self._merge_base_diff()
+                else:
+                    result_dict = self._merged_diff()
 
-            for diff_str in [self._git_diff_tool.diff_committed(),
-                             self._git_diff_tool.diff_staged(),
-                             self._git_diff_tool.diff_unstaged()]:
+            instrumentation.count('files in diff', len(result_dict))
+            instrumentation.count('changed lines', sum(
+                end - start + 1
+                for ranges in result_dict.itervalues()
+                for (start, end) in ranges
+            ))
+
+            # Store the resulting dict
+            self._diff_dict = result_dict
+
+        # Return the diff cache
+        return self._diff_dict
+
+    def _merge_base_diff(self):
+        """
+        Run a single `git diff` against the merge-base and return
+        a dict in which the keys are changed file paths and the
+        values are lists of `(start, end)` runs of added lines.
+        """
+        diff_str = self._git_diff_tool.diff_merge_base()
+
+        try:
+            diff_dict = self._parse_diff_str(diff_str)
+        finally:
+            self._close_diffs([diff_str])
+
+        # The diff already covers every change, so the
+        # added lines are the lines changed
+        return dict(
+            (src_path, self._unique_ordered_ranges(added_ranges))
+            for src_path, (added_ranges, _) in diff_dict.items()
+        )
+
+    def _merged_diff(self):
+        """
+        Run `git diff` for committed, staged, and unstaged changes
+        and return a dict in which the keys are changed file paths
+        and the values are lists of `(start, end)` runs of line
+        numbers, merged across the three diffs.
+        """
+        result_dict = dict()
+
+        # Committed, staged, and unstaged changes,
+        # in the order they need to be merged
+        diff_strs = self._git_diff_tool.diff_all()
+
+        try:
+            for diff_str in diff_strs:
 
                 # Parse the output of the diff string
                 diff_dict = self._parse_diff_str(diff_str)
 
                 for src_path in diff_dict.keys():
 
-                    added_lines, deleted_lines = diff_dict[src_path]
+                    added_ranges, deleted_ranges = diff_dict[src_path]
 
-                    # Remove any lines from the dict that have been deleted
-                    # Include any lines that have been added
-                    result_dict[src_path] = [
-                        line for line in result_dict.get(src_path, [])
-                        if not line in deleted_lines
-                    ] + added_lines
+                    # Remove any lines from the dict that have been
+                    # deleted, shift the remaining lines to their
+                    # position after this diff, and include any
+                    # lines that have been added
+                    result_dict[src_path] = self._merge_ranges(
+                        result_dict.get(src_path, []),
+                        added_ranges, deleted_ranges
+                    )
 
-            # Eliminate repeats and order line numbers
-            for (src_path, lines) in result_dict.items():
-                result_dict[src_path] = self._unique_ordered_lines(lines)
+        # If parsing failed, stop any `git diff` we didn't finish reading
+        finally:
+            self._close_diffs(diff_strs)
 
-            # Store the resulting dict
-            self._diff_dict = result_dict
+        return result_dict
 
-        # Return the diff cache
-        return self._diff_dict
+    @staticmethod
+    def _close_diffs(diff_strs):
+        """
+        Close each output of `git diff` in `diff_strs` that can be
+        closed (see `GitDiffOutput.close()`), so that no process
+        is left running.
+        """
+        for diff_str in diff_strs:
+            if hasattr(diff_str, 'close'):
+                diff_str.close()
+
+    @classmethod
+    def _merge_ranges(cls, changed_ranges, added_ranges, deleted_ranges):
+        """
+        Apply a diff to `changed_ranges`, a list of `(start, end)`
+        runs of line numbers changed by earlier diffs, and return
+        the sorted list of runs of line numbers changed after the diff.
+
+        `added_ranges` and `deleted_ranges` are the runs of line
+        numbers added/deleted by the diff.  `changed_ranges` and
+        `deleted_ranges` refer to the file before the diff;
+        `added_ranges` refers to the file after the diff.
+
+        Runs in linear time in the number of runs (after sorting),
+        because every list is walked once in ascending order.
+        """
+        changed_ranges = cls._unique_ordered_ranges(changed_ranges)
+        added_ranges = cls._unique_ordered_ranges(added_ranges)
+        deleted_ranges = cls._unique_ordered_ranges(deleted_ranges)
+
+        num_added = len(added_ranges)
+        num_deleted = len(deleted_ranges)
+
+        # Number of added/deleted runs we've walked past,
+        # and the number of lines in them
+        added_index = 0
+        deleted_index = 0
+        added_before = 0
+        deleted_before = 0
+
+        shifted_ranges = []
+
+        for (start, end) in changed_ranges:
+            while start <= end:
+
+                # Skip over the runs deleted before this line
+                while (deleted_index < num_deleted and
+                       deleted_ranges[deleted_index][1] < start):
+                    (deleted_start, deleted_end) = \
+                        deleted_ranges[deleted_index]
+                    deleted_before += deleted_end - deleted_start + 1
+                    deleted_index += 1
+
+                # If this line was deleted, drop the rest of the
+                # deleted run
+                if (deleted_index < num_deleted and
+                        deleted_ranges[deleted_index][0] <= start):
+                    start = deleted_ranges[deleted_index][1] + 1
+                    continue
+
+                # Otherwise, the lines up to the next deleted run
+                # survive the diff
+                survived_end = end
+                if deleted_index < num_deleted:
+                    survived_end = min(
+                        end, deleted_ranges[deleted_index][0] - 1
+                    )
+
+                # The lines that were not deleted keep their order
+                # in the new file, where they fill the positions
+                # not taken by added lines.  These lines are the
+                # `first`-th to `last`-th such lines.
+                first = start - deleted_before
+                last = survived_end - deleted_before
+
+                while first <= last:
+                    while (added_index < num_added and
+                           added_ranges[added_index][0] <=
+                           first + added_before):
+                        (added_start, added_end) = added_ranges[added_index]
+                        added_before += added_end - added_start + 1
+                        added_index += 1
+
+                    # Shift the lines until the next added run
+                    new_start = first + added_before
+                    new_end = last + added_before
+                    if added_index < num_added:
+                        new_end = min(
+                            new_end, added_ranges[added_index][0] - 1
+                        )
+
+                    shifted_ranges.append((new_start, new_end))
+                    first += new_end - new_start + 1
+
+                start = survived_end + 1
+
+        # The shifted and added runs are disjoint,
+        # so merge them in order
+        return cls._unique_ordered_ranges(shifted_ranges + added_ranges)
 
     # Regular expressions used to parse the diff output
     SRC_FILE_RE = re.compile(r'^diff --git "?a/.*"? "?b/([^ \n"]*)"?')
     MERGE_CONFLICT_RE = re.compile(r'^diff --cc ([^ \n]*)')
     HUNK_LINE_RE = re.compile(r'\+([0-9]*)')
+    HUNK_OLD_LINE_RE = re.compile(r'-([0-9]+)')
 
     def _parse_diff_str(self, diff_str):
         """
         Parse the output of `git diff` into a dictionary of the form:
 
-            { SRC_PATH: (ADDED_LINES, DELETED_LINES) }
+            { SRC_PATH: (ADDED_RANGES, DELETED_RANGES) }
 
-        where `ADDED_LINES` and `DELETED_LINES` are lists of line
-        numbers added/deleted respectively.
+        where `ADDED_RANGES` and `DELETED_RANGES` are lists of
+        `(start, end)` runs of line numbers added/deleted
+        respectively, in the order they appear in the diff.
+
+        `diff_str` is either the output as a string or an iterable
+        of output lines.  The output is parsed in a single pass
+        that records only runs of line numbers, so it can be streamed
+        from `git diff` without holding the hunk text in memory.
 
         If the output could not be parsed, raises a GitDiffError.
         """
+        if isinstance(diff_str, basestring):
+            diff_str = diff_str.split('\n')
 
         # Create a dict to hold results
         diff_dict = dict()
 
-        # Parse the diff string into sections by source file
-        sections_dict = self._parse_source_sections(diff_str)
-        for (src_path, diff_lines) in sections_dict.items():
-
-            # Parse the hunk information for the source file
-            # to determine lines changed for the source file
-            diff_dict[src_path] = self._parse_lines(diff_lines)
-
-        return diff_dict
-
-    def _parse_source_sections(self, diff_str):
-        """
-        Given the output of `git diff`, return a dictionary
-        with keys that are source file paths.
-
-        Each value is a list of lines from the `git diff` output
-        related to the source file.
-
-        Raises a `GitDiffError` if `diff_str` is in an invalid format.
-        """
-
-        # Create a dict to map source files to lines in the diff output
-        source_dict = dict()
-
         # Keep track of the current source file
         src_path = None
+        added_ranges, deleted_ranges = None, None
 
         # Signal that we've found a hunk (after starting a source file)
         found_hunk = False
 
-        # Parse the diff string into sections by source file
-        for line in diff_str.split('\n'):
+        # Line numbers in the new and old versions of the source file
+        current_line_new = None
+        current_line_old = None
+
+        # Line numbers that the current runs of added and deleted
+        # lines started at, or `None` outside such a run
+        added_start = None
+        deleted_start = None
+
+        for line in diff_str:
 
             # If the line starts with "diff --git"
             # or "diff --cc" (in the case of a merge conflict)
             # then it is the start of a new source file
             if line.startswith('diff --git') or line.startswith('diff --cc'):
 
+                # End the runs in the last source file
+                added_start = self._end_run(
+                    added_ranges, added_start, current_line_new
+                )
+                deleted_start = self._end_run(
+                    deleted_ranges, deleted_start, current_line_old
+                )
+
                 # Retrieve the name of the source file
                 src_path = self._parse_source_line(line)
 
                 # Create an entry for the source file, if we don't
                 # already have one.
-                if src_path not in source_dict:
-                    source_dict[src_path] = []
+                added_ranges, deleted_ranges = diff_dict.setdefault(
+                    src_path, ([], [])
+                )
 
                 # Signal that we're waiting for a hunk for this source file
                 found_hunk = False
+                current_line_new, current_line_old = None, None
 
-            # Every other line is stored in the dictionary for this source file
-            # once we find a hunk section
-            else:
-
-                # Only add lines if we're in a hunk section
-                # (ignore index and files changed lines)
-                if found_hunk or line.startswith('@@'):
-
-                    # Remember that we found a hunk
-                    found_hunk = True
-
-                    if src_path is not None:
-                        source_dict[src_path].append(line)
-
-                    else:
-                        # We tolerate other information before we have
-                        # a source file defined, unless it's a hunk line
-                        if line.startswith("@@"):
-                            msg = "Hunk has no source file: '{0}'".format(line)
-                            raise GitDiffError(msg)
+            # Only parse lines if we're in a hunk section
+            # (ignore index and files changed lines)
+            elif found_hunk or line.startswith('@@'):
 
-        return source_dict
+                # Remember that we found a hunk
+                found_hunk = True
 
-    def _parse_lines(self, diff_lines):
-        """
-        Given the diff lines output from `git diff` for a particular
-        source file, return a tuple of `(ADDED_LINES, DELETED_LINES)`
-
-        where `ADDED_LINES` and `DELETED_LINES` are lists of line
-        numbers added/deleted respectively.
-
-        Raises a `GitDiffError` if the diff lines are in an invalid format.
-        """
+                if src_path is None:
 
-        added_lines = []
-        deleted_lines = []
-
-        current_line_new = None
-        current_line_old = None
+                    # We tolerate other information before we have
+                    # a source file defined, unless it's a hunk line
+                    if line.startswith("@@"):
+                        msg = "Hunk has no source file: '{0}'".format(line)
+                        raise GitDiffError(msg)
 
-        for line in diff_lines:
+                # If this is the start of the hunk definition, retrieve
+                # the starting line number
+                elif line.startswith('@@'):
 
-            # If this is the start of the hunk definition, retrieve
-            # the starting line number
-            if line.startswith('@@'):
-                line_num = self._parse_hunk_line(line)
-                current_line_new, current_line_old = line_num, line_num
+                    # End the runs in the last hunk
+                    added_start = self._end_run(
+                        added_ranges, added_start, current_line_new
+                    )
+                    deleted_start = self._end_run(
+                        deleted_ranges, deleted_start, current_line_old
+                    )
 
-            # This is an added/modified line, so store the line number
-            elif line.startswith('+'):
+                    current_line_new = self._parse_hunk_line(line)
+                    current_line_old = self._parse_hunk_old_line(line)
 
-                # Since we parse for source file sections before
-                # calling this method, we're guaranteed to have a source
-                # file specified.  We check anyway just to be safe.
-                if current_line_new is not None:
+                    # If we can't tell where the hunk started in the
+                    # old version, assume it started at the same line
+                    if current_line_old is None:
+                        current_line_old = current_line_new
 
-                    # Store the added line
-                    added_lines.append(current_line_new)
+                # This is an added/modified line, so start a run
+                # of added lines unless we're already in one
+                elif line.startswith('+'):
+                    if added_start is None:
+                        added_start = current_line_new
 
                     # Increment the line number in the file
                     current_line_new += 1
 
-            # This is a deleted line that does not exist in the final
-            # version, so skip it
-            elif line.startswith('-'):
-
-                # Since we parse for source file sections before
-                # calling this method, we're guaranteed to have a source
-                # file specified.  We check anyway just to be safe.
-                if current_line_old is not None:
-
-                    # Store the deleted line
-                    deleted_lines.append(current_line_old)
+                # This is a deleted line that does not exist in the final
+                # version, so start a run of deleted lines (numbered
+                # in the old version) unless we're already in one
+                elif line.startswith('-'):
+                    if deleted_start is None:
+                        deleted_start = current_line_old
 
                     # Increment the line number in the file
                     current_line_old += 1
 
-            # This is a line in the final version that was not modified.
-            # Increment the line number, but do not store this as a changed
-            # line.
-            else:
-                if current_line_old is not None:
-                    current_line_old += 1
+                # This is a line in the final version that was not
+                # modified.  End any runs of changed lines and
+                # increment the line number.
+                else:
+                    if added_start is not None:
+                        added_ranges.append(
+                            (added_start, current_line_new - 1)
+                        )
+                        added_start = None
+
+                    if deleted_start is not None:
+                        deleted_ranges.append(
+                            (deleted_start, current_line_old - 1)
+                        )
+                        deleted_start = None
 
-                if current_line_new is not None:
+                    current_line_old += 1
                     current_line_new += 1
 
-                # If we are not in a hunk, then ignore the line
-                else:
-                    pass
+        # End the runs in the last source file
+        self._end_run(added_ranges, added_start, current_line_new)
+        self._end_run(deleted_ranges, deleted_start, current_line_old)
+
+        return diff_dict
+
+    @staticmethod
+    def _end_run(line_ranges, run_start, next_line):
+        """
+        If a run of changed lines started at line `run_start`,
+        append the run (which ends before `next_line`) to
+        `line_ranges`.
+
+        Returns `None`, the start of the run after this one.
+        """
+        if run_start is not None:
+            line_ranges.append((run_start, next_line - 1))
 
-        return added_lines, deleted_lines
+        return None
 
     def _parse_source_line(self, line):
         """
@@ -377,18 +596,44 @@ class GitDiffReporter(BaseDiffReporter):
             msg = "Could not parse hunk in line '{0}'".format(line)
             raise GitDiffError(msg)
 
+    def _parse_hunk_old_line(self, line):
+        """
+        Given a hunk line in `git diff` output, return the line number
+        at the start of the hunk in the version before the changes.
+        (See `_parse_hunk_line()` for the format of the hunk line.)
+
+        Returns `None` if the start line could not be determined,
+        for example in the combined diff of a merge conflict,
+        which has more than one "before" version.
+        """
+        components = line.split('@@')
+
+        if len(components) >= 2:
+            groups = self.HUNK_OLD_LINE_RE.findall(components[1])
+
+            if len(groups) == 1:
+                return int(groups[0])
+
+        return None
+
     @staticmethod
-    def _unique_ordered_lines(line_numbers):
+    def _unique_ordered_ranges(line_ranges):
         """
-        Given a list of line numbers, return a list in which each line
-        number is included once and the lines are ordered sequentially.
+        Given a list of `(start, end)` runs of line numbers, return
+        a list of `(start, end)` tuples covering the same lines, in
+        which the runs are ordered and do not overlap or touch.
         """
+        ranges = []
+
+        for (start, end) in sorted(line_ranges):
 
-        if len(line_numbers) == 0:
-            return []
+            # If this run overlaps or continues the last run, extend it
+            if ranges and ranges[-1][1] >= start - 1:
+                if end > ranges[-1][1]:
+                    ranges[-1] = (ranges[-1][0], end)
 
-        # Ensure lines are unique by putting them in a set
-        line_set = set(line_numbers)
+            # Otherwise, start a new run
+            else:
+                ranges.append((start, end))
 
-        # Retrieve the list from the set, sort it, and return
-        return sorted([line for line in line_set])
+        return ranges
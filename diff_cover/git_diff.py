@@ -1,7 +1,10 @@
 """
 Wrapper for `git diff` command.
 """
+import Queue
 import subprocess
+import threading
+from diff_cover import instrumentation
 
 
 class GitDiffError(Exception):
@@ -11,11 +14,121 @@ class GitDiffError(Exception):
     pass
 
 
+class GitDiffOutput(object):
+    """
+    Iterable over the lines (without line endings) that
+    a `git diff` process outputs to stdout.
+
+    Iterating raises a `GitDiffError` once stdout is exhausted
+    if the process output anything to stderr.  Call `close()` to
+    stop the process if the output won't be read to the end.
+    """
+
+    # Maximum number of lines read from the process
+    # ahead of the caller
+    MAX_READ_AHEAD_LINES = 10000
+
+    def __init__(self, process, read_ahead=False):
+        """
+        Read the output of `process` (a `subprocess.Popen`).
+
+        If `read_ahead` is True, read stdout on its own thread
+        (up to `MAX_READ_AHEAD_LINES` ahead of the caller), so
+        that the process keeps running while the caller reads
+        the output of another process.  Otherwise, stdout is
+        read only as the caller iterates.
+        """
+        self._process = process
+        self._finished = False
+        self._stderr_output = []
+
+        # Always read stderr on its own thread, so that the process
+        # never blocks on a full stderr pipe while we read stdout
+        self._threads = [threading.Thread(target=self._read_stderr)]
+
+        if read_ahead:
+            self._lines = Queue.Queue(maxsize=self.MAX_READ_AHEAD_LINES)
+            self._threads.append(threading.Thread(target=self._read_ahead))
+        else:
+            self._lines = None
+
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def __iter__(self):
+        try:
+            if self._lines is None:
+                for line in self._process.stdout:
+                    yield line.rstrip('\n')
+            else:
+                for line in iter(self._lines.get, None):
+                    yield line
+
+            self._finished = True
+
+        finally:
+            self.close()
+
+        # If we get a non-empty output to stderr, raise an exception
+        stderr = ''.join(self._stderr_output)
+        if bool(stderr):
+            raise GitDiffError(stderr)
+
+    def close(self):
+        """
+        Stop the process if its output hasn't been read to the end,
+        and wait for it to exit.
+        """
+        if not self._finished:
+            self._finished = True
+
+            try:
+                self._process.kill()
+            except OSError:
+                pass
+
+            # Let the read-ahead thread reach the end of the output
+            if self._lines is not None:
+                for _ in iter(self._lines.get, None):
+                    pass
+
+        for thread in self._threads:
+            thread.join()
+
+        self._process.wait()
+
+    def _read_stderr(self):
+        """
+        Read everything the process outputs to stderr.
+        """
+        self._stderr_output.append(self._process.stderr.read())
+
+    def _read_ahead(self):
+        """
+        Put each line the process outputs to stdout (without
+        its line ending) into the queue, followed by `None`.
+        """
+        try:
+            for line in self._process.stdout:
+                self._lines.put(line.rstrip('\n'))
+        finally:
+            self._lines.put(None)
+
+
 class GitDiffTool(object):
     """
     Thin wrapper for a subset of the `git diff` command.
     """
 
+    COMMITTED_COMMAND = [
+        'git', 'diff',
+        'origin/master...HEAD', '--no-ext-diff'
+    ]
+    STAGED_COMMAND = ['git', 'diff', '--cached', '--no-ext-diff']
+    UNSTAGED_COMMAND = ['git', 'diff', '--no-ext-diff']
+    MERGE_BASE_COMMAND = ['git', 'merge-base', 'origin/master', 'HEAD']
+
     def __init__(self, subprocess_mod=subprocess):
         """
         Initialize the wrapper to use `subprocess_mod` to
@@ -31,10 +144,7 @@ class GitDiffTool(object):
         Raises a `GitDiffError` if `git diff` outputs anything
         to stderr.
         """
-        return self._execute([
-            'git', 'diff',
-            'origin/master...HEAD', '--no-ext-diff'
-        ])
+        return self._execute(self.COMMITTED_COMMAND)
 
     def diff_unstaged(self):
         """
@@ -44,7 +154,7 @@ class GitDiffTool(object):
         Raises a `GitDiffError` if `git diff` outputs anything
         to stderr.
         """
-        return self._execute(['git', 'diff', '--no-ext-diff'])
+        return self._execute(self.UNSTAGED_COMMAND)
 
     def diff_staged(self):
         """
@@ -54,7 +164,52 @@ class GitDiffTool(object):
         Raises a `GitDiffError` if `git diff` outputs anything
         to stderr.
         """
-        return self._execute(['git', 'diff', '--cached', '--no-ext-diff'])
+        return self._execute(self.STAGED_COMMAND)
+
+    def diff_all(self):
+        """
+        Returns a list containing the output of `diff_committed()`,
+        `diff_staged()`, and `diff_unstaged()`, in that order.
+
+        Each output is a `GitDiffOutput` over the lines of the diff.
+
+        The three `git diff` commands run concurrently, since none
+        of them depends on the others: the staged and unstaged
+        outputs are read ahead on their own threads while the
+        caller reads the committed output.
+
+        Raises a `GitDiffError` while iterating over an output
+        if that `git diff` outputs anything to stderr.
+        """
+        processes = [
+            self._start(command)
+            for command in [
+                self.COMMITTED_COMMAND,
+                self.STAGED_COMMAND,
+                self.UNSTAGED_COMMAND
+            ]
+        ]
+        return [
+            GitDiffOutput(process, read_ahead=(index > 0))
+            for index, process in enumerate(processes)
+        ]
+
+    def diff_merge_base(self):
+        """
+        Returns the output of `git diff` between the working tree
+        and the merge-base of origin/master and HEAD, as a
+        `GitDiffOutput` over the lines of the diff.
+
+        This single diff covers the committed, staged,
+        and unstaged changes.
+
+        Raises a `GitDiffError` if `git merge-base` or `git diff`
+        outputs anything to stderr.
+        """
+        merge_base = self._execute(self.MERGE_BASE_COMMAND).strip()
+        return GitDiffOutput(
+            self._start(['git', 'diff', merge_base, '--no-ext-diff'])
+        )
 
     def _execute(self, command):
         """
@@ -64,15 +219,23 @@ class GitDiffTool(object):
         Raises a `GitDiffError` if `git diff` outputs anything
         to stderr.
         """
-        stdout_pipe = self._subprocess.PIPE
-        process = self._subprocess.Popen(
-            command, stdout=stdout_pipe,
-            stderr=stdout_pipe
-        )
-        stdout, stderr = process.communicate()
+        stdout, stderr = self._start(command).communicate()
 
         # If we get a non-empty output to stderr, raise an exception
         if bool(stderr):
             raise GitDiffError(stderr)
 
         return stdout
+
+    def _start(self, command):
+        """
+        Start a process to execute `command` (list of
+        command components) and return the process.
+        """
+        instrumentation.count('git processes')
+
+        stdout_pipe = self._subprocess.PIPE
+        return self._subprocess.Popen(
+            command, stdout=stdout_pipe,
+            stderr=stdout_pipe
+        )
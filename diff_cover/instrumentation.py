@@ -0,0 +1,320 @@
+"""
+Hooks for measuring where the tool spends its time.
+
+Code that does significant work wraps it in a stage:
+
+    with instrumentation.stage('git diff'):
+        ...
+
+and counts what it processes:
+
+    instrumentation.count('files in diff', len(src_paths))
+
+These events are passed on to each registered observer, for example:
+
+    class MetricsObserver(instrumentation.Observer):
+
+        def stage_end(self, name):
+            ...
+
+    instrumentation.register(MetricsObserver())
+
+Unless an observer has been registered, the hooks do (almost) nothing.
+"""
+import json
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# The registered observers.  This is replaced rather than
+# modified, so it can be read safely from other threads.
+_OBSERVERS = ()
+
+
+def register(observer):
+    """
+    Start passing stage and counter events to `observer`,
+    an instance of `Observer`.
+    """
+    global _OBSERVERS
+    _OBSERVERS = _OBSERVERS + (observer,)
+
+
+def unregister(observer):
+    """
+    Stop passing events to `observer`.  Does nothing
+    if `observer` is not registered.
+    """
+    global _OBSERVERS
+    _OBSERVERS = tuple(
+        registered for registered in _OBSERVERS
+        if registered is not observer
+    )
+
+
+def stage(name):
+    """
+    Return a context manager that tells each observer when
+    the stage called `name` starts and ends.
+    """
+    if not _OBSERVERS:
+        return _NULL_STAGE
+
+    return _Stage(_OBSERVERS, name)
+
+
+def count(name, amount=1):
+    """
+    Tell each observer to add `amount` to the counter called `name`.
+    """
+    for observer in _OBSERVERS:
+        observer.count(name, amount)
+
+
+class Observer(object):
+    """
+    Receives stage and counter events.  Subclasses
+    override the events they are interested in.
+
+    Stages can be nested, and can run at the same time in different
+    threads; `stage_end()` is called in the thread that called
+    `stage_start()`, even if the stage raised an exception.
+    """
+
+    def stage_start(self, name):
+        """
+        Called when the stage called `name` starts.
+        """
+        pass
+
+    def stage_end(self, name):
+        """
+        Called when the stage called `name` ends.
+        """
+        pass
+
+    def count(self, name, amount):
+        """
+        Called to add `amount` to the counter called `name`.
+        """
+        pass
+
+
+class _NullStage(object):
+    """
+    A stage that does nothing, used when there are no observers.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage(object):
+    """
+    Tell `observers` when the context starts and ends.
+    """
+
+    def __init__(self, observers, name):
+        self._observers = observers
+        self._name = name
+
+    def __enter__(self):
+        for observer in self._observers:
+            observer.stage_start(self._name)
+        return self
+
+    def __exit__(self, *exc_info):
+
+        # End the stage in the reverse order we started it,
+        # so each observer's measurement is nested in the last one's
+        for observer in reversed(self._observers):
+            observer.stage_end(self._name)
+        return False
+
+
+def _measure():
+    """
+    Return a tuple `(wall_time, cpu_time, peak_rss)`, where the times
+    are in seconds and `peak_rss` is the largest resident set size of
+    the process so far in bytes (or `None` if it is not available).
+
+    The CPU time includes child processes that have finished
+    (for example, git and quality tool subprocesses).
+    """
+    if resource is None:
+        return (time.time(), time.clock(), None)
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    child_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    cpu_time = (
+        usage.ru_utime + usage.ru_stime +
+        child_usage.ru_utime + child_usage.ru_stime
+    )
+
+    # Linux reports the peak RSS in kilobytes, OS X in bytes
+    peak_rss = usage.ru_maxrss
+    if sys.platform != 'darwin':
+        peak_rss *= 1024
+
+    return (time.time(), cpu_time, peak_rss)
+
+
+class Profiler(Observer):
+    """
+    Collect the time and memory used by each stage,
+    and the value of each counter.
+
+    The memory used by a stage is how much it raised the peak
+    resident set size (RSS) of the process, so a stage that only
+    reuses memory freed by earlier stages shows no growth.
+    """
+
+    def __init__(self):
+        # Stage and counter names, in the order they first appeared
+        self._stage_names = []
+        self._counter_names = []
+
+        self._stages = dict()
+        self._counters = dict()
+
+        # Map `(name, thread)` to a stack of measurements
+        # taken when the stages that are still running started
+        self._starts = dict()
+        self._lock = threading.Lock()
+
+    def stage_start(self, name):
+        """
+        Take a measurement at the start of the stage called `name`.
+        """
+        key = (name, threading.current_thread())
+
+        with self._lock:
+
+            # Report stages in the order they started, not finished
+            if name not in self._stages:
+                self._stage_names.append(name)
+                self._stages[name] = {
+                    'calls': 0, 'wall_time': 0.0,
+                    'cpu_time': 0.0, 'rss_growth': None
+                }
+
+            self._starts.setdefault(key, []).append(_measure())
+
+    def stage_end(self, name):
+        """
+        Record a run of the stage called `name`.
+
+        If a stage runs more than once, its times
+        and RSS growth are added up.
+        """
+        end = _measure()
+        key = (name, threading.current_thread())
+
+        with self._lock:
+            starts = self._starts[key]
+            start = starts.pop()
+
+            if not starts:
+                del self._starts[key]
+
+            stats = self._stages[name]
+
+            start_wall, start_cpu, start_rss = start
+            end_wall, end_cpu, end_rss = end
+
+            stats['calls'] += 1
+            stats['wall_time'] += end_wall - start_wall
+            stats['cpu_time'] += end_cpu - start_cpu
+
+            if start_rss is not None and end_rss is not None:
+                stats['rss_growth'] = (
+                    (stats['rss_growth'] or 0) + end_rss - start_rss
+                )
+
+    def count(self, name, amount):
+        """
+        Add `amount` to the counter called `name`.
+        """
+        with self._lock:
+            if name not in self._counters:
+                self._counter_names.append(name)
+                self._counters[name] = 0
+
+            self._counters[name] += amount
+
+    def stats(self):
+        """
+        Return a dict of the form:
+
+            {
+                'stages': [
+                    {'name': NAME, 'calls': CALLS,
+                     'wall_time': WALL_TIME, 'cpu_time': CPU_TIME,
+                     'rss_growth': None | RSS_GROWTH}, ...
+                ],
+                'counters': {NAME: VALUE, ...}
+            }
+
+        where the stages are in the order they first ran, times are
+        in seconds, and `RSS_GROWTH` is how much the stage raised the
+        peak RSS of the process, in bytes.
+        """
+        stages = []
+        for name in self._stage_names:
+            stage_stats = dict(self._stages[name])
+            stage_stats['name'] = name
+            stages.append(stage_stats)
+
+        return {'stages': stages, 'counters': dict(self._counters)}
+
+    def write_json(self, output_file):
+        """
+        Write the stats (see `stats()`) to `output_file` as JSON.
+        """
+        json.dump(self.stats(), output_file, indent=4, sort_keys=True)
+
+    def write_report(self, output_file):
+        """
+        Write a table of the stats to `output_file`.
+        """
+        output_file.write("{0:<24} {1:>6} {2:>10} {3:>10} {4:>16}\n".format(
+            "Stage", "Calls", "Wall (s)", "CPU (s)", "RSS growth (MB)"
+        ))
+
+        for name in self._stage_names:
+            stats = self._stages[name]
+
+            if stats['rss_growth'] is None:
+                rss_growth = "-"
+            else:
+                rss_growth = "{0:.1f}".format(
+                    stats['rss_growth'] / 1024.0 ** 2
+                )
+
+            output_file.write(
+                "{0:<24} {1:>6} {2:>10.3f} {3:>10.3f} {4:>16}\n".format(
+                    name, stats['calls'], stats['wall_time'],
+                    stats['cpu_time'], rss_growth
+                )
+            )
+
+        if self._counter_names:
+            output_file.write("\n{0:<24} {1:>10}\n".format("Counter", "Count"))
+
+            for name in self._counter_names:
+                output_file.write("{0:<24} {1:>10}\n".format(
+                    name, self._counters[name]
+                ))
@@ -3,33 +3,54 @@ Classes for generating diff coverage reports.
 """
 
 from abc import ABCMeta, abstractmethod
-from jinja2 import Environment, PackageLoader
+from bisect import bisect_right
+from itertools import imap
+import os.path
 from lazy import lazy
-from diff_cover.snippets import Snippet
+from diff_cover import instrumentation
 
 
 class DiffViolations(object):
     """
     Class to capture violations generated by a particular diff
     """
-    def __init__(self, violations, measured_lines, diff_lines):
-        self.lines = set(
-            violation.line for violation in violations
-        ).intersection(diff_lines)
+    def __init__(self, violations, measured_lines, diff_ranges):
+        """
+        `diff_ranges` is a list of `(start, end)` tuples
+        representing the runs of lines changed in the diff,
+        as returned by `BaseDiffReporter.line_ranges()`.
+        """
+        self._diff_ranges = diff_ranges
+        self._range_starts = [start for (start, _) in diff_ranges]
 
         self.violations = set(
             violation for violation in violations
-            if violation.line in self.lines
+            if self._in_diff(violation.line)
         )
 
+        self.lines = set(violation.line for violation in self.violations)
+
         # By convention, a violation reporter
         # can return `None` to indicate that all lines are "measured"
         # by default.  This is an optimization to avoid counting
         # lines in all the source files.
         if measured_lines is None:
-            self.measured_lines = set(diff_lines)
+            self.measured_lines = set(
+                line
+                for (start, end) in diff_ranges
+                for line in xrange(start, end + 1)
+            )
         else:
-            self.measured_lines = set(measured_lines).intersection(diff_lines)
+            self.measured_lines = set(
+                line for line in measured_lines if self._in_diff(line)
+            )
+
+    def _in_diff(self, line):
+        """
+        Return True if `line` is in one of the diff ranges.
+        """
+        index = bisect_right(self._range_starts, line) - 1
+        return index >= 0 and line <= self._diff_ranges[index][1]
 
 
 class BaseReportGenerator(object):
@@ -169,17 +190,40 @@ class BaseReportGenerator(object):
                 src_path, DiffViolations(
                     self._violations.violations(src_path),
                     self._violations.measured_lines(src_path),
-                    self._diff.lines_changed(src_path),
+                    self._diff.line_ranges(src_path),
                 )
             ) for src_path in self._diff.src_paths_changed()
         )
 
 
-# Set up the template environment
-TEMPLATE_LOADER = PackageLoader(__package__)
-TEMPLATE_ENV = Environment(loader=TEMPLATE_LOADER,
-                           trim_blocks=True,
-                           lstrip_blocks=True)
+# Directory holding the report templates.  This is resolved when
+# the module is imported, since `__file__` may be a relative path
+# and the working directory can change before we render a report.
+_TEMPLATE_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'templates'
+)
+
+# The template environment, set up the first time we render
+# a report, so that importing this module doesn't load Jinja2
+_TEMPLATE_ENV = None
+
+
+def template_env():
+    """
+    Return the Jinja2 environment used to load report templates.
+    """
+    global _TEMPLATE_ENV
+
+    if _TEMPLATE_ENV is None:
+        from jinja2 import Environment, FileSystemLoader
+
+        # Load templates from the package directory
+        # (`PackageLoader` would import the slow `pkg_resources`)
+        _TEMPLATE_ENV = Environment(loader=FileSystemLoader(_TEMPLATE_DIR),
+                                    trim_blocks=True,
+                                    lstrip_blocks=True)
+
+    return _TEMPLATE_ENV
 
 
 class TemplateReportGenerator(BaseReportGenerator):
@@ -195,6 +239,23 @@ class TemplateReportGenerator(BaseReportGenerator):
     # that they want to include source file snippets.
     INCLUDE_SNIPPETS = False
 
+    def __init__(self, violations_reporter, diff_reporter, jobs=1,
+                 snippet_cache=None):
+        """
+        See base class.
+
+        `jobs` is the number of processes to use to render
+        source file snippets.
+
+        `snippet_cache` is an optional `DiskCache` used to store
+        rendered snippets across runs.
+        """
+        super(TemplateReportGenerator, self).__init__(
+            violations_reporter, diff_reporter
+        )
+        self._jobs = max(1, jobs)
+        self._snippet_cache = snippet_cache
+
     def generate_report(self, output_file):
         """
         See base class.
@@ -202,15 +263,19 @@ class TemplateReportGenerator(BaseReportGenerator):
 
         if self.TEMPLATE_NAME is not None:
 
-            # Find the template
-            template = TEMPLATE_ENV.get_template(self.TEMPLATE_NAME)
+            context = self._context()
+
+            with instrumentation.stage('render template'):
 
-            # Render the template
-            report = template.render(self._context())
+                # Find the template
+                template = template_env().get_template(self.TEMPLATE_NAME)
 
-            # Write the report to the output file
-            # (encode to a byte string)
-            output_file.write(report.encode('utf-8'))
+                # Render the template a piece at a time, encoding
+                # each piece to a byte string as we write it to the
+                # output file, so we never hold the whole report in memory.
+                # Source snippets are rendered as the template reaches
+                # them, so we only hold a few files' snippets at once.
+                template.stream(context).dump(output_file, 'utf-8')
 
     def _context(self):
         """
@@ -225,20 +290,27 @@ class TemplateReportGenerator(BaseReportGenerator):
                             'percent_covered': PERCENT_COVERED,
                             'violation_lines': [LINE_NUM, ...]
                             }, ... }
+            'src_snippets': ITERATOR,
             'total_num_lines': TOTAL_NUM_LINES,
             'total_num_violations': TOTAL_NUM_VIOLATIONS,
             'total_percent_covered': TOTAL_PERCENT_COVERED
         }
+
+        where `ITERATOR` yields `(SRC_PATH, [SNIPPET_HTML, ...])`
+        tuples in order of `SRC_PATH`, rendering the snippets
+        as they are needed (see `_iter_snippets()`).
         """
 
         # Calculate the information to pass to the template
+        src_paths = sorted(self.src_paths())
         src_stats = dict(
-            (src, self._src_path_stats(src)) for src in self.src_paths()
+            (src, self._src_path_stats(src)) for src in src_paths
         )
 
         # Include snippet style info if we're displaying
         # source code snippets
         if self.INCLUDE_SNIPPETS:
+            from diff_cover.snippets import Snippet
             snippet_style = Snippet.style_defs()
         else:
             snippet_style = None
@@ -247,12 +319,70 @@ class TemplateReportGenerator(BaseReportGenerator):
             'report_name': self.coverage_report_name(),
             'diff_name': self.diff_report_name(),
             'src_stats': src_stats,
+            'src_snippets': self._iter_snippets(src_paths),
             'total_num_lines': self.total_num_lines(),
             'total_num_violations': self.total_num_violations(),
             'total_percent_covered': self.total_percent_covered(),
             'snippet_style': snippet_style
         }
 
+    def _iter_snippets(self, src_paths):
+        """
+        Yield `(src_path, snippets)` for each path in `src_paths`,
+        in the same order, where `snippets` is the list of HTML
+        source snippets to show for the file.
+
+        Snippets are rendered as they are requested, so only the
+        snippets for the current file (and those rendered ahead
+        by worker processes) are held in memory.
+
+        If the report doesn't display snippets, yields nothing.
+        """
+        if not self.INCLUDE_SNIPPETS:
+            return
+
+        snippet_args = [
+            (src_path, self.violation_lines(src_path), self._snippet_cache)
+            for src_path in src_paths
+        ]
+
+        # Lexing and formatting happen in Python,
+        # so use processes to spread them across CPUs.
+        if self._jobs > 1 and len(snippet_args) > 1:
+            import multiprocessing
+            pool = multiprocessing.Pool(min(self._jobs, len(snippet_args)))
+        else:
+            pool = None
+
+        try:
+            if pool is not None:
+                results = pool.imap(_load_snippets_html, snippet_args)
+            else:
+                results = imap(_load_snippets_html, snippet_args)
+
+            for src_path in src_paths:
+                with instrumentation.stage('render snippets'):
+                    snippets = next(results)
+
+                instrumentation.count('snippets rendered', len(snippets))
+                yield (src_path, snippets)
+
+        # Stop the workers if rendering fails, or if the
+        # template stops asking for snippets
+        except:
+            if pool is not None:
+                pool.terminate()
+            raise
+        else:
+            if pool is not None:
+                pool.close()
+        finally:
+            if pool is not None:
+                pool.join()
+
+        if self._snippet_cache is not None:
+            self._snippet_cache.evict()
+
     def _src_path_stats(self, src_path):
         """
         Return a dict of statistics for the source file at `src_path`.
@@ -262,24 +392,33 @@ class TemplateReportGenerator(BaseReportGenerator):
         violation_lines = self.violation_lines(src_path)
         violations = sorted(self._diff_violations[src_path].violations)
 
-        # Load source snippets (if the report will display them)
-        # If we cannot load the file, then fail gracefully
-        if self.INCLUDE_SNIPPETS:
-            try:
-                snippets = Snippet.load_snippets_html(src_path, violation_lines)
-            except IOError:
-                snippets = []
-        else:
-            snippets = []
-
         return {
             'percent_covered': self.percent_covered(src_path),
             'violation_lines': [str(line) for line in violation_lines],
-            'violations': violations,
-            'snippets_html': snippets
+            'violations': violations
         }
 
 
+def _load_snippets_html(snippet_args):
+    """
+    Return a list of HTML snippets for the
+    `(src_path, violation_lines, cache)` tuple `snippet_args`
+    (see `Snippet.load_snippets_html()`).
+    If we cannot load the file, then fail gracefully
+    and return an empty list.
+
+    This is a module-level function so that it can
+    run in a `multiprocessing.Pool`.
+    """
+    from diff_cover.snippets import Snippet
+    src_path, violation_lines, cache = snippet_args
+
+    try:
+        return Snippet.load_snippets_html(src_path, violation_lines, cache)
+    except IOError:
+        return []
+
+
 class StringReportGenerator(TemplateReportGenerator):
     """
     Generate a string diff coverage report.
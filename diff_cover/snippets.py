@@ -3,10 +3,16 @@ Load snippets from source files to show violation lines
 in HTML reports.
 """
 
+import fnmatch
+import os.path
+import re
 import pygments
-from pygments.lexers import TextLexer, guess_lexer_for_filename
+from pygments.lexers import TextLexer, find_lexer_class, get_all_lexers, \
+    get_lexer_by_name
 from pygments.formatters import HtmlFormatter
 from pygments.util import ClassNotFound
+from diff_cover import instrumentation
+from diff_cover.cache import DiskCache
 
 
 class Snippet(object):
@@ -26,6 +32,55 @@ class Snippet(object):
     # should split into two snippets.
     MAX_GAP_IN_SNIPPET = 4
 
+    # Aliases of lexers that can start lexing on any unindented
+    # line outside a multi-line string.  For these, we only lex
+    # the lines around each snippet instead of the whole file.
+    WINDOWED_LEXERS = ['python', 'python3', 'text']
+
+    # Maximum number of lines before (and after) a snippet to lex,
+    # when looking for an unindented line to start (and end) at
+    LEXER_LOOKBACK_LINES = 50
+
+    # Map of filename patterns (for example, `'*.inc'`) to the names
+    # of the lexers to use for files matching them, overriding the
+    # lexer chosen from the file name.
+    LEXER_OVERRIDES = {}
+
+    # Aliases of the lexers to prefer, in order, when the patterns
+    # of several lexers handle a file name (for example, C and
+    # Objective-C both handle `*.h`)
+    PREFERRED_LEXERS = ['text', 'c', 'cpp', 'objective-c', 'perl', 'xslt']
+
+    # Comments and the quotes that start strings in Python source
+    # (group 1 is the quote), and the rest of a string after each
+    # quote, up to and including the closing quote.  Backslashes
+    # escape the next character, even in raw strings.
+    _PYTHON_STRING_START_RE = re.compile(r'#[^\n]*|("""|\'\'\'|"|\')')
+    _PYTHON_STRING_END_RES = {
+        '"""': re.compile(r'(?:\\.|[^\\])*?"""', re.DOTALL),
+        "'''": re.compile(r"(?:\\.|[^\\])*?'''", re.DOTALL),
+        '"': re.compile(r'(?:\\.|[^"\\\n])*"', re.DOTALL),
+        "'": re.compile(r"(?:\\.|[^'\\\n])*'", re.DOTALL),
+    }
+
+    # Lexers shared by every file that uses the same lexer class
+    # (or override pattern), so each is only created once
+    _LEXER_CACHE = {}
+
+    # List of `(regex, lexer_class, is_primary, extension)` tuples
+    # for the filename patterns of every pygments lexer, compiled
+    # the first time we choose a lexer (see `_filename_patterns()`)
+    _FILENAME_PATTERNS = None
+
+    # Filename patterns that match only the files with an extension
+    # (for example, `'*.py'`), and the extension they match
+    _EXTENSION_PATTERN_RE = re.compile(r'^\*\.([^*?\[\].]+)$')
+
+    # Lexer classes chosen for file names, keyed by the extension
+    # and the other filename patterns that match the name
+    # (see `_lexer_class()`)
+    _LEXER_CLASS_CACHE = {}
+
     def __init__(self, src_tokens, src_filename,
                  start_line, violation_lines):
         """
@@ -105,15 +160,53 @@ class Snippet(object):
         return ''.join([val for _, val in self._src_tokens])
 
     @classmethod
-    def load_snippets_html(cls, src_path, violation_lines):
+    def load_snippets_html(cls, src_path, violation_lines, cache=None):
         """
         Load snippets from the file at `src_path` and format
         them as HTML.
 
+        `cache` is an optional `DiskCache` used to store the
+        HTML across runs, keyed by the contents of the file,
+        the violation lines, and the formatting options.
+
         See `load_snippets()` for details.
         """
+        if cache is not None:
+            key = cls._cache_key(src_path, violation_lines)
+            snippets_html = cache.get(key)
+
+            if snippets_html is not None:
+                instrumentation.count('snippet cache hits')
+                return snippets_html
+
         snippet_list = cls.load_snippets(src_path, violation_lines)
-        return [snippet.html() for snippet in snippet_list]
+        snippets_html = [snippet.html() for snippet in snippet_list]
+
+        if cache is not None:
+            cache.set(key, snippets_html)
+
+        return snippets_html
+
+    @classmethod
+    def _cache_key(cls, src_path, violation_lines):
+        """
+        Return the `DiskCache` key for the HTML snippets
+        showing `violation_lines` in the file at `src_path`.
+
+        Raises an `IOError` if the file could not be read.
+        """
+        options = (
+            cls.VIOLATION_COLOR, cls.DIV_CSS_CLASS,
+            cls.NUM_CONTEXT_LINES, cls.MAX_GAP_IN_SNIPPET,
+            cls.WINDOWED_LEXERS, cls.LEXER_LOOKBACK_LINES,
+            sorted(cls.LEXER_OVERRIDES.items()), cls.PREFERRED_LEXERS
+        )
+
+        return DiskCache.make_key(
+            'snippets', pygments.__version__, repr(options),
+            src_path, DiskCache.hash_file(src_path),
+            repr(sorted(set(violation_lines)))
+        )
 
     @classmethod
     def load_snippets(cls, src_path, violation_lines):
@@ -136,11 +229,18 @@ class Snippet(object):
         src_lines = contents.split('\n')
         snippet_ranges = cls._snippet_ranges(len(src_lines), violation_lines)
 
-        # Parse the source into tokens
-        token_stream = cls._parse_src(contents, src_path)
+        instrumentation.count('files lexed')
+        lexer = cls._lexer(src_path, contents)
 
-        # Group the tokens by snippet
-        token_groups = cls._group_tokens(token_stream, snippet_ranges)
+        # Parse the source into tokens and group the tokens by snippet,
+        # lexing only the lines we need if the lexer allows it
+        if any(alias in cls.WINDOWED_LEXERS for alias in lexer.aliases):
+            token_groups = cls._group_window_tokens(
+                src_lines, snippet_ranges, lexer
+            )
+        else:
+            token_stream = pygments.lex(contents, lexer)
+            token_groups = cls._group_tokens(token_stream, snippet_ranges)
 
         return [
             Snippet(tokens, src_path, start, violation_lines)
@@ -156,10 +256,193 @@ class Snippet(object):
         Uses `src_filename` to guess the type of file
         so it can highlight syntax correctly.
         """
+        lexer = cls._lexer(src_filename, src_contents)
+        return pygments.lex(src_contents, lexer)
+
+    @classmethod
+    def _lexer(cls, src_filename, src_contents):
+        """
+        Return a pygments lexer for `src_contents` (str),
+        using `src_filename` to guess the type of file.
+
+        Lexers are chosen by `LEXER_OVERRIDES`, then by the pygments
+        filename patterns that match the file name (see
+        `_lexer_class()`).  Only files without an extension that
+        match no pattern are looked at more closely: scripts use the
+        lexer for the interpreter on their "#!" line.
+        Each lexer is created once and shared by every file
+        that uses it.
+        """
+        filename = os.path.basename(src_filename)
+
+        for pattern, lexer_name in cls.LEXER_OVERRIDES.iteritems():
+            if fnmatch.fnmatch(filename, pattern):
+                return cls._cached_lexer(
+                    ('override', pattern), get_lexer_by_name, lexer_name
+                )
+
+        lexer_class = cls._lexer_class(filename)
+
+        if lexer_class is None and not os.path.splitext(filename)[1]:
+            lexer_class = cls._script_lexer_class(src_contents)
+
+        if lexer_class is None:
+            lexer_class = TextLexer
+
+        return cls._cached_lexer(lexer_class, lexer_class)
+
+    @classmethod
+    def _lexer_class(cls, filename):
+        """
+        Return the class of the pygments lexer for the file called
+        `filename` (without a directory), or `None` if no lexer
+        matches the name.
+
+        If the patterns of more than one lexer match the name, choose
+        from the lexers that handle it directly (rather than as an
+        alternative to another lexer) the first in `PREFERRED_LEXERS`,
+        or else the first by name.  The choice never depends on the
+        contents, so every file with the same name pattern uses the
+        same lexer; use `LEXER_OVERRIDES` to choose a different one.
+
+        Most patterns only match an extension, so the choice is
+        cached by the extension and the few other patterns that
+        match, rather than matching every pattern for every file.
+        """
+        normalized = os.path.normcase(filename)
+        patterns = cls._filename_patterns()
+
+        extension = None
+        if '.' in normalized:
+            extension = normalized.rpartition('.')[2]
+
+        key = (extension,) + tuple(
+            index
+            for index, (regex, _, _, pattern_extension) in enumerate(patterns)
+            if pattern_extension is None and regex.match(normalized)
+        )
+
+        if key not in cls._LEXER_CLASS_CACHE:
+            first = None
+            primaries = []
+
+            for regex, lexer_class, is_primary, _ in patterns:
+                if regex.match(normalized):
+                    first = first or lexer_class
+                    if is_primary and lexer_class not in primaries:
+                        primaries.append(lexer_class)
+
+            cls._LEXER_CLASS_CACHE[key] = (
+                cls._preferred_lexer_class(primaries) or first
+            )
+
+        return cls._LEXER_CLASS_CACHE[key]
+
+    @classmethod
+    def _preferred_lexer_class(cls, lexer_classes):
+        """
+        Return the first class in `lexer_classes` with an alias in
+        `PREFERRED_LEXERS` (in the order of `PREFERRED_LEXERS`),
+        or else the first class, or `None` if there are none.
+        """
+        for alias in cls.PREFERRED_LEXERS:
+            for lexer_class in lexer_classes:
+                if alias in lexer_class.aliases:
+                    return lexer_class
+
+        return lexer_classes[0] if lexer_classes else None
+
+    @staticmethod
+    def _script_lexer_class(src_contents):
+        """
+        Return the class of the pygments lexer named after the
+        interpreter on the "#!" line starting `src_contents`
+        (for example, `python` in "#!/usr/bin/env python2.7"),
+        or `None` if there isn't one.
+        """
+        if not src_contents.startswith('#!'):
+            return None
+
+        words = src_contents[2:].split('\n', 1)[0].split()
+        if words and os.path.basename(words[0]) == 'env':
+            words = words[1:]
+
+        if not words:
+            return None
+
+        interpreter = os.path.basename(words[0])
+
+        # Try the name with and without a version number
+        for name in [interpreter, interpreter.rstrip('0123456789.')]:
+            try:
+                return type(get_lexer_by_name(name))
+            except ClassNotFound:
+                continue
+
+        return None
+
+    @classmethod
+    def _filename_patterns(cls):
+        """
+        Return a list of `(regex, lexer_class, is_primary, extension)`
+        tuples, one for each filename pattern of each pygments lexer.
+        `is_primary` is False for patterns the lexer only
+        handles as an alternative to another lexer.  `extension`
+        is the extension that the pattern matches, or `None` if the
+        pattern matches more than the files with an extension.
+        """
+        if cls._FILENAME_PATTERNS is None:
+            patterns = []
+
+            # Walk the lexers in a fixed order, so that the same
+            # lexer is chosen for a name every time
+            for lexer_name in sorted(info[0] for info in get_all_lexers()):
+                lexer_class = find_lexer_class(lexer_name)
+
+                if lexer_class is None:
+                    continue
+
+                for filenames, is_primary in [
+                        (lexer_class.filenames, True),
+                        (lexer_class.alias_filenames, False)]:
+
+                    for pattern in filenames:
+                        pattern = os.path.normcase(pattern)
+                        regex = re.compile(fnmatch.translate(pattern))
+
+                        match = cls._EXTENSION_PATTERN_RE.match(pattern)
+                        extension = match.group(1) if match else None
+
+                        patterns.append(
+                            (regex, lexer_class, is_primary, extension)
+                        )
+
+            cls._FILENAME_PATTERNS = patterns
+
+        return cls._FILENAME_PATTERNS
+
+    @classmethod
+    def _cached_lexer(cls, key, lexer_func, *args):
+        """
+        Return the lexer cached under `key`, creating it
+        with `_new_lexer(lexer_func, *args)` if there isn't one.
+        """
+        lexer = cls._LEXER_CACHE.get(key)
 
-        # Parse the source into tokens
+        if lexer is None:
+            lexer = cls._new_lexer(lexer_func, *args)
+            cls._LEXER_CACHE[key] = lexer
+
+        return lexer
+
+    @staticmethod
+    def _new_lexer(lexer_func, *args):
+        """
+        Return the lexer returned by `lexer_func(*args)`, or a plain
+        text lexer if pygments doesn't have a matching lexer.
+        """
         try:
-            lexer = guess_lexer_for_filename(src_filename, src_contents)
+            lexer = lexer_func(*args)
         except ClassNotFound:
             lexer = TextLexer()
 
@@ -167,7 +450,156 @@ class Snippet(object):
         # the source file when lexing.
         lexer.stripnl = False
 
-        return pygments.lex(src_contents, lexer)
+        return lexer
+
+    @classmethod
+    def _group_window_tokens(cls, src_lines, range_list, lexer):
+        """
+        Group tokens into snippet ranges, like `_group_tokens()`,
+        but lex only a window of lines around each range.
+
+        `src_lines` is the list of lines in the source file.
+
+        Each window starts a few lines before its range and ends a few
+        lines after it (see `_window_bound()`), so the lexer reads the
+        range the same way as if it had lexed the whole file.
+        Ranges whose windows overlap are lexed together.
+        """
+        token_map = dict()
+
+        if not range_list:
+            return token_map
+
+        # Find the lines that start inside a string.  If we can't
+        # tell, lex the whole file to be sure we get it right.
+        if 'text' in lexer.aliases:
+            in_string = [False] * len(src_lines)
+        else:
+            in_string = cls._python_string_lines(src_lines)
+
+        if in_string is None:
+            return cls._group_tokens(
+                pygments.lex('\n'.join(src_lines), lexer), range_list
+            )
+
+        # Collect the ranges for each window, in order
+        windows = []
+        for (start, end) in range_list:
+            window_start = cls._window_bound(src_lines, in_string, start, -1)
+            window_end = cls._window_bound(src_lines, in_string, end + 1, 1)
+
+            if windows and window_start <= windows[-1][1] + 1:
+                windows[-1][1] = max(windows[-1][1], window_end)
+                windows[-1][2].append((start, end))
+            else:
+                windows.append([window_start, window_end, [(start, end)]])
+
+        for window_start, window_end, window_ranges in windows:
+            window = '\n'.join(src_lines[window_start - 1:window_end])
+
+            # Number the lines from the start of the window
+            offset = window_start - 1
+            window_map = cls._group_tokens(
+                pygments.lex(window, lexer),
+                [(start - offset, end - offset)
+                 for (start, end) in window_ranges]
+            )
+
+            for (start, end), tokens in window_map.iteritems():
+                token_map[(start + offset, end + offset)] = tokens
+
+        return token_map
+
+    @classmethod
+    def _python_string_lines(cls, src_lines):
+        """
+        Return a list of booleans, one for each line in `src_lines`
+        (lines of Python source), indicating whether the line starts
+        inside a multi-line string.
+
+        Returns `None` if a string is never closed, in which case
+        we can't tell where the strings are.
+        """
+        contents = '\n'.join(src_lines)
+
+        # Find the `(start, end)` offsets of each string that spans
+        # lines, skipping comments and the strings on a single line
+        spans = []
+        pos = 0
+
+        while True:
+            match = cls._PYTHON_STRING_START_RE.search(contents, pos)
+            if match is None:
+                break
+
+            quote = match.group(1)
+            if quote is None:
+                pos = match.end()
+                continue
+
+            end_match = cls._PYTHON_STRING_END_RES[quote].match(
+                contents, match.end()
+            )
+            if end_match is None:
+                return None
+
+            if '\n' in contents[match.start():end_match.end()]:
+                spans.append((match.start(), end_match.end()))
+
+            pos = end_match.end()
+
+        # Walk the lines and the strings together, in order
+        in_string = []
+        line_start = 0
+        span_index = 0
+
+        for line in src_lines:
+            while (span_index < len(spans) and
+                   spans[span_index][1] <= line_start):
+                span_index += 1
+
+            in_string.append(
+                span_index < len(spans) and
+                spans[span_index][0] < line_start
+            )
+            line_start += len(line) + 1
+
+        return in_string
+
+    @classmethod
+    def _window_bound(cls, src_lines, in_string, line_num, step):
+        """
+        Return the line number at which to start (if `step` is -1)
+        or end (if `step` is 1) lexing a window around a snippet.
+
+        `in_string` is a list of booleans, one for each line in
+        `src_lines`, indicating whether the line starts inside
+        a triple-quoted string.
+
+        This is the nearest line to `line_num` in the direction
+        of `step` that is unindented and not inside a triple-quoted
+        string, searching at most `LEXER_LOOKBACK_LINES` lines.
+        If there is no such line, use the nearest line that isn't
+        inside a string, or else the start or end of the file.
+        """
+        file_bound = 1 if step < 0 else len(src_lines)
+        limit = line_num + step * cls.LEXER_LOOKBACK_LINES
+        limit = min(max(limit, 1), len(src_lines))
+
+        outside_string = None
+
+        for bound in xrange(line_num, limit + step, step):
+            if not 1 <= bound <= len(src_lines) or in_string[bound - 1]:
+                continue
+
+            line = src_lines[bound - 1]
+            if line and not line[0].isspace():
+                return bound
+
+            if outside_string is None:
+                outside_string = bound
+
+        return outside_string or file_bound
 
     @classmethod
     def _group_tokens(cls, token_stream, range_list):
@@ -190,55 +622,66 @@ class Snippet(object):
         }
 
         The algorithm is slightly complicated because a single token
-        can contain multiple line breaks.
+        can contain multiple line breaks.  We walk the tokens once,
+        keeping track of the first range that hasn't ended yet,
+        so each token is only compared with the ranges it overlaps.
+        Ranges may overlap, in which case a token is added to each.
         """
 
         # Create a map from ranges (start/end tuples) to tokens
         token_map = dict((rng, []) for rng in range_list)
 
+        # Index of the first range that ends on or after
+        # the current line
+        first_range = 0
+
         # Keep track of the current line number; we will
         # increment this as we encounter newlines in token values
         line_num = 1
 
         for ttype, val in token_stream:
 
-            # If there are newlines in this token,
-            # we need to split it up and check whether
-            # each line within the token is within one
-            # of our ranges.
-            if '\n' in val:
-                val_lines = val.split('\n')
+            # Skip ranges that ended before this token
+            while (first_range < len(range_list) and
+                   range_list[first_range][1] < line_num):
+                first_range += 1
 
-                # Check if the tokens match each range
-                for (start, end), filtered_tokens in token_map.iteritems():
+            # If every range has ended, we don't need the other tokens
+            if first_range == len(range_list):
+                break
 
-                    # Filter out lines that are not in this range
-                    include_vals = [
-                        val_lines[i] for i in
-                        range(0, len(val_lines))
-                        if i + line_num in range(start, end + 1)
-                    ]
+            # The token covers the lines from `line_num` to `last_line`
+            num_newlines = val.count('\n')
+            last_line = line_num + num_newlines
 
-                    # If we found any lines, store the tokens
-                    if len(include_vals) > 0:
-                        token = (ttype, '\n'.join(include_vals))
-                        filtered_tokens.append(token)
+            # If there are newlines in this token,
+            # split it up so we can keep only the lines
+            # within each range.
+            if num_newlines > 0:
+                val_lines = val.split('\n')
 
-                # Increment the line number
-                # by the number of lines we found
-                line_num += len(val_lines) - 1
+            index = first_range
+            num_ranges = len(range_list)
+            while index < num_ranges and range_list[index][0] <= last_line:
+                start, end = range_list[index]
+                index += 1
 
-            # No newline in this token
-            # If we're in the line range, add it
-            else:
-                # Check if the tokens match each range
-                for (start, end), filtered_tokens in token_map.iteritems():
+                # A range that starts later can still end earlier
+                if end < line_num:
+                    continue
 
-                    # If we got a match, store the token
-                    if line_num in range(start, end + 1):
-                        filtered_tokens.append((ttype, val))
+                if num_newlines > 0:
+                    include_vals = val_lines[
+                        max(start, line_num) - line_num:
+                        min(end, last_line) - line_num + 1
+                    ]
+                    token = (ttype, '\n'.join(include_vals))
+                else:
+                    token = (ttype, val)
 
-                    # Otherwise, ignore the token
+                token_map[(start, end)].append(token)
+
+            line_num = last_line
 
         return token_map
 
@@ -252,52 +695,53 @@ class Snippet(object):
         Each snippet contains a few extra lines of context
         before/after the first/last violation.  Nearby
         violations are grouped within the same snippet.
+
+        Only the violation lines are examined, so the cost
+        doesn't depend on the length of the source file.
         """
-        current_range = (None, None)
-        lines_since_last_violation = 0
         snippet_ranges = []
-        for line_num in range(1, num_src_lines + 1):
-
-            # If we have not yet started a snippet,
-            # check if we can (is this line a violation?)
-            if current_range[0] is None:
-                if line_num in violation_lines:
-
-                    # Expand to include extra context, but not before line 1
-                    snippet_start = max(1, line_num - cls.NUM_CONTEXT_LINES)
-                    current_range = (snippet_start, None)
-                    lines_since_last_violation = 0
-
-            # If we are within a snippet, check if we
-            # can end the snippet (have we gone enough
-            # lines without hitting a violation?)
-            elif current_range[1] is None:
-                if line_num in violation_lines:
-                    lines_since_last_violation = 0
-
-                elif lines_since_last_violation > cls.MAX_GAP_IN_SNIPPET:
-
-                    # Expand to include extra context, but not after last line
-                    snippet_end = line_num - lines_since_last_violation
-                    snippet_end = min(
-                        num_src_lines,
-                        snippet_end + cls.NUM_CONTEXT_LINES
-                    )
-                    current_range = (current_range[0], snippet_end)
-
-                    # Store the snippet and start looking for the next one
-                    snippet_ranges.append(current_range)
-                    current_range = (None, None)
-
-            # Another line since the last violation
-            lines_since_last_violation += 1
-
-        # If we started a snippet but didn't finish it, do so now
-        if current_range[0] is not None and current_range[1] is None:
-            snippet_ranges.append((current_range[0], num_src_lines))
+        first_violation = last_violation = None
+
+        # Ignore violations outside the file
+        for line_num in sorted(set(violation_lines)):
+            if not 1 <= line_num <= num_src_lines:
+                continue
+
+            # Start a new snippet unless this violation is
+            # close enough to the last one
+            if (last_violation is not None and
+                    line_num - last_violation > cls.MAX_GAP_IN_SNIPPET + 1):
+                snippet_ranges.append(
+                    cls._snippet_range(first_violation, last_violation,
+                                       num_src_lines)
+                )
+                first_violation = None
+
+            if first_violation is None:
+                first_violation = line_num
+            last_violation = line_num
+
+        if first_violation is not None:
+            snippet_ranges.append(
+                cls._snippet_range(first_violation, last_violation,
+                                   num_src_lines)
+            )
 
         return snippet_ranges
 
+    @classmethod
+    def _snippet_range(cls, first_violation, last_violation, num_src_lines):
+        """
+        Return the `(start_line, end_line)` range of a snippet
+        showing the violations from `first_violation` to
+        `last_violation`, expanded to include extra context
+        (but not before line 1 or after the last line).
+        """
+        return (
+            max(1, first_violation - cls.NUM_CONTEXT_LINES),
+            min(num_src_lines, last_violation + cls.NUM_CONTEXT_LINES)
+        )
+
     @staticmethod
     def _shift_lines(line_num_list, start_line):
         """
@@ -28,6 +28,62 @@ class ParseArgsTest(unittest.TestCase):
             arg_dict.get('coverage_xml'),
             ['reports/coverage.xml']
         )
+        self.assertEqual(arg_dict.get('merge_base'), False)
+
+    def test_parse_with_merge_base(self):
+        argv = ['reports/coverage.xml', '--merge-base']
+
+        arg_dict = parse_coverage_args(argv)
+        self.assertEqual(arg_dict.get('merge_base'), True)
+
+    def test_parse_with_lexers(self):
+        argv = ['reports/coverage.xml',
+                '--lexer', '*.inc=php', '--lexer', 'SConstruct=python']
+
+        arg_dict = parse_coverage_args(argv)
+        self.assertEqual(
+            arg_dict.get('lexer'),
+            [('*.inc', 'php'), ('SConstruct', 'python')]
+        )
+
+    def test_parse_with_jobs(self):
+        argv = ['reports/coverage.xml', '--jobs', '3']
+
+        arg_dict = parse_coverage_args(argv)
+        self.assertEqual(arg_dict.get('jobs'), 3)
+
+    def test_parse_with_cache_dir(self):
+        argv = ['reports/coverage.xml', '--cache-dir', '.diff_cover_cache']
+
+        arg_dict = parse_coverage_args(argv)
+        self.assertEqual(arg_dict.get('cache_dir'), '.diff_cover_cache')
+
+    def test_parse_with_profile(self):
+        argv = ['--profile', 'reports/coverage.xml']
+
+        # Expect that the positional argument isn't taken by `--profile`
+        arg_dict = parse_coverage_args(argv)
+        self.assertEqual(arg_dict.get('profile'), True)
+        self.assertEqual(
+            arg_dict.get('coverage_xml'), ['reports/coverage.xml']
+        )
+
+    def test_parse_with_profile_json(self):
+        argv = ['reports/coverage.xml', '--profile-json', 'profile.json']
+
+        arg_dict = parse_coverage_args(argv)
+        self.assertEqual(arg_dict.get('profile'), False)
+        self.assertEqual(arg_dict.get('profile_json'), 'profile.json')
+
+    def test_parse_with_no_profile(self):
+        arg_dict = parse_coverage_args(['reports/coverage.xml'])
+        self.assertEqual(arg_dict.get('profile'), False)
+        self.assertEqual(arg_dict.get('profile_json'), None)
+
+    def test_parse_invalid_lexer(self):
+        for lexer in ['php', '*.inc=', '=php', '*.inc=not-a-lexer']:
+            with self.assertRaises(SystemExit):
+                parse_coverage_args(['reports/coverage.xml', '--lexer', lexer])
 
     def test_parse_invalid_arg(self):
 
@@ -58,6 +114,69 @@ class ParseQualityArgsTest(unittest.TestCase):
         arg_dict = parse_quality_args(argv)
         self.assertEqual(arg_dict.get('violations'), 'pylint')
         self.assertEqual(arg_dict.get('input_reports'), [])
+        self.assertEqual(arg_dict.get('merge_base'), False)
+
+    def test_parse_with_merge_base(self):
+        argv = ['--violations', 'pep8', '--merge-base']
+
+        arg_dict = parse_quality_args(argv)
+        self.assertEqual(arg_dict.get('merge_base'), True)
+
+    def test_parse_with_jobs(self):
+        argv = ['--violations', 'pylint', '--jobs', '4']
+
+        arg_dict = parse_quality_args(argv)
+        self.assertEqual(arg_dict.get('jobs'), 4)
+
+    def test_parse_default_jobs(self):
+        argv = ['--violations', 'pylint']
+
+        arg_dict = parse_quality_args(argv)
+        self.assertTrue(arg_dict.get('jobs') >= 1)
+
+    def test_parse_with_cache_dir(self):
+        argv = ['--violations', 'pylint', '--cache-dir', '.diff_cover_cache']
+
+        arg_dict = parse_quality_args(argv)
+        self.assertEqual(arg_dict.get('cache_dir'), '.diff_cover_cache')
+
+    def test_parse_with_no_cache_dir(self):
+        argv = ['--violations', 'pylint']
+
+        arg_dict = parse_quality_args(argv)
+        self.assertEqual(arg_dict.get('cache_dir'), None)
+
+    def test_parse_with_lexers(self):
+        argv = ['--violations', 'pylint', '--lexer', '*.inc=php']
+
+        arg_dict = parse_quality_args(argv)
+        self.assertEqual(arg_dict.get('lexer'), [('*.inc', 'php')])
+
+    def test_parse_with_no_lexers(self):
+        argv = ['--violations', 'pylint']
+
+        arg_dict = parse_quality_args(argv)
+        self.assertEqual(arg_dict.get('lexer'), [])
+
+    def test_parse_with_profile(self):
+        argv = ['--violations', 'pylint', '--profile', 'pylint_report.txt']
+
+        # Expect that the input report isn't taken by `--profile`
+        arg_dict = parse_quality_args(argv)
+        self.assertEqual(arg_dict.get('profile'), True)
+        self.assertEqual(arg_dict.get('input_reports'), ['pylint_report.txt'])
+
+    def test_parse_with_profile_json(self):
+        argv = ['--violations', 'pep8', '--profile-json', 'profile.json']
+
+        arg_dict = parse_quality_args(argv)
+        self.assertEqual(arg_dict.get('profile_json'), 'profile.json')
+        self.assertEqual(arg_dict.get('input_reports'), [])
+
+    def test_parse_with_no_profile(self):
+        arg_dict = parse_quality_args(['--violations', 'pep8'])
+        self.assertEqual(arg_dict.get('profile'), False)
+        self.assertEqual(arg_dict.get('profile_json'), None)
 
     def test_parse_with_one_input_report(self):
         argv = ['--violations', 'pylint', 'pylint_report.txt']
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+import os
+import os.path
+import shutil
+import tempfile
+from mock import patch
+from diff_cover.cache import DiskCache
+from diff_cover.tests.helpers import unittest
+
+
+class DiskCacheTest(unittest.TestCase):
+
+    def setUp(self):
+
+        # Create a temporary directory to hold the cache
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(self.temp_dir))
+        self.cache_dir = os.path.join(self.temp_dir, 'cache')
+
+        self.cache = DiskCache(self.cache_dir)
+
+    def test_creates_dir(self):
+        self.assertTrue(os.path.isdir(self.cache_dir))
+
+    def test_get_set(self):
+        self.cache.set('key', [[1, u'message ሴ']])
+
+        # Expect that we get back what we stored,
+        # even from another instance of the cache
+        self.assertEqual(self.cache.get('key'), [[1, u'message ሴ']])
+        self.assertEqual(DiskCache(self.cache_dir).get('key'),
+                         [[1, u'message ሴ']])
+
+    def test_get_missing(self):
+        self.assertEqual(self.cache.get('missing'), None)
+
+    def test_get_corrupt(self):
+
+        # Write an entry that isn't valid JSON
+        with open(self.cache._path('key'), 'w') as cache_file:
+            cache_file.write('{not json')
+
+        self.assertEqual(self.cache.get('key'), None)
+
+    def test_set_existing_key(self):
+        self.cache.set('key', 'first')
+        self.cache.set('key', 'second')
+        self.assertEqual(self.cache.get('key'), 'second')
+
+    def test_set_rename_fails(self):
+        self.cache.set('key', 'first')
+
+        # Simulate Windows, where we can't rename onto an existing file
+        real_rename = os.rename
+
+        def rename(src, dst):
+            if os.path.exists(dst):
+                raise OSError("File exists")
+            real_rename(src, dst)
+
+        with patch('diff_cover.cache.os.rename', side_effect=rename):
+            self.cache.set('key', 'second')
+
+        self.assertEqual(self.cache.get('key'), 'second')
+
+        # Expect that no temporary files are left behind
+        self.assertEqual(os.listdir(self.cache_dir),
+                         [os.path.basename(self.cache._path('key'))])
+
+    def test_set_rename_always_fails(self):
+        self.cache.set('key', 'first')
+
+        # Expect that a failed write is ignored
+        with patch('diff_cover.cache.os.rename', side_effect=OSError):
+            self.cache.set('key', 'second')
+
+        self.assertEqual(os.listdir(self.cache_dir), [])
+        self.assertEqual(self.cache.get('key'), None)
+
+    def test_make_key(self):
+        key = DiskCache.make_key('pep8', u'file_朩.py', 'abc')
+
+        # Expect that the same components produce the same key
+        self.assertEqual(key, DiskCache.make_key('pep8', u'file_朩.py', 'abc'))
+
+        # Expect that different components produce different keys
+        self.assertNotEqual(
+            key, DiskCache.make_key('pep8', u'file_朩.py', 'abd')
+        )
+        self.assertNotEqual(DiskCache.make_key('ab', 'c'),
+                            DiskCache.make_key('a', 'bc'))
+
+    def test_hash_file(self):
+        path = os.path.join(self.temp_dir, 'file.py')
+
+        with open(path, 'w') as src_file:
+            src_file.write('x = 1\n')
+        first_hash = DiskCache.hash_file(path)
+
+        with open(path, 'w') as src_file:
+            src_file.write('x = 2\n')
+
+        self.assertNotEqual(first_hash, DiskCache.hash_file(path))
+
+        with self.assertRaises(IOError):
+            DiskCache.hash_file(os.path.join(self.temp_dir, 'no_such_file.py'))
+
+    def test_evict(self):
+
+        # Allow room for about two entries
+        cache = DiskCache(self.cache_dir, max_size=250)
+
+        for index, key in enumerate(['oldest', 'old', 'new']):
+            cache.set(key, ['x' * 100])
+
+            # Make sure each entry has a distinct access time
+            os.utime(cache._path(key), (1000 + index, 1000 + index))
+
+        # Using the oldest entry makes it the most recently used
+        self.assertNotEqual(cache.get('oldest'), None)
+
+        cache.evict()
+
+        # Expect that the least recently used entry was removed
+        self.assertEqual(cache.get('old'), None)
+        self.assertNotEqual(cache.get('oldest'), None)
+        self.assertNotEqual(cache.get('new'), None)
+
+    def test_evict_other_files(self):
+        cache = DiskCache(self.cache_dir, max_size=0)
+        cache.set('key', ['x' * 100])
+
+        # Add a file the cache didn't create, and a temporary
+        # file for an entry another process is still writing
+        for name in ['important.dat', 'diff_cover-abc.tmp']:
+            with open(os.path.join(self.cache_dir, name), 'w') as other:
+                other.write('x' * 100)
+
+        cache.evict()
+
+        # Expect that only the cache's own entry was removed
+        self.assertEqual(cache.get('key'), None)
+        self.assertEqual(sorted(os.listdir(self.cache_dir)),
+                         ['diff_cover-abc.tmp', 'important.dat'])
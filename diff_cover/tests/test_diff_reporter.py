@@ -2,7 +2,7 @@
 import mock
 from textwrap import dedent
 from diff_cover.diff_reporter import GitDiffReporter
-from diff_cover.git_diff import GitDiffTool, GitDiffError
+from diff_cover.git_diff import GitDiffTool, GitDiffError, GitDiffOutput
 from diff_cover.tests.helpers import line_numbers, git_diff_output, unittest
 
 
@@ -74,6 +74,57 @@ class GitDiffReporterTest(unittest.TestCase):
         self.assertEqual(lines_changed,
                          line_numbers(3, 10) + line_numbers(34, 47))
 
+    def test_git_line_ranges(self):
+
+        # Configure the git diff output
+        self._set_git_diff_output(
+            git_diff_output({'subdir/file1.py':
+                             line_numbers(3, 10) + line_numbers(34, 47)}),
+            git_diff_output({'subdir/file1.py': line_numbers(11, 12) + [40]}),
+            git_diff_output(dict(), deleted_files=['README.md']))
+
+        # Expect that adjacent and overlapping lines are combined into runs
+        self.assertEqual(self.diff.line_ranges('subdir/file1.py'),
+                         [(3, 12), (34, 47)])
+        self.assertEqual(self.diff.line_ranges('README.md'), [])
+        self.assertEqual(self.diff.line_ranges('no_such_file.py'), [])
+
+    def test_git_lines_changed_cached(self):
+        self._set_git_diff_output(
+            git_diff_output({'file.py': line_numbers(3, 10)}), '', ''
+        )
+
+        # Expect that the lines are only expanded from the ranges once
+        lines_changed = self.diff.lines_changed('file.py')
+        self.assertIs(self.diff.lines_changed('file.py'), lines_changed)
+
+        # Expect that clearing the cache clears the lines too
+        self._set_git_diff_output(
+            git_diff_output({'file.py': [4]}), '', ''
+        )
+        self.assertEqual(self.diff.lines_changed('file.py'), [4])
+
+    def test_git_streamed_lines(self):
+
+        # Output the diffs as iterators over lines,
+        # the way `GitDiffTool` streams them from `git diff`
+        diffs = [
+            git_diff_output({'subdir/file1.py': line_numbers(3, 10)}),
+            git_diff_output({'file2.py': [4]}),
+            ''
+        ]
+        self.diff.clear_cache()
+        self._git_diff.diff_all.return_value = [
+            (line for line in diff.split('\n')) for diff in diffs
+        ]
+
+        # Expect that the lines are parsed as they are read
+        self.assertEqual(self.diff.src_paths_changed(),
+                         ['file2.py', 'subdir/file1.py'])
+        self.assertEqual(self.diff.lines_changed('subdir/file1.py'),
+                         line_numbers(3, 10))
+        self.assertEqual(self.diff.lines_changed('file2.py'), [4])
+
     def test_ignore_lines_outside_src(self):
 
         # Add some lines at the start of the diff, before any
@@ -255,6 +306,113 @@ class GitDiffReporterTest(unittest.TestCase):
             self.assertEqual(self.diff.lines_changed('file.py'), [],
                              msg=fail_msg)
 
+    def test_git_shifted_lines(self):
+
+        # Commit changes to lines 3 and 4
+        master_diff = dedent("""
+            diff --git a/file.py b/file.py
+            @@ -1,4 +1,4 @@
+             test
+             test
+            -test
+            -test
+            +changed
+            +changed
+            """).strip()
+
+        # Insert two lines at the start of the file and
+        # delete the last line of the committed version
+        staged_diff = dedent("""
+            diff --git a/file.py b/file.py
+            @@ -1,6 +1,7 @@
+            +added
+            +added
+             test
+             test
+             changed
+             changed
+             test
+            -test
+            """).strip()
+
+        self._set_git_diff_output(master_diff, staged_diff, '')
+
+        # Expect that the committed lines have moved down two lines
+        self.assertEqual(self.diff.lines_changed('file.py'), [1, 2, 5, 6])
+        self.assertEqual(self.diff.line_ranges('file.py'), [(1, 2), (5, 6)])
+
+    def test_git_merged_ranges(self):
+
+        # Commit changes to lines 3 to 6
+        master_diff = dedent("""
+            diff --git a/file.py b/file.py
+            @@ -3,4 +3,4 @@
+            -test
+            -test
+            -test
+            -test
+            +changed
+            +changed
+            +changed
+            +changed
+            """).strip()
+
+        # Delete line 4, replace line 8 with two lines,
+        # and change the line after them
+        staged_diff = dedent("""
+            diff --git a/file.py b/file.py
+            @@ -3,7 +3,7 @@
+             changed
+            -changed
+             changed
+             changed
+             test
+            -test
+            +added
+            +added
+            -test
+            +added
+            """).strip()
+
+        self._set_git_diff_output(master_diff, staged_diff, '')
+
+        # Expect that the committed run has moved up to close the
+        # deleted line, and that the added lines form a single run
+        self.assertEqual(self.diff.line_ranges('file.py'), [(3, 5), (7, 9)])
+        self.assertEqual(
+            self.diff.lines_changed('file.py'), [3, 4, 5, 7, 8, 9]
+        )
+
+    def test_git_deleted_lines_in_later_hunk(self):
+
+        # Commit changes to lines 10 and 20
+        master_diff = dedent("""
+            diff --git a/file.py b/file.py
+            @@ -10 +10 @@
+            -test
+            +changed
+            @@ -20 +20 @@
+            -test
+            +changed
+            """).strip()
+
+        # Delete lines 1 to 3, then line 20 (which is line 17 afterwards)
+        unstaged_diff = dedent("""
+            diff --git a/file.py b/file.py
+            @@ -1,3 +0,0 @@
+            -test
+            -test
+            -test
+            @@ -20 +16,0 @@
+            -changed
+            """).strip()
+
+        self._set_git_diff_output(master_diff, '', unstaged_diff)
+
+        # Expect that line 10 has moved up three lines and line 20 is gone
+        self.assertEqual(self.diff.lines_changed('file.py'), [7])
+        self.assertEqual(self.diff.line_ranges('file.py'), [(7, 7)])
+
     def test_git_no_such_file(self):
 
         diff = git_diff_output({'subdir/file1.py': [1],
@@ -317,6 +475,20 @@ class GitDiffReporterTest(unittest.TestCase):
                 print "lines_changed() should fail for {0}".format(diff_str)
                 self.diff.lines_changed('subdir/file1.py')
 
+    def test_git_diff_error_closes_outputs(self):
+        outputs = [mock.MagicMock(GitDiffOutput) for _ in range(3)]
+        outputs[0].__iter__.return_value = iter(['@@ -1 +1 @@'])
+        self.diff.clear_cache()
+        self._git_diff.diff_all.return_value = outputs
+
+        # Expect that when we fail to parse the committed diff,
+        # every `git diff` is closed
+        with self.assertRaises(GitDiffError):
+            self.diff.src_paths_changed()
+
+        for output in outputs:
+            output.close.assert_called_with()
+
     def test_plus_sign_in_hunk_bug(self):
 
         # This was a bug that caused a parse error
@@ -375,6 +547,27 @@ class GitDiffReporterTest(unittest.TestCase):
         lines_changed = self.diff.lines_changed('subdir/src.py')
         self.assertEqual(lines_changed, [16, 17, 18, 19])
 
+    def test_merge_base_diff(self):
+
+        # Use a single diff against the merge-base
+        diff = GitDiffReporter(git_diff=self._git_diff, use_merge_base=True)
+        self._git_diff.diff_merge_base.return_value = git_diff_output(
+            {'subdir/file1.py': line_numbers(3, 10) + line_numbers(34, 47),
+             'file2.py': [7]},
+            deleted_files=['README.md']
+        )
+
+        # Expect that we get the files and lines from the single diff
+        self.assertEqual(diff.src_paths_changed(),
+                         ['file2.py', 'README.md', 'subdir/file1.py'])
+        self.assertEqual(diff.lines_changed('subdir/file1.py'),
+                         line_numbers(3, 10) + line_numbers(34, 47))
+        self.assertEqual(diff.lines_changed('file2.py'), [7])
+        self.assertEqual(diff.lines_changed('README.md'), [])
+
+        # Expect that we did not run the separate diffs
+        self.assertFalse(self._git_diff.diff_all.called)
+
     def _set_git_diff_output(self, committed_diff,
                              staged_diff, unstaged_diff):
         """
@@ -383,6 +576,6 @@ class GitDiffReporterTest(unittest.TestCase):
         `git diff`
         """
         self.diff.clear_cache()
-        self._git_diff.diff_committed.return_value = committed_diff
-        self._git_diff.diff_staged.return_value = staged_diff
-        self._git_diff.diff_unstaged.return_value = unstaged_diff
+        self._git_diff.diff_all.return_value = [
+            committed_diff, staged_diff, unstaged_diff
+        ]
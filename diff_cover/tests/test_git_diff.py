@@ -1,5 +1,8 @@
 import mock
-from diff_cover.git_diff import GitDiffTool, GitDiffError
+from StringIO import StringIO
+import threading
+import time
+from diff_cover.git_diff import GitDiffTool, GitDiffError, GitDiffOutput
 from diff_cover.tests.helpers import unittest
 
 
@@ -56,6 +59,151 @@ class TestGitDiffTool(unittest.TestCase):
                                                  stdout=self.subprocess.PIPE,
                                                  stderr=self.subprocess.PIPE)
 
+    def test_diff_all(self):
+
+        # Give each `git diff` command its own process with its own output
+        outputs = {
+            'origin/master...HEAD': 'committed output',
+            '--cached': 'staged output',
+        }
+
+        def make_process(command, **kwargs):
+            process = mock.Mock()
+            output = outputs.get(command[2], 'unstaged output')
+            process.stdout = StringIO(output)
+            process.stderr = StringIO('')
+            return process
+
+        self.subprocess.Popen.side_effect = make_process
+        output = self.tool.diff_all()
+
+        # Expect that we get the outputs in merge order
+        self.assertEqual(
+            [list(lines) for lines in output],
+            [['committed output'], ['staged output'], ['unstaged output']]
+        )
+
+        # Expect that all three commands were launched
+        pipe = self.subprocess.PIPE
+        expected = [
+            mock.call(['git', 'diff', 'origin/master...HEAD', '--no-ext-diff'],
+                      stdout=pipe, stderr=pipe),
+            mock.call(['git', 'diff', '--cached', '--no-ext-diff'],
+                      stdout=pipe, stderr=pipe),
+            mock.call(['git', 'diff', '--no-ext-diff'],
+                      stdout=pipe, stderr=pipe),
+        ]
+        self.assertEqual(self.subprocess.Popen.call_args_list, expected)
+
+    def test_diff_all_concurrent(self):
+
+        # Record when each process's output has been read to the end
+        finished = []
+
+        def make_process(command, **kwargs):
+            done = threading.Event()
+            finished.append(done)
+
+            def read_stdout():
+                yield 'output\n'
+                done.set()
+
+            process = mock.Mock()
+            process.stdout = read_stdout()
+            process.stderr = StringIO('')
+            return process
+
+        self.subprocess.Popen.side_effect = make_process
+        output = self.tool.diff_all()
+
+        # Expect that the staged and unstaged processes are drained
+        # before we start reading the committed output, which is
+        # read as we iterate over it
+        for done in finished[1:]:
+            done.wait(5)
+            self.assertTrue(done.is_set())
+
+        self.assertFalse(finished[0].is_set())
+
+        self.assertEqual(
+            [list(lines) for lines in output],
+            [['output'], ['output'], ['output']]
+        )
+
+    @mock.patch.object(GitDiffOutput, 'MAX_READ_AHEAD_LINES', 2)
+    def test_read_ahead_limit(self):
+
+        # Record how many lines have been read from the process
+        num_read = []
+
+        def read_stdout():
+            for line in ['1\n', '2\n', '3\n', '4\n', '5\n']:
+                num_read.append(line)
+                yield line
+
+        self.process.stdout = read_stdout()
+        self.process.stderr = StringIO('')
+        output = GitDiffOutput(self.process, read_ahead=True)
+
+        # Expect that we stop reading once the queue is full
+        # (plus the line waiting to be put into it)
+        deadline = time.time() + 5
+        while len(num_read) < 3 and time.time() < deadline:
+            time.sleep(0.01)
+
+        time.sleep(0.05)
+        self.assertEqual(len(num_read), 3)
+
+        self.assertEqual(list(output), ['1', '2', '3', '4', '5'])
+        self.process.wait.assert_called_with()
+
+    def test_close_early(self):
+        for read_ahead in [False, True]:
+            self.process.reset_mock()
+            self.process.stdout = StringIO('1\n2\n3\n')
+            self.process.stderr = StringIO('')
+
+            # Stop reading after the first line
+            output = GitDiffOutput(self.process, read_ahead=read_ahead)
+            lines = iter(output)
+            self.assertEqual(next(lines), '1')
+            lines.close()
+
+            # Expect that the process was stopped and waited for
+            self.process.kill.assert_called_with()
+            self.process.wait.assert_called_with()
+
+    def test_close_unread(self):
+        self.process.stdout = StringIO('1\n2\n3\n')
+        self.process.stderr = StringIO('')
+
+        # Expect that closing an output we never read
+        # stops the process and waits for it
+        GitDiffOutput(self.process, read_ahead=True).close()
+        self.process.kill.assert_called_with()
+        self.process.wait.assert_called_with()
+
+    def test_diff_merge_base(self):
+
+        # Output the merge-base commit, then the diff against it
+        self._set_git_diff_output('abc123\n', '')
+        self.process.stdout = StringIO('test output\nmore output\n')
+        self.process.stderr = StringIO('')
+        output = self.tool.diff_merge_base()
+
+        # Expect that we get the lines of the diff
+        self.assertEqual(list(output), ['test output', 'more output'])
+
+        # Expect that we diffed the working tree against the merge-base
+        pipe = self.subprocess.PIPE
+        expected = [
+            mock.call(['git', 'merge-base', 'origin/master', 'HEAD'],
+                      stdout=pipe, stderr=pipe),
+            mock.call(['git', 'diff', 'abc123', '--no-ext-diff'],
+                      stdout=pipe, stderr=pipe),
+        ]
+        self.assertEqual(self.subprocess.Popen.call_args_list, expected)
+
     def test_errors(self):
         self._set_git_diff_output('test output', 'fatal error')
 
@@ -68,6 +216,17 @@ class TestGitDiffTool(unittest.TestCase):
         with self.assertRaises(GitDiffError):
             self.tool.diff_unstaged()
 
+        # Streamed output raises the error once it has been read
+        self.process.stdout = StringIO('test output')
+        self.process.stderr = StringIO('fatal error')
+
+        with self.assertRaises(GitDiffError):
+            for lines in self.tool.diff_all():
+                list(lines)
+
+        with self.assertRaises(GitDiffError):
+            self.tool.diff_merge_base()
+
     def _set_git_diff_output(self, stdout, stderr):
         """
         Configure the `git diff` mock to output `stdout`
@@ -0,0 +1,353 @@
+import json
+from mock import Mock, call, patch
+from StringIO import StringIO
+import threading
+from lxml import etree
+from diff_cover import instrumentation
+from diff_cover.diff_reporter import BaseDiffReporter, GitDiffReporter
+from diff_cover.report_generator import HtmlReportGenerator
+from diff_cover.violations_reporter import BaseViolationReporter, \
+    Violation, XmlCoverageReporter, Pep8QualityReporter
+from diff_cover.tests.helpers import unittest, git_diff_output, \
+    line_numbers
+
+
+class InstrumentationTest(unittest.TestCase):
+
+    def setUp(self):
+
+        # Control the measurements for each stage
+        self._patcher = patch('diff_cover.instrumentation._measure')
+        self._measure = self._patcher.start()
+        self.addCleanup(self._patcher.stop)
+
+    def _start_profiling(self):
+        """
+        Register and return a new `Profiler`.
+        """
+        profiler = instrumentation.Profiler()
+        instrumentation.register(profiler)
+        self.addCleanup(instrumentation.unregister, profiler)
+        return profiler
+
+    def test_not_profiling(self):
+
+        # Expect that the hooks do nothing, without taking measurements
+        with instrumentation.stage('stage'):
+            instrumentation.count('counter')
+
+        self.assertEqual(self._measure.call_count, 0)
+
+    def test_stages(self):
+        self._measure.side_effect = [
+            (0.0, 0.0, 1024 ** 2),
+            (1.0, 0.0, 1024 ** 2),
+            (3.0, 1.5, 3 * 1024 ** 2),
+            (10.0, 2.0, 4 * 1024 ** 2),
+            (10.5, 2.0, 4 * 1024 ** 2),
+            (11.0, 2.0, 5 * 1024 ** 2),
+        ]
+
+        profiler = self._start_profiling()
+
+        with instrumentation.stage('outer'):
+            with instrumentation.stage('inner'):
+                pass
+
+        with instrumentation.stage('inner'):
+            pass
+
+        # Expect that stages are listed in the order they started,
+        # that repeated stages are added together, and that memory
+        # is how much each stage raised the peak RSS
+        self.assertEqual(profiler.stats()['stages'], [
+            {'name': 'outer', 'calls': 1, 'wall_time': 10.0,
+             'cpu_time': 2.0, 'rss_growth': 3 * 1024 ** 2},
+            {'name': 'inner', 'calls': 2, 'wall_time': 2.5,
+             'cpu_time': 1.5, 'rss_growth': 3 * 1024 ** 2},
+        ])
+
+    def test_stage_exception(self):
+        self._measure.side_effect = [(0.0, 0.0, None), (1.0, 0.5, None)]
+        profiler = self._start_profiling()
+
+        # Expect that the stage is recorded and the exception propagated
+        with self.assertRaises(ValueError):
+            with instrumentation.stage('failing'):
+                raise ValueError()
+
+        self.assertEqual(profiler.stats()['stages'], [
+            {'name': 'failing', 'calls': 1, 'wall_time': 1.0,
+             'cpu_time': 0.5, 'rss_growth': None},
+        ])
+
+    def test_counters(self):
+        profiler = self._start_profiling()
+
+        instrumentation.count('files')
+        instrumentation.count('lines', 10)
+        instrumentation.count('files', 2)
+
+        self.assertEqual(
+            profiler.stats()['counters'], {'files': 3, 'lines': 10}
+        )
+
+    def test_unregister(self):
+        profiler = self._start_profiling()
+        instrumentation.unregister(profiler)
+
+        instrumentation.count('files')
+        self.assertEqual(profiler.stats()['counters'], {})
+
+    def test_threads(self):
+        self._measure.side_effect = [
+            (0.0, 0.0, None), (1.0, 0.0, None),
+            (4.0, 0.0, None), (10.0, 0.0, None),
+        ]
+        profiler = self._start_profiling()
+
+        # Start the same stage in two threads, but end
+        # the one that started first last
+        main_stage = instrumentation.stage('stage')
+        main_stage.__enter__()
+
+        thread = threading.Thread(target=self._run_stage)
+        thread.start()
+        thread.join()
+
+        main_stage.__exit__(None, None, None)
+
+        self.assertEqual(profiler.stats()['stages'], [
+            {'name': 'stage', 'calls': 2, 'wall_time': 13.0,
+             'cpu_time': 0.0, 'rss_growth': None},
+        ])
+
+    @staticmethod
+    def _run_stage():
+        with instrumentation.stage('stage'):
+            pass
+
+    def test_write_json(self):
+        self._measure.side_effect = [(0.0, 0.0, None), (2.0, 1.0, None)]
+        profiler = self._start_profiling()
+
+        with instrumentation.stage('stage'):
+            instrumentation.count('counter', 5)
+
+        output = StringIO()
+        profiler.write_json(output)
+
+        self.assertEqual(json.loads(output.getvalue()), {
+            'stages': [
+                {'name': 'stage', 'calls': 1, 'wall_time': 2.0,
+                 'cpu_time': 1.0, 'rss_growth': None}
+            ],
+            'counters': {'counter': 5}
+        })
+
+    def test_write_report(self):
+        self._measure.side_effect = [
+            (0.0, 0.0, 5 * 1024 ** 2), (2.0, 1.0, 15 * 1024 ** 2),
+            (2.0, 1.0, None), (2.5, 1.25, None),
+        ]
+        profiler = self._start_profiling()
+
+        with instrumentation.stage('git diff'):
+            instrumentation.count('files in diff', 5)
+
+        with instrumentation.stage('render template'):
+            pass
+
+        output = StringIO()
+        profiler.write_report(output)
+
+        lines = [line.split() for line in output.getvalue().splitlines()]
+        self.assertEqual(lines, [
+            ['Stage', 'Calls', 'Wall', '(s)', 'CPU', '(s)',
+             'RSS', 'growth', '(MB)'],
+            ['git', 'diff', '1', '2.000', '1.000', '10.0'],
+            ['render', 'template', '1', '0.500', '0.250', '-'],
+            [],
+            ['Counter', 'Count'],
+            ['files', 'in', 'diff', '5'],
+        ])
+
+    def test_measure(self):
+
+        # Expect real measurements to be increasing
+        self._patcher.stop()
+        start = instrumentation._measure()
+        end = instrumentation._measure()
+        self._patcher.start()
+
+        self.assertLessEqual(start[0], end[0])
+        self.assertLessEqual(start[1], end[1])
+
+
+class ObserverTest(unittest.TestCase):
+
+    def _register(self, observer):
+        instrumentation.register(observer)
+        self.addCleanup(instrumentation.unregister, observer)
+
+    def test_events(self):
+        observer = Mock(instrumentation.Observer)
+        self._register(observer)
+
+        with instrumentation.stage('outer'):
+            instrumentation.count('files', 3)
+            with instrumentation.stage('inner'):
+                instrumentation.count('lines')
+
+        self.assertEqual(observer.method_calls, [
+            call.stage_start('outer'),
+            call.count('files', 3),
+            call.stage_start('inner'),
+            call.count('lines', 1),
+            call.stage_end('inner'),
+            call.stage_end('outer'),
+        ])
+
+    def test_stage_exception(self):
+        observer = Mock(instrumentation.Observer)
+        self._register(observer)
+
+        with self.assertRaises(ValueError):
+            with instrumentation.stage('failing'):
+                raise ValueError()
+
+        self.assertEqual(observer.method_calls, [
+            call.stage_start('failing'),
+            call.stage_end('failing'),
+        ])
+
+    def test_multiple_observers(self):
+        events = []
+
+        class RecordingObserver(instrumentation.Observer):
+            def __init__(self, label):
+                self.label = label
+
+            def stage_start(self, name):
+                events.append((self.label, 'start', name))
+
+            def stage_end(self, name):
+                events.append((self.label, 'end', name))
+
+        self._register(RecordingObserver('first'))
+        self._register(RecordingObserver('second'))
+
+        with instrumentation.stage('stage'):
+            instrumentation.count('ignored')
+
+        # Expect the stage to be ended in the reverse order it started
+        self.assertEqual(events, [
+            ('first', 'start', 'stage'),
+            ('second', 'start', 'stage'),
+            ('second', 'end', 'stage'),
+            ('first', 'end', 'stage'),
+        ])
+
+    def test_unregister_missing(self):
+
+        # Expect that unregistering an unknown observer does nothing
+        instrumentation.unregister(instrumentation.Observer())
+        self.assertEqual(instrumentation._OBSERVERS, ())
+
+    def test_no_observers(self):
+
+        # Expect that the same do-nothing stage is used every time
+        self.assertIs(
+            instrumentation.stage('first'), instrumentation.stage('second')
+        )
+
+
+class HookTest(unittest.TestCase):
+    """
+    Check that the tool's components emit events.
+    """
+
+    def setUp(self):
+        self.observer = Mock(instrumentation.Observer)
+        instrumentation.register(self.observer)
+        self.addCleanup(instrumentation.unregister, self.observer)
+
+    def _stages(self):
+        return [
+            args[0] for (method, args, _) in self.observer.method_calls
+            if method == 'stage_start'
+        ]
+
+    def _counts(self):
+        counts = dict()
+        for (method, args, _) in self.observer.method_calls:
+            if method == 'count':
+                counts[args[0]] = counts.get(args[0], 0) + args[1]
+        return counts
+
+    def test_git_diff(self):
+        git_diff = Mock()
+        git_diff.diff_all.return_value = [
+            git_diff_output(
+                {'subdir/file1.py': line_numbers(3, 10) + line_numbers(34, 47)}
+            ),
+            '', ''
+        ]
+
+        diff = GitDiffReporter(git_diff=git_diff)
+        diff.src_paths_changed()
+
+        self.assertEqual(self._stages(), ['git diff'])
+        self.assertEqual(
+            self._counts(), {'files in diff': 1, 'changed lines': 22}
+        )
+
+    def test_coverage_xml(self):
+        xml = etree.fromstring(
+            '<coverage><packages><classes>'
+            '<class filename="file1.py"><lines>'
+            '<line number="2" hits="0"/></lines></class>'
+            '<class filename="file2.py"><lines>'
+            '<line number="2" hits="1"/></lines></class>'
+            '</classes></packages></coverage>'
+        )
+
+        coverage = XmlCoverageReporter([xml])
+        coverage.violations('file1.py')
+        coverage.violations('file2.py')
+
+        self.assertEqual(self._stages(), ['coverage XML'])
+        self.assertEqual(self._counts(), {'XML classes scanned': 2})
+
+    def test_quality_command(self):
+        with patch('diff_cover.violations_reporter.subprocess.Popen') as popen:
+            popen.return_value.communicate.return_value = (
+                'file1.py:2:1: E231 whitespace', ''
+            )
+            quality = Pep8QualityReporter('pep8', [])
+            quality.violations('file1.py')
+
+        self.assertEqual(self._stages(), ['quality tool', 'quality command'])
+        self.assertEqual(self._counts()['quality tool processes'], 1)
+
+    def test_generate_report(self):
+        violations = Mock(BaseViolationReporter)
+        violations.name.return_value = 'pep8'
+        violations.violations.return_value = [Violation(2, None)]
+        violations.measured_lines.return_value = None
+
+        diff = Mock(BaseDiffReporter)
+        diff.name.return_value = 'main'
+        diff.src_paths_changed.return_value = ['file1.py']
+        diff.lines_changed.return_value = [1, 2]
+        diff.line_ranges.return_value = [(1, 2)]
+
+        with patch('diff_cover.snippets.Snippet.load_snippets_html') as load:
+            load.return_value = ['<div>snippet</div>']
+            HtmlReportGenerator(violations, diff).generate_report(StringIO())
+
+        # Expect that snippets are rendered as the template needs them
+        self.assertEqual(
+            self._stages(), ['render template', 'render snippets']
+        )
+        self.assertEqual(self._counts(), {'snippets rendered': 1})
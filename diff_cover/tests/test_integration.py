@@ -129,11 +129,20 @@ class ToolsIntegrationBase(unittest.TestCase):
         """
         Patch the call to `git diff` to output `stdout`
         and `stderr`.
+
+        `stdout` is the diff of the committed changes; there
+        are no staged or unstaged changes.
         """
         def patch_diff(command, **kwargs):
             if command[0] == 'git':
                 mock = Mock()
-                mock.communicate.return_value = (stdout, stderr)
+                if 'origin/master...HEAD' in command:
+                    output = stdout
+                else:
+                    output = ''
+                mock.communicate.return_value = (output, stderr)
+                mock.stdout = StringIO(output)
+                mock.stderr = StringIO(stderr)
                 return mock
             else:
                 process = Popen(command, **kwargs)
@@ -0,0 +1,25 @@
+import subprocess
+import sys
+from diff_cover.tests.helpers import unittest
+
+
+class LazyImportTest(unittest.TestCase):
+
+    def test_tool_imports(self):
+
+        # Import the tool in a fresh interpreter,
+        # and list the modules it loaded
+        process = subprocess.Popen([
+            sys.executable, '-c',
+            'import sys; import diff_cover.tool; '
+            'print("\\n".join(sorted(sys.modules)))'
+        ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output, stderr = process.communicate()
+        self.assertEqual(process.returncode, 0, msg=stderr)
+
+        modules = output.split()
+
+        # Expect that the slow dependencies are only
+        # imported when we need them
+        for module in ['lxml', 'jinja2', 'pygments', 'pkg_resources']:
+            self.assertNotIn(module, modules)
@@ -1,5 +1,9 @@
 import mock
+import os.path
 import StringIO
+import subprocess
+import sys
+import tempfile
 from textwrap import dedent
 from diff_cover.diff_reporter import BaseDiffReporter
 from diff_cover.violations_reporter import BaseViolationReporter, Violation
@@ -73,6 +77,10 @@ class BaseReportGeneratorTest(unittest.TestCase):
 
         self._lines_dict = dict()
         self.diff.lines_changed.side_effect = self._lines_dict.get
+        self.diff.line_ranges.side_effect = lambda src_path: \
+            BaseDiffReporter._ranges_from_lines(
+                self._lines_dict.get(src_path, [])
+            )
 
         self._violations_dict = dict()
         self.coverage.violations.side_effect = self._violations_dict.get
@@ -341,3 +349,144 @@ class HtmlReportGeneratorTest(BaseReportGeneratorTest):
         # Verify that we got the expected string
         expected = load_fixture('html_report_two_snippets.html').strip()
         self.assert_report(expected)
+
+    def test_multiple_snippets_jobs(self):
+
+        self.use_default_values()
+        self.set_num_snippets(2)
+
+        # Render the snippets in separate processes
+        self.report = HtmlReportGenerator(self.coverage, self.diff, jobs=2)
+
+        # Expect the same report as rendering them in this process
+        expected = load_fixture('html_report_two_snippets.html').strip()
+        self.assert_report(expected)
+
+    def test_snippets_loaded_lazily(self):
+
+        self.use_default_values()
+
+        # Record each write to the output file
+        output = []
+
+        class WriteRecorder(object):
+            def write(self, chunk):
+                output.append(chunk)
+
+        # Record how much of the report was written
+        # when the snippets for each file were loaded
+        written_before_load = []
+
+        def load_snippets_html(*args):
+            written_before_load.append(len(output))
+            return [self.SNIPPET]
+
+        self._load_snippets_html.side_effect = load_snippets_html
+        self.report.generate_report(WriteRecorder())
+
+        # Expect that the snippets were loaded one file at a time,
+        # after the start of the report had been written
+        self.assertEqual(len(written_before_load), 2)
+        self.assertTrue(written_before_load[0] > 0)
+        self.assertTrue(written_before_load[1] > written_before_load[0])
+
+    def test_snippets_sorted(self):
+
+        src_paths = ['file{0}.py'.format(index) for index in range(20)]
+        self.set_src_paths_changed(list(reversed(src_paths)))
+        for src_path in src_paths:
+            self.set_lines_changed(src_path, self.LINES)
+            self.set_violations(src_path, self.VIOLATIONS)
+            self.set_measured(src_path, self.MEASURED)
+
+        self.report.generate_report(StringIO.StringIO())
+
+        # Expect that snippets are rendered in order of path
+        loaded = [
+            call[0][0] for call in self._load_snippets_html.call_args_list
+        ]
+        self.assertEqual(loaded, sorted(src_paths))
+
+    @mock.patch('multiprocessing.Pool')
+    def test_multiple_snippets_jobs_pool(self, pool_class):
+
+        self.use_default_values()
+        self.set_num_snippets(2)
+        pool = pool_class.return_value
+        pool.imap.side_effect = lambda func, args: (func(arg) for arg in args)
+
+        self.report = HtmlReportGenerator(self.coverage, self.diff, jobs=2)
+        self.report.generate_report(StringIO.StringIO())
+
+        # Expect that the pool is shut down and waited for
+        self.assertEqual(pool.close.call_count, 1)
+        self.assertEqual(pool.join.call_count, 1)
+        self.assertEqual(pool.terminate.call_count, 0)
+
+    @mock.patch('multiprocessing.Pool')
+    def test_multiple_snippets_jobs_error(self, pool_class):
+
+        self.use_default_values()
+        self.set_num_snippets(2)
+        pool = pool_class.return_value
+        pool.imap.side_effect = KeyboardInterrupt
+
+        self.report = HtmlReportGenerator(self.coverage, self.diff, jobs=2)
+
+        # Expect that the workers are stopped if rendering fails
+        with self.assertRaises(KeyboardInterrupt):
+            self.report.generate_report(StringIO.StringIO())
+
+        self.assertEqual(pool.terminate.call_count, 1)
+        self.assertEqual(pool.join.call_count, 1)
+
+    def test_generate_report_streamed(self):
+
+        self.use_default_values()
+        self.set_num_snippets(2)
+
+        # Record each write to the output file
+        class WriteRecorder(object):
+            def __init__(self):
+                self.chunks = []
+
+            def write(self, chunk):
+                self.chunks.append(chunk)
+
+        output = WriteRecorder()
+        self.report.generate_report(output)
+
+        # Expect that the report is written a piece at a time,
+        # as byte strings, instead of all at once
+        self.assertTrue(len(output.chunks) > 1)
+        self.assertTrue(all(isinstance(chunk, str) for chunk in output.chunks))
+
+        expected = load_fixture('html_report_two_snippets.html').strip()
+        assert_long_str_equal(expected, ''.join(output.chunks), strip=True)
+
+
+class TemplateDirTest(unittest.TestCase):
+
+    def test_render_from_other_dir(self):
+
+        # Import the package by a relative path, so that `__file__`
+        # is relative, then change directory before rendering
+        package_root = os.path.dirname(
+            os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        )
+        other_dir = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, other_dir)
+
+        process = subprocess.Popen([
+            sys.executable, '-c',
+            'import os, sys; sys.path.insert(0, "."); '
+            'from diff_cover import report_generator; '
+            'os.chdir(sys.argv[1]); '
+            'env = report_generator.template_env(); '
+            'print(env.get_template("html_coverage_report.html").name)',
+            other_dir
+        ], cwd=package_root, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output, stderr = process.communicate()
+        self.assertEqual(process.returncode, 0, msg=stderr)
+
+        self.assertEqual(output.strip(), 'html_coverage_report.html')
@@ -1,7 +1,11 @@
 from textwrap import dedent
+from mock import patch
 import os
+import shutil
 import tempfile
+import pygments
 from pygments.token import Token
+from diff_cover.cache import DiskCache
 from diff_cover.snippets import Snippet
 from diff_cover.tests.helpers import load_fixture,\
     fixture_path, assert_long_str_equal, unittest
@@ -92,6 +96,124 @@ class SnippetTest(unittest.TestCase):
             1, [], self.FIXTURES['unicode']
         )
 
+    def test_group_tokens(self):
+
+        # Tokens covering lines 1-6, some spanning several lines
+        src_tokens = [
+            (Token.Comment, u'# 1'),
+            (Token.Text, u'\n'),
+            (Token.String, u'"""2\n3\n4\n5"""'),
+            (Token.Text, u'\n'),
+            (Token.Name, u'six'),
+        ]
+
+        # Overlapping ranges, and a range past the end of the file
+        token_map = Snippet._group_tokens(
+            iter(src_tokens), [(1, 3), (3, 4), (6, 8)]
+        )
+
+        self.assertEqual(token_map, {
+            (1, 3): [
+                (Token.Comment, u'# 1'),
+                (Token.Text, u'\n'),
+                (Token.String, u'"""2\n3'),
+            ],
+            (3, 4): [(Token.String, u'3\n4')],
+            (6, 8): [(Token.Text, u''), (Token.Name, u'six')],
+        })
+
+    def test_snippet_ranges(self):
+
+        # Unsorted, repeated violations in a very long file,
+        # including one past the end of the file
+        ranges = Snippet._snippet_ranges(
+            10 ** 9, [500, 10 ** 9, 2, 505, 500, 511, 10 ** 9 + 1]
+        )
+
+        # Expect that violations up to `MAX_GAP_IN_SNIPPET` + 1
+        # lines apart are in the same snippet
+        self.assertEqual(ranges, [
+            (1, 6), (496, 509), (507, 515), (10 ** 9 - 4, 10 ** 9)
+        ])
+
+    def test_lexer_cache(self):
+        patch.dict(Snippet._LEXER_CACHE, clear=True).start()
+        patch.dict(Snippet._LEXER_CLASS_CACHE, clear=True).start()
+        self.addCleanup(patch.stopall)
+
+        # Expect that files using the same lexer share it
+        lexer = Snippet._lexer('src/one.py', 'x = 1')
+        self.assertEqual(lexer.name, 'Python')
+        self.assertIs(lexer, Snippet._lexer('src/two.py', 'y = 2'))
+        self.assertIs(lexer, Snippet._lexer('src/SConstruct', 'z = 3'))
+        self.assertFalse(lexer.stripnl)
+
+        # Expect that lexers are chosen by the whole file name,
+        # not just the extension
+        self.assertEqual(Snippet._lexer('src/file.conf', '').name, 'Text only')
+        self.assertEqual(
+            Snippet._lexer('src/apache.conf', '<VirtualHost *>').name,
+            'ApacheConf'
+        )
+        self.assertEqual(
+            Snippet._lexer('src/Makefile', 'all:\n\techo done\n').name,
+            'Makefile'
+        )
+
+        # Expect that unknown types are lexed as text
+        self.assertEqual(
+            Snippet._lexer('src/data.unknown', '').name, 'Text only'
+        )
+
+    def test_lexer_ambiguous_names(self):
+        patch.dict(Snippet._LEXER_CACHE, clear=True).start()
+        patch.dict(Snippet._LEXER_CLASS_CACHE, clear=True).start()
+        self.addCleanup(patch.stopall)
+
+        objc_src = '#import <Foo.h>\n@interface Foo : NSObject\n@end\n'
+        matlab_src = 'function y = f(x)\n% comment\ny = x;\nend\n'
+
+        # Expect that when several lexers handle a file name, we choose
+        # the preferred one without looking at the contents
+        for (src_path, contents, name) in [
+                ('src/one.m', objc_src, 'Objective-C'),
+                ('src/two.m', matlab_src, 'Objective-C'),
+                ('src/lib.h', objc_src, 'C'),
+                ('src/notes.txt', '*** Test Cases ***', 'Text only')]:
+            self.assertEqual(Snippet._lexer(src_path, contents).name, name)
+
+        # Expect that the preference can be changed
+        patch.object(Snippet, 'PREFERRED_LEXERS', ['matlab']).start()
+        Snippet._LEXER_CLASS_CACHE.clear()
+        self.assertEqual(Snippet._lexer('src/two.m', '').name, 'Matlab')
+
+    def test_lexer_scripts(self):
+        patch.dict(Snippet._LEXER_CACHE, clear=True).start()
+        patch.dict(Snippet._LEXER_CLASS_CACHE, clear=True).start()
+        self.addCleanup(patch.stopall)
+
+        # Expect that files without an extension that match no
+        # pattern use the lexer for the interpreter on the "#!" line
+        for (src_path, contents, name) in [
+                ('bin/tool', '#!/usr/bin/env python2.7\nx = 1\n', 'Python'),
+                ('bin/build', '#!/bin/sh -e\nmake\n', 'Bash'),
+                ('bin/other', '#!/usr/bin/no-such-lexer\n', 'Text only'),
+                ('README', 'Not a script\n', 'Text only'),
+                ('src/run.unknown', '#!/bin/sh\n', 'Text only')]:
+            self.assertEqual(Snippet._lexer(src_path, contents).name, name)
+
+    def test_lexer_overrides(self):
+        patch.dict(Snippet._LEXER_CACHE, clear=True).start()
+        patch.dict(Snippet._LEXER_CLASS_CACHE, clear=True).start()
+        patch.object(Snippet, 'LEXER_OVERRIDES', {
+            '*.inc': 'php', 'setup.py': 'text'
+        }).start()
+        self.addCleanup(patch.stopall)
+
+        self.assertEqual(Snippet._lexer('src/lib.inc', '').name, 'PHP')
+        self.assertEqual(Snippet._lexer('src/setup.py', '').name, 'Text only')
+        self.assertEqual(Snippet._lexer('src/other.py', '').name, 'Python')
+
     def _assert_format(self, src_tokens, src_filename,
                        start_line, violation_lines,
                        expected_fixture):
@@ -198,6 +320,142 @@ class SnippetLoaderTest(unittest.TestCase):
         # Check that we got what we expected
         assert_long_str_equal(expected, snippets_html, strip=True)
 
+    def test_windowed_lexing(self):
+
+        # A Python module with docstrings that start before
+        # and end after the snippets
+        src_lines = ['import os', '']
+        for index in range(20):
+            src_lines.extend([
+                'def func_{0}():'.format(index),
+                '    """',
+                '    Docstring {0}'.format(index),
+                '    """',
+                '    return os.path.join("a", "b")',
+                '',
+                '',
+            ])
+
+        _, src_path = tempfile.mkstemp(suffix='.py')
+        self.addCleanup(lambda: os.remove(src_path))
+        with open(src_path, 'w') as src_file:
+            src_file.write('\n'.join(src_lines))
+
+        violations = [40, 41, 100]
+
+        # Expect that we don't lex the lines far from the snippets
+        with patch('diff_cover.snippets.pygments.lex',
+                   wraps=pygments.lex) as lex:
+            windowed = Snippet.load_snippets(src_path, violations)
+
+        for call in lex.call_args_list:
+            self.assertNotIn('func_19', call[0][0])
+
+        # Expect the same snippets as when we lex the whole file
+        with patch.object(Snippet, 'WINDOWED_LEXERS', []):
+            whole = Snippet.load_snippets(src_path, violations)
+
+        self.assertEqual(
+            sorted((s.line_range(), s.html()) for s in windowed),
+            sorted((s.line_range(), s.html()) for s in whole)
+        )
+
+    def test_windowed_lexing_quotes(self):
+
+        # Triple quotes in a comment, in single-line strings, and
+        # in a docstring delimited by the other kind of quotes
+        src_lines = [
+            '# Strings start with """',
+            'QUOTES = \'"""\' + "\'\'\'"',
+            'ESCAPED = "\\"\\"\\""',
+            "DOC = '''",
+            'A docstring with """ in it',
+            "'''",
+            '',
+        ]
+        for index in range(10):
+            src_lines.extend([
+                'def func_{0}():'.format(index),
+                '    return "{0}"'.format(index),
+                '',
+            ])
+
+        # Expect that only the docstring's lines start inside a string
+        in_string = Snippet._python_string_lines(src_lines)
+        self.assertEqual(
+            [index + 1 for index, inside in enumerate(in_string) if inside],
+            [5, 6]
+        )
+
+        _, src_path = tempfile.mkstemp(suffix='.py')
+        self.addCleanup(lambda: os.remove(src_path))
+        with open(src_path, 'w') as src_file:
+            src_file.write('\n'.join(src_lines))
+
+        # Expect the same snippets as when we lex the whole file
+        violations = [5, 30]
+        windowed = Snippet.load_snippets(src_path, violations)
+
+        with patch.object(Snippet, 'WINDOWED_LEXERS', []):
+            whole = Snippet.load_snippets(src_path, violations)
+
+        self.assertEqual(
+            sorted((s.line_range(), s.html()) for s in windowed),
+            sorted((s.line_range(), s.html()) for s in whole)
+        )
+
+    def test_windowed_lexing_unclosed_string(self):
+
+        # Expect that if a string is never closed, we can't
+        # tell which lines are in strings
+        self.assertIs(
+            Snippet._python_string_lines(['x = 1', 'DOC = """', 'x = 2']),
+            None
+        )
+
+        _, src_path = tempfile.mkstemp(suffix='.py')
+        self.addCleanup(lambda: os.remove(src_path))
+        with open(src_path, 'w') as src_file:
+            src_file.write('\n'.join(['DOC = """'] + ['x = 1'] * 200))
+
+        # Expect that we lex the whole file instead
+        with patch('diff_cover.snippets.pygments.lex',
+                   wraps=pygments.lex) as lex:
+            Snippet.load_snippets(src_path, [150])
+
+        self.assertEqual(lex.call_count, 1)
+        self.assertIn('DOC', lex.call_args[0][0])
+
+    def test_load_snippets_html_cache(self):
+        self._init_src_file(20)
+
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(cache_dir))
+        cache = DiskCache(cache_dir)
+
+        expected = Snippet.load_snippets_html(self._src_path, [5])
+
+        # Fill the cache
+        self.assertEqual(
+            Snippet.load_snippets_html(self._src_path, [5], cache), expected
+        )
+
+        # Expect that we use the cached HTML instead of loading the snippets
+        with patch.object(Snippet, 'load_snippets') as load_snippets:
+            self.assertEqual(
+                Snippet.load_snippets_html(self._src_path, [5], cache),
+                expected
+            )
+            self.assertFalse(load_snippets.called)
+
+            # Expect that different violations or contents aren't cached
+            Snippet.load_snippets_html(self._src_path, [6], cache)
+            self.assertEqual(load_snippets.call_count, 1)
+
+            self._init_src_file(21)
+            Snippet.load_snippets_html(self._src_path, [5], cache)
+            self.assertEqual(load_snippets.call_count, 2)
+
     def _assert_line_range(self, violation_lines, expected_ranges):
         """
         Assert that the snippets loaded using `violation_lines`
@@ -1,10 +1,16 @@
-from mock import patch
+from mock import patch, Mock
+import os
+import os.path
+import shutil
 from subprocess import Popen
+import tempfile
 from textwrap import dedent
 from StringIO import StringIO
 from lxml import etree
 from diff_cover.violations_reporter import XmlCoverageReporter, Violation, \
-    Pep8QualityReporter, PylintQualityReporter, QualityReporterError
+    StreamingXmlCoverageReporter, Pep8QualityReporter, \
+    Pep8LibraryQualityReporter, PylintQualityReporter, QualityReporterError
+from diff_cover.cache import DiskCache
 from diff_cover.tests.helpers import unittest
 
 
@@ -29,7 +35,7 @@ class XmlCoverageReporterTest(unittest.TestCase):
         xml = self._coverage_xml(file_paths, violations, measured)
 
         # Parse the report
-        coverage = XmlCoverageReporter(xml)
+        coverage = self._reporter(xml)
 
         # Expect that the name is set
         self.assertEqual(coverage.name(), "XML")
@@ -62,7 +68,7 @@ class XmlCoverageReporterTest(unittest.TestCase):
         xml2 = self._coverage_xml(file_paths, violations2, measured2)
 
         # Parse the report
-        coverage = XmlCoverageReporter([xml, xml2])
+        coverage = self._reporter([xml, xml2])
 
         # By construction, each file has the same set
         # of covered/uncovered lines
@@ -91,7 +97,7 @@ class XmlCoverageReporterTest(unittest.TestCase):
         xml2 = self._coverage_xml(file_paths, violations2, measured2)
 
         # Parse the report
-        coverage = XmlCoverageReporter([xml2, xml])
+        coverage = self._reporter([xml2, xml])
 
         # By construction, each file has the same set
         # of covered/uncovered lines
@@ -123,7 +129,7 @@ class XmlCoverageReporterTest(unittest.TestCase):
         xml3 = self._coverage_xml(file_paths, violations3, measured3)
 
         # Parse the report
-        coverage = XmlCoverageReporter([xml2, xml, xml3])
+        coverage = self._reporter([xml2, xml, xml3])
 
         # By construction, each file has the same set
         # of covered/uncovered lines
@@ -146,7 +152,7 @@ class XmlCoverageReporterTest(unittest.TestCase):
         ]
 
         # Parse the report
-        coverage = XmlCoverageReporter(xml_roots)
+        coverage = self._reporter(xml_roots)
 
         self.assertEqual(self.MANY_VIOLATIONS, coverage.violations('file.py'))
         self.assertEqual(self.FEW_VIOLATIONS, coverage.violations('other_file.py'))
@@ -169,7 +175,7 @@ class XmlCoverageReporterTest(unittest.TestCase):
         xml2 = self._coverage_xml(file_paths, violations2, measured2)
 
         # Parse the report
-        coverage = XmlCoverageReporter([xml2, xml])
+        coverage = self._reporter([xml2, xml])
 
         # By construction, each file has the same set
         # of covered/uncovered lines
@@ -183,18 +189,39 @@ class XmlCoverageReporterTest(unittest.TestCase):
             coverage.measured_lines('file1.py')
         )
 
+    def test_classes_split_across_file(self):
+
+        # Construct an XML report in which one source file
+        # is described by two <class> elements
+        xml = self._coverage_xml(['file1.py'], self.FEW_VIOLATIONS, set([3, 5]))
+        other_xml = self._coverage_xml(['file1.py'], self.FEW_VIOLATIONS, set([11, 13]))
+        xml.find('.//classes').append(other_xml.find('.//class'))
+
+        # Parse the report
+        coverage = self._reporter([xml])
+
+        # Expect that lines from both classes are combined
+        self.assertEqual(self.FEW_VIOLATIONS, coverage.violations('file1.py'))
+        self.assertEqual(set([3, 5, 11, 13]), coverage.measured_lines('file1.py'))
+
     def test_no_such_file(self):
 
         # Construct the XML report with no source files
         xml = self._coverage_xml([], [], [])
 
         # Parse the report
-        coverage = XmlCoverageReporter(xml)
+        coverage = self._reporter(xml)
 
         # Expect that we get no results
         result = coverage.violations('file.py')
         self.assertEqual(result, set([]))
 
+    def _reporter(self, xml_roots):
+        """
+        Create the coverage reporter under test from `xml_roots`.
+        """
+        return XmlCoverageReporter(xml_roots)
+
     def _coverage_xml(self, file_paths, violations, measured):
         """
         Build an XML tree with source files specified by `file_paths`.
@@ -235,6 +262,50 @@ class XmlCoverageReporterTest(unittest.TestCase):
         return root
 
 
+class StreamingXmlCoverageReporterTest(XmlCoverageReporterTest):
+    """
+    Run the XML coverage tests against reports that are
+    parsed incrementally from files.
+    """
+
+    def test_ignores_files_outside_diff(self):
+
+        # Construct the XML report
+        xml = self._coverage_xml(
+            ['file1.py', 'subdir/file2.py'],
+            self.MANY_VIOLATIONS, self.FEW_MEASURED
+        )
+
+        # Only look for one of the files in the report
+        coverage = StreamingXmlCoverageReporter(
+            [StringIO(etree.tostring(xml))], ['file1.py']
+        )
+
+        # Expect that we only keep the file we asked for
+        self.assertEqual(self.MANY_VIOLATIONS, coverage.violations('file1.py'))
+        self.assertEqual(set(), coverage.violations('subdir/file2.py'))
+        self.assertEqual(set(), coverage.measured_lines('subdir/file2.py'))
+
+    def _reporter(self, xml_roots):
+        """
+        Serialize each of `xml_roots` to a file-like object
+        and stream them, keeping every source file in the reports.
+        """
+        if not isinstance(xml_roots, list):
+            xml_roots = [xml_roots]
+
+        src_paths = set(
+            class_node.get('filename')
+            for xml_root in xml_roots
+            for class_node in xml_root.iter('class')
+        )
+
+        return StreamingXmlCoverageReporter(
+            [StringIO(etree.tostring(xml_root)) for xml_root in xml_roots],
+            src_paths
+        )
+
+
 class Pep8QualityReporterTest(unittest.TestCase):
 
     def tearDown(self):
@@ -274,6 +345,143 @@ class Pep8QualityReporterTest(unittest.TestCase):
 
         self.assertEqual(expected_violations, quality.violations('../new_file.py'))
 
+    def test_batch(self):
+
+        # Patch the output of `pep8`
+        _mock_popen = patch('diff_cover.violations_reporter.subprocess.Popen').start()
+        _mock_popen.return_value.communicate.return_value = (
+            '\n' + dedent("""
+                file1.py:1:17: E231 whitespace
+                subdir/file2.py:3:13: E225 whitespace
+                file1.py:7:1: E302 blank lines
+            """).strip() + '\n', ''
+        )
+
+        # Tell the reporter which files it will be asked about
+        quality = Pep8QualityReporter(
+            'pep8', [],
+            src_paths=['file1.py', 'subdir/file2.py', 'file3.py', 'README.md']
+        )
+
+        # Expect that we get the right violations
+        self.assertEqual(
+            [Violation(1, 'E231 whitespace'), Violation(7, 'E302 blank lines')],
+            quality.violations('file1.py')
+        )
+        self.assertEqual(
+            [Violation(3, 'E225 whitespace')],
+            quality.violations('subdir/file2.py')
+        )
+        self.assertEqual([], quality.violations('file3.py'))
+        self.assertEqual([], quality.violations('README.md'))
+
+        # Expect that we ran pep8 once on all the Python files
+        self.assertEqual(_mock_popen.call_count, 1)
+        command = _mock_popen.call_args[0][0]
+        self.assertEqual(command, ['pep8', 'file1.py', 'file3.py', 'subdir/file2.py'])
+
+    def test_batch_chunks(self):
+
+        # Patch the output of `pep8`
+        _mock_popen = patch('diff_cover.violations_reporter.subprocess.Popen').start()
+        _mock_popen.return_value.communicate.return_value = ('', '')
+
+        # Allow only a couple of paths per command
+        # (after the 5 characters for "pep8 ")
+        patch.object(Pep8QualityReporter, 'MAX_COMMAND_LENGTH', 25).start()
+
+        src_paths = ['file{0}.py'.format(index) for index in range(5)]
+        quality = Pep8QualityReporter('pep8', [], src_paths=src_paths)
+        self.assertEqual([], quality.violations('file3.py'))
+
+        # Expect that we split the paths into chunks
+        commands = [call[0][0] for call in _mock_popen.call_args_list]
+        self.assertEqual(commands, [
+            ['pep8', 'file0.py', 'file1.py'],
+            ['pep8', 'file2.py', 'file3.py'],
+            ['pep8', 'file4.py'],
+        ])
+
+    def test_batch_jobs(self):
+
+        # Patch the output of `pep8`, depending on which files it runs on
+        def make_process(command, **kwargs):
+            process = Mock()
+            process.communicate.return_value = (
+                '\n'.join(
+                    '{0}:1:1: E302 blank lines'.format(path)
+                    for path in command[1:]
+                ), ''
+            )
+            return process
+
+        _mock_popen = patch('diff_cover.violations_reporter.subprocess.Popen').start()
+        _mock_popen.side_effect = make_process
+
+        # Split the work between two jobs
+        src_paths = ['file{0}.py'.format(index) for index in range(5)]
+        quality = Pep8QualityReporter('pep8', [], src_paths=src_paths, jobs=2)
+
+        # Expect that we get the violations from every job
+        for src_path in src_paths:
+            self.assertEqual(
+                [Violation(1, 'E302 blank lines')],
+                quality.violations(src_path)
+            )
+
+        # Expect that each job ran on its own chunk of the files
+        commands = sorted(call[0][0] for call in _mock_popen.call_args_list)
+        self.assertEqual(commands, [
+            ['pep8', 'file0.py', 'file1.py', 'file2.py'],
+            ['pep8', 'file3.py', 'file4.py'],
+        ])
+
+    def test_result_cache(self):
+
+        # Create a source file and a cache in a temporary directory
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(temp_dir))
+        src_path = os.path.join(temp_dir, 'file1.py')
+
+        with open(src_path, 'w') as src_file:
+            src_file.write('x=1\n')
+
+        result_cache = DiskCache(os.path.join(temp_dir, 'cache'))
+
+        # Patch the output of `pep8`
+        _mock_popen = patch('diff_cover.violations_reporter.subprocess.Popen').start()
+        _mock_popen.return_value.communicate.return_value = (
+            '{0}:1:2: E225 missing whitespace'.format(src_path), ''
+        )
+        expected = [Violation(1, u'E225 missing whitespace')]
+
+        # Run the tool once to fill the cache
+        quality = Pep8QualityReporter(
+            'pep8', [], src_paths=[src_path], result_cache=result_cache
+        )
+        self.assertEqual(expected, quality.violations(src_path))
+
+        # Expect that a new reporter uses the cached results
+        # instead of running the tool on the file
+        _mock_popen.reset_mock()
+        quality = Pep8QualityReporter(
+            'pep8', [], src_paths=[src_path], result_cache=result_cache
+        )
+        self.assertEqual(expected, quality.violations(src_path))
+        self.assertFalse(any(
+            src_path in call[0][0] for call in _mock_popen.call_args_list
+        ))
+
+        # Expect that changing the file runs the tool again
+        with open(src_path, 'w') as src_file:
+            src_file.write('x = 1\n')
+
+        _mock_popen.return_value.communicate.return_value = ('', '')
+        quality = Pep8QualityReporter(
+            'pep8', [], src_paths=[src_path], result_cache=result_cache
+        )
+        self.assertEqual([], quality.violations(src_path))
+
     def test_no_quality_issues_newline(self):
 
         # Patch the output of `pep8`
@@ -362,6 +570,239 @@ class Pep8QualityReporterTest(unittest.TestCase):
         for expected in expected_violations:
             self.assertIn(expected, actual_violations)
 
+    def test_quality_pregenerated_report_line_ranges(self):
+
+        pep8_reports = [
+            StringIO(dedent("""
+                path/to/file.py:1:17: E231 whitespace
+                path/to/file.py:3:13: E225 whitespace
+                path/to/file.py:8:1: E302 blank lines
+                path/to/file.py:9:1: E302 blank lines
+                another/file.py:7:1: E302 blank lines
+            """).strip())
+        ]
+
+        # Lines 3 and 5-8 of one file changed
+        quality = Pep8QualityReporter(
+            'pep8', pep8_reports,
+            line_ranges={'path/to/file.py': [(3, 3), (5, 8)]}
+        )
+
+        # Expect that violations outside the diff are dropped
+        self.assertEqual(
+            sorted(quality.violations('path/to/file.py')),
+            [Violation(3, u'E225 whitespace'), Violation(8, u'E302 blank lines')]
+        )
+        self.assertEqual(quality.violations('another/file.py'), [])
+
+    def test_quality_pregenerated_report_streamed(self):
+
+        # Give a report that can only be read a line at a time
+        def report_lines():
+            yield 'path/to/file.py:1:17: E231 whitespace\n'
+            yield 'path/to/file.py:2:1: W123 \xe4\xb8\x80\n'
+            yield 'another/file.py:7:1: E302 blank lines\n'
+
+        quality = Pep8QualityReporter('pep8', [report_lines()])
+
+        self.assertEqual(
+            quality.violations('path/to/file.py'),
+            [Violation(1, u'E231 whitespace'), Violation(2, u'W123 \u4e00')]
+        )
+        self.assertEqual(
+            quality.violations('another/file.py'),
+            [Violation(7, u'E302 blank lines')]
+        )
+
+    def test_quality_pregenerated_report_skips_paths(self):
+
+        # Patch the regex, so we can see which lines it matches
+        regex = Pep8QualityReporter.VIOLATION_REGEX
+        _mock_regex = patch.object(Pep8QualityReporter, 'VIOLATION_REGEX').start()
+        _mock_regex.match.side_effect = regex.match
+
+        pep8_reports = [
+            StringIO(dedent("""
+                path/to/file.py:1:17: E231 whitespace
+                another/file.py:7:1: E302 blank lines
+            """).strip())
+        ]
+
+        quality = Pep8QualityReporter(
+            'pep8', pep8_reports,
+            line_ranges={'path/to/file.py': [(1, 1)]}
+        )
+
+        # Expect that only lines for files in the diff are matched
+        self.assertEqual(
+            quality.violations('path/to/file.py'),
+            [Violation(1, u'E231 whitespace')]
+        )
+        self.assertEqual(
+            [call[0][0] for call in _mock_regex.match.call_args_list],
+            [u'path/to/file.py:1:17: E231 whitespace\n']
+        )
+
+    def test_result_cache_line_ranges(self):
+
+        # Create a source file and a cache in a temporary directory
+        temp_dir = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(temp_dir))
+        src_path = os.path.join(temp_dir, 'file1.py')
+
+        with open(src_path, 'w') as src_file:
+            src_file.write('x=1\ny=2\n')
+
+        result_cache = DiskCache(os.path.join(temp_dir, 'cache'))
+
+        # Patch the output of `pep8`
+        _mock_popen = patch('diff_cover.violations_reporter.subprocess.Popen').start()
+        _mock_popen.return_value.communicate.return_value = (
+            '{0}:1:2: E225 missing whitespace\n'
+            '{0}:2:2: E225 missing whitespace'.format(src_path), ''
+        )
+
+        # Fill the cache with the violations on the first line
+        quality = Pep8QualityReporter(
+            'pep8', [], src_paths=[src_path], result_cache=result_cache,
+            line_ranges={src_path: [(1, 1)]}
+        )
+        self.assertEqual(
+            [Violation(1, u'E225 missing whitespace')],
+            quality.violations(src_path)
+        )
+
+        # Expect that a different set of changed lines
+        # doesn't reuse the cached results
+        quality = Pep8QualityReporter(
+            'pep8', [], src_paths=[src_path], result_cache=result_cache,
+            line_ranges={src_path: [(2, 2)]}
+        )
+        self.assertEqual(
+            [Violation(2, u'E225 missing whitespace')],
+            quality.violations(src_path)
+        )
+
+
+class Pep8LibraryQualityReporterTest(unittest.TestCase):
+
+    def setUp(self):
+
+        # Create source files in a temporary directory
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(lambda: shutil.rmtree(self.temp_dir))
+
+        self.bad_path = self._write_source('bad.py', dedent("""
+            import os
+            x=1
+            def f( a ):
+                return a
+        """).lstrip())
+        self.good_path = self._write_source('good.py', 'x = 1\n')
+
+    def tearDown(self):
+        """
+        Undo all patches
+        """
+        patch.stopall()
+
+    def _write_source(self, name, contents):
+        """
+        Write `contents` to a file called `name` in the
+        temporary directory and return its path.
+        """
+        path = os.path.join(self.temp_dir, name)
+
+        with open(path, 'w') as src_file:
+            src_file.write(contents)
+
+        return path
+
+    def test_quality(self):
+
+        # Expect that the tool never runs in a subprocess
+        _mock_popen = patch('diff_cover.violations_reporter.subprocess.Popen').start()
+
+        quality = Pep8LibraryQualityReporter(
+            'pep8', [], src_paths=[self.bad_path, self.good_path]
+        )
+
+        expected_violations = [
+            Violation(2, 'E225 missing whitespace around operator'),
+            Violation(3, 'E302 expected 2 blank lines, found 0'),
+            Violation(3, "E201 whitespace after '('"),
+            Violation(3, "E202 whitespace before ')'"),
+        ]
+
+        self.assertEqual(expected_violations, quality.violations(self.bad_path))
+        self.assertEqual([], quality.violations(self.good_path))
+        self.assertFalse(_mock_popen.called)
+
+    def test_line_ranges(self):
+
+        quality = Pep8LibraryQualityReporter(
+            'pep8', [], src_paths=[self.bad_path, self.good_path],
+            line_ranges={self.bad_path: [(2, 2)], self.good_path: [(1, 1)]}
+        )
+
+        # Expect that only violations on changed lines are kept
+        self.assertEqual(
+            [Violation(2, 'E225 missing whitespace around operator')],
+            quality.violations(self.bad_path)
+        )
+
+    def test_jobs(self):
+
+        # Check the files in separate processes
+        quality = Pep8LibraryQualityReporter(
+            'pep8', [], src_paths=[self.bad_path, self.good_path], jobs=2
+        )
+
+        self.assertEqual(4, len(quality.violations(self.bad_path)))
+        self.assertEqual([], quality.violations(self.good_path))
+
+    def test_project_config(self):
+
+        # Ignore some codes in the project configuration
+        self._write_source('setup.cfg', dedent("""
+            [pep8]
+            ignore = E201,E202
+        """))
+
+        quality = Pep8LibraryQualityReporter('pep8', [])
+
+        self.assertEqual(
+            [
+                Violation(2, 'E225 missing whitespace around operator'),
+                Violation(3, 'E302 expected 2 blank lines, found 0'),
+            ],
+            quality.violations(self.bad_path)
+        )
+
+    def test_missing_library(self):
+
+        # Simulate the `pep8` library not being installed
+        with patch.dict('sys.modules', {'pep8': None}):
+            quality = Pep8LibraryQualityReporter('pep8', [])
+
+            with self.assertRaises(QualityReporterError):
+                quality.violations(self.bad_path)
+
+    def test_quality_pregenerated_report(self):
+
+        # Expect that pre-generated reports are parsed
+        # the same way as for the `pep8` command
+        pep8_reports = [
+            StringIO('path/to/file.py:1:17: E231 whitespace\n')
+        ]
+
+        quality = Pep8LibraryQualityReporter('pep8', pep8_reports)
+
+        self.assertEqual(
+            [Violation(1, u'E231 whitespace')],
+            quality.violations('path/to/file.py')
+        )
+
 
 class PylintQualityReporterTest(unittest.TestCase):
 
@@ -565,3 +1006,43 @@ class PylintQualityReporterTest(unittest.TestCase):
 
         # Expect that the char is replaced
         self.assertEqual(violations, [Violation(2, u"W1401: Invalid char '\ufffd'")])
+
+    def test_quality_pregenerated_report_line_ranges(self):
+
+        pylint_reports = [
+            StringIO(dedent("""
+                path/to/file.py:1: [C0111] Missing docstring
+                path/to/file.py:57: [W0511] TODO fix this
+                path/to/file.py:60: [C0103, foo] Invalid name
+                unchanged/file.py:3: [C0111] Missing docstring
+            """).strip())
+        ]
+
+        # Only lines 50-57 of one file changed
+        quality = PylintQualityReporter(
+            'pylint', pylint_reports,
+            line_ranges={'path/to/file.py': [(50, 57)]}
+        )
+
+        # Expect that violations outside the diff are dropped
+        self.assertEqual(
+            quality.violations('path/to/file.py'),
+            [Violation(57, u'W0511: TODO fix this')]
+        )
+        self.assertEqual(quality.violations('unchanged/file.py'), [])
+
+    def test_chunk_paths_options(self):
+
+        # Allow room for the command, its options, and two paths
+        command = 'pylint -f parseable --reports=no --include-ids=y '
+        patch.object(
+            PylintQualityReporter, 'MAX_COMMAND_LENGTH', len(command) + 20
+        ).start()
+
+        src_paths = ['file{0}.py'.format(index) for index in range(5)]
+        quality = PylintQualityReporter('pylint', [])
+
+        # Expect that the options count towards the command's length
+        self.assertEqual(quality._chunk_paths(src_paths), [
+            ['file0.py', 'file1.py'], ['file2.py', 'file3.py'], ['file4.py']
+        ])
@@ -2,24 +2,46 @@
 Implement the command-line tool interface.
 """
 import argparse
+from contextlib import contextmanager
+import multiprocessing
 import sys
 import diff_cover
+from diff_cover import instrumentation
+from diff_cover.cache import DiskCache
 from diff_cover.diff_reporter import GitDiffReporter
 from git_diff import GitDiffTool
-from diff_cover.violations_reporter import XmlCoverageReporter, \
-    Pep8QualityReporter, PylintQualityReporter
+from diff_cover.violations_reporter import StreamingXmlCoverageReporter, \
+    Pep8QualityReporter, Pep8LibraryQualityReporter, PylintQualityReporter
 from diff_cover.report_generator import HtmlReportGenerator, \
     StringReportGenerator, HtmlQualityReportGenerator, \
     StringQualityReportGenerator
-from lxml import etree
 
 COVERAGE_XML_HELP = "XML coverage report"
 HTML_REPORT_HELP = "Diff coverage HTML output"
 VIOLATION_CMD_HELP = "Which code quality tool to use"
 INPUT_REPORTS_HELP = "Pep8 or pylint reports to use"
+JOBS_HELP = "Number of quality tool processes to run at once"
+SNIPPET_JOBS_HELP = ("Number of processes to use to render source "
+                     "snippets in the HTML report")
+CACHE_DIR_HELP = ("Directory in which to cache quality tool results "
+                  "between runs (for example, .diff_cover_cache)")
+SNIPPET_CACHE_DIR_HELP = ("Directory in which to cache the source snippets "
+                          "in the HTML report between runs (for example, "
+                          ".diff_cover_cache)")
+MERGE_BASE_HELP = ("Run a single git diff against the merge-base with "
+                   "origin/master instead of separate committed, staged, "
+                   "and unstaged diffs")
+LEXER_HELP = ("Highlight source files matching PATTERN in the HTML report "
+              "using the pygments lexer NAME (for example, '*.inc=php'). "
+              "Can be given more than once")
+PROFILE_HELP = ("Print the time and memory used by each stage "
+                "of the tool to stderr")
+PROFILE_JSON_HELP = ("Write the time and memory used by each stage "
+                     "of the tool to PATH as JSON")
 
 QUALITY_REPORTERS = {
     'pep8': Pep8QualityReporter,
+    'pep8-lib': Pep8LibraryQualityReporter,
     'pylint': PylintQualityReporter
 }
 
@@ -35,10 +57,20 @@ def parse_coverage_args(argv):
 
         {
             'coverage_xml': COVERAGE_XML,
-            'html_report': None | HTML_REPORT
+            'html_report': None | HTML_REPORT,
+            'merge_base': True | False,
+            'lexer': [(PATTERN, NAME), ],
+            'jobs': JOBS,
+            'cache_dir': None | CACHE_DIR,
+            'profile': True | False,
+            'profile_json': None | PROFILE_JSON
         }
 
     where `COVERAGE_XML` is a path, and `HTML_REPORT` is a path.
+    Each `PATTERN` is a filename pattern, and `NAME` is the name
+    of the pygments lexer to use for files matching it.
+    `JOBS` is a positive integer, defaulting to the number of CPUs,
+    and `CACHE_DIR` and `PROFILE_JSON` are paths.
 
     The path strings may or may not exist.
     """
@@ -58,6 +90,51 @@ def parse_coverage_args(argv):
         help=HTML_REPORT_HELP
     )
 
+    parser.add_argument(
+        '--merge-base',
+        action='store_true',
+        default=False,
+        help=MERGE_BASE_HELP
+    )
+
+    parser.add_argument(
+        '--lexer',
+        type=_lexer_override,
+        action='append',
+        default=[],
+        metavar='PATTERN=NAME',
+        help=LEXER_HELP
+    )
+
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=_cpu_count(),
+        help=SNIPPET_JOBS_HELP
+    )
+
+    parser.add_argument(
+        '--cache-dir',
+        type=str,
+        default=None,
+        help=SNIPPET_CACHE_DIR_HELP
+    )
+
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        default=False,
+        help=PROFILE_HELP
+    )
+
+    parser.add_argument(
+        '--profile-json',
+        type=str,
+        default=None,
+        metavar='PATH',
+        help=PROFILE_JSON_HELP
+    )
+
     return vars(parser.parse_args(argv))
 
 
@@ -67,11 +144,19 @@ def parse_quality_args(argv):
     valid options:
 
         {
-            'violations': pep8 | pylint
-            'html_report': None | HTML_REPORT
+            'violations': pep8 | pep8-lib | pylint
+            'html_report': None | HTML_REPORT,
+            'merge_base': True | False,
+            'lexer': [(PATTERN, NAME), ],
+            'jobs': JOBS,
+            'cache_dir': None | CACHE_DIR,
+            'profile': True | False,
+            'profile_json': None | PROFILE_JSON
         }
 
-    where `HTML_REPORT` is a path.
+    where `HTML_REPORT` is a path, `JOBS` is a positive integer,
+    defaulting to the number of CPUs, and `CACHE_DIR` and
+    `PROFILE_JSON` are paths.
     """
     parser = argparse.ArgumentParser(
         description=diff_cover.QUALITY_DESCRIPTION
@@ -91,6 +176,51 @@ def parse_quality_args(argv):
         help=HTML_REPORT_HELP
     )
 
+    parser.add_argument(
+        '--merge-base',
+        action='store_true',
+        default=False,
+        help=MERGE_BASE_HELP
+    )
+
+    parser.add_argument(
+        '--lexer',
+        type=_lexer_override,
+        action='append',
+        default=[],
+        metavar='PATTERN=NAME',
+        help=LEXER_HELP
+    )
+
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        default=_cpu_count(),
+        help=JOBS_HELP
+    )
+
+    parser.add_argument(
+        '--cache-dir',
+        type=str,
+        default=None,
+        help=CACHE_DIR_HELP
+    )
+
+    parser.add_argument(
+        '--profile',
+        action='store_true',
+        default=False,
+        help=PROFILE_HELP
+    )
+
+    parser.add_argument(
+        '--profile-json',
+        type=str,
+        default=None,
+        metavar='PATH',
+        help=PROFILE_JSON_HELP
+    )
+
     parser.add_argument(
         'input_reports',
         type=str,
@@ -102,18 +232,107 @@ def parse_quality_args(argv):
     return vars(parser.parse_args(argv))
 
 
-def generate_coverage_report(coverage_xml, html_report=None):
+def _lexer_override(value):
+    """
+    Parse a `PATTERN=NAME` lexer override into
+    a `(PATTERN, NAME)` tuple.
+    """
+    pattern, sep, lexer_name = value.partition('=')
+
+    if not (pattern and sep and lexer_name):
+        raise argparse.ArgumentTypeError(
+            "Expected PATTERN=NAME, got '{0}'".format(value)
+        )
+
+    # Only load pygments if we've been given a lexer
+    from pygments.lexers import get_lexer_by_name
+    from pygments.util import ClassNotFound
+
+    try:
+        get_lexer_by_name(lexer_name)
+    except ClassNotFound:
+        raise argparse.ArgumentTypeError(
+            "Unknown lexer '{0}'".format(lexer_name)
+        )
+
+    return (pattern, lexer_name)
+
+
+def _set_lexer_overrides(lexer_overrides):
+    """
+    Use the lexers in `lexer_overrides`, a list of `(PATTERN, NAME)`
+    tuples, for source snippets in the HTML report.
+    """
+    # Only load the snippet module (and pygments) if we need to
+    if lexer_overrides:
+        from diff_cover.snippets import Snippet
+        Snippet.LEXER_OVERRIDES = dict(lexer_overrides)
+
+
+def _cpu_count():
+    """
+    Return the number of CPUs, or 1 if it cannot be determined.
+    """
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+@contextmanager
+def _profiling(profile=False, profile_json=None):
+    """
+    Profile the code run in the context, as the stage "total".
+
+    If `profile` is True, print a table of the profile to stderr.
+    If `profile_json` is not `None`, write the profile as JSON
+    to the path `profile_json`.
+    """
+    if not profile and profile_json is None:
+        yield
+        return
+
+    profiler = instrumentation.Profiler()
+    instrumentation.register(profiler)
+
+    try:
+        with instrumentation.stage('total'):
+            yield
+    finally:
+        instrumentation.unregister(profiler)
+
+    if profile:
+        profiler.write_report(sys.stderr)
+
+    if profile_json is not None:
+        with open(profile_json, 'w') as profile_file:
+            profiler.write_json(profile_file)
+
+
+def generate_coverage_report(coverage_xml, html_report=None,
+                             merge_base=False, jobs=1, cache_dir=None):
     """
     Generate the diff coverage report, using kwargs from `parse_args()`.
     """
-    diff = GitDiffReporter(git_diff=GitDiffTool())
+    diff = GitDiffReporter(git_diff=GitDiffTool(), use_merge_base=merge_base)
 
-    xml_roots = [etree.parse(xml_root) for xml_root in coverage_xml]
-    coverage = XmlCoverageReporter(xml_roots)
+    # Only keep coverage information for files in the diff
+    coverage = StreamingXmlCoverageReporter(
+        coverage_xml, diff.src_paths_changed()
+    )
 
     # Build a report generator
     if html_report is not None:
-        reporter = HtmlReportGenerator(coverage, diff)
+
+        # Reuse snippets from earlier runs, if we have a cache
+        if cache_dir is not None:
+            snippet_cache = DiskCache(cache_dir)
+        else:
+            snippet_cache = None
+
+        reporter = HtmlReportGenerator(
+            coverage, diff, jobs=jobs, snippet_cache=snippet_cache
+        )
         output_file = open(html_report, "w")
     else:
         reporter = StringReportGenerator(coverage, diff)
@@ -123,14 +342,15 @@ def generate_coverage_report(coverage_xml, html_report=None):
     reporter.generate_report(output_file)
 
 
-def generate_quality_report(tool, html_report=None):
+def generate_quality_report(tool, diff, html_report=None, jobs=1,
+                            snippet_cache=None):
     """
     Generate the quality report, using kwargs from `parse_args()`.
     """
-    diff = GitDiffReporter(git_diff=GitDiffTool())
-
     if html_report is not None:
-        reporter = HtmlQualityReportGenerator(tool, diff)
+        reporter = HtmlQualityReportGenerator(
+            tool, diff, jobs=jobs, snippet_cache=snippet_cache
+        )
         output_file = open(html_report, "w")
     else:
         reporter = StringQualityReportGenerator(tool, diff)
@@ -147,11 +367,18 @@ def main():
 
     if progname.endswith('diff-cover'):
         arg_dict = parse_coverage_args(sys.argv[1:])
-        generate_coverage_report(arg_dict['coverage_xml'],
-                                 html_report=arg_dict['html_report'])
+        _set_lexer_overrides(arg_dict['lexer'])
+
+        with _profiling(arg_dict['profile'], arg_dict['profile_json']):
+            generate_coverage_report(arg_dict['coverage_xml'],
+                                     html_report=arg_dict['html_report'],
+                                     merge_base=arg_dict['merge_base'],
+                                     jobs=arg_dict['jobs'],
+                                     cache_dir=arg_dict['cache_dir'])
 
     elif progname.endswith('diff-quality'):
         arg_dict = parse_quality_args(sys.argv[1:])
+        _set_lexer_overrides(arg_dict['lexer'])
         tool = arg_dict['violations']
         reporter_class = QUALITY_REPORTERS.get(tool)
 
@@ -167,8 +394,36 @@ def main():
                     LOGGER.warning("Could not load '{0}'".format(path))
 
             try:
-                reporter = reporter_class(tool, input_reports)
-                generate_quality_report(reporter, arg_dict['html_report'])
+                with _profiling(arg_dict['profile'],
+                                arg_dict['profile_json']):
+                    diff = GitDiffReporter(
+                        git_diff=GitDiffTool(),
+                        use_merge_base=arg_dict['merge_base']
+                    )
+
+                    # Reuse results from earlier runs, if we have a cache
+                    if arg_dict['cache_dir'] is not None:
+                        result_cache = DiskCache(arg_dict['cache_dir'])
+                    else:
+                        result_cache = None
+
+                    # Run the tool once on all the files in the diff,
+                    # keeping only the violations on changed lines
+                    src_paths = diff.src_paths_changed()
+                    reporter = reporter_class(
+                        tool, input_reports,
+                        src_paths=src_paths,
+                        jobs=arg_dict['jobs'],
+                        result_cache=result_cache,
+                        line_ranges=dict(
+                            (src_path, diff.line_ranges(src_path))
+                            for src_path in src_paths
+                        )
+                    )
+                    generate_quality_report(reporter, diff,
+                                            arg_dict['html_report'],
+                                            jobs=arg_dict['jobs'],
+                                            snippet_cache=result_cache)
 
             # Close any reports we opened
             finally:
@@ -3,10 +3,14 @@ Classes for querying the information in a test coverage report.
 """
 
 from abc import ABCMeta, abstractmethod
+from bisect import bisect_right
+import codecs
 from collections import namedtuple, defaultdict
 import re
 import subprocess
 import sys
+from diff_cover import instrumentation
+from diff_cover.cache import DiskCache
 
 
 Violation = namedtuple('Violation', 'line, message')
@@ -74,6 +78,11 @@ class XmlCoverageReporter(BaseViolationReporter):
         # Keys are source file paths, values are output of `violations()`
         self._info_cache = defaultdict(list)
 
+        # Index of coverage information for every source file
+        # in the reports.  This is built the first time we need it,
+        # so that we walk each XML document only once.
+        self._file_index = None
+
     def _cache_file(self, src_path):
         """
         Load the data from `self._xml_roots`
@@ -82,55 +91,94 @@ class XmlCoverageReporter(BaseViolationReporter):
         # If we have not yet loaded this source file
         if src_path not in self._info_cache:
 
-            # Retrieve the <line> elements for this file
-            xpath = ".//class[@filename='{0}']/lines/line".format(src_path)
-
-            # We only want to keep violations that show up in each xml source.
-            # Thus, each time, we take the intersection.  However, to do this
-            # we must treat the first time as a special case and just add all
-            # the violations from the first xml report.
-            violations = None
-
-            # A line is measured if it is measured in any of the reports, so
-            # we take set union each time and can just start with the empty set
-            measured = set()
-
-            # Loop through the files that contain the xml roots
-            for xml_document in self._xml_roots:
-
-                # Check that we've actually found a source file
-                src_element = xml_document.find(".//class[@filename='{0}']".format(src_path))
-                if src_element is not None:
-                    line_nodes = xml_document.findall(xpath)
-
-                    # First case, need to define violations initially
-                    if violations is None:
-                        violations = set(
-                            Violation(int(line.get('number')), None)
-                            for line in line_nodes
-                            if int(line.get('hits', 0)) == 0)
-
-                    # If we already have a violations set,
-                    # take the intersection of the new
-                    # violations set and its old self
-                    else:
-                        violations = violations & set(
-                            Violation(int(line.get('number')), None)
-                            for line in line_nodes
-                            if int(line.get('hits', 0)) == 0
-                        )
-
-                    # Measured is the union of itself and the new measured
-                    measured = measured | set(
-                        int(line.get('number')) for line in line_nodes
-                    )
+            # Build the index of source files on the first lookup
+            if self._file_index is None:
+                with instrumentation.stage('coverage XML'):
+                    self._file_index = self._build_index()
 
             # If we don't have any information about the source file,
             # don't report any violations
-            if violations is None:
-                violations = set()
+            self._info_cache[src_path] = self._file_index.get(
+                src_path, (set(), set())
+            )
+
+    def _build_index(self):
+        """
+        Walk each of the XML documents once and return a dict
+        of the form:
+
+            { SRC_PATH: (VIOLATIONS, MEASURED) }
+
+        where `VIOLATIONS` is a set of `Violation`s and
+        `MEASURED` is a set of measured line numbers.
+        """
+        file_index = dict()
+
+        # Loop through the files that contain the xml roots
+        for document_info in self._document_line_info():
+
+            for src_path, (violations, measured) in document_info.iteritems():
+
+                # We only want to keep violations that show up in each xml
+                # source that measures the file.  Thus, each time, we take
+                # the intersection.  However, to do this we must treat the
+                # first time as a special case and just add all the
+                # violations from the first xml report.
+                if src_path not in file_index:
+                    file_index[src_path] = (violations, measured)
+
+                # A line is measured if it is measured in any of the reports,
+                # so we take set union each time.
+                else:
+                    old_violations, old_measured = file_index[src_path]
+                    file_index[src_path] = (
+                        old_violations & violations,
+                        old_measured | measured
+                    )
+
+        return file_index
+
+    def _document_line_info(self):
+        """
+        Yield a dict for each XML document of the form:
+
+            { SRC_PATH: (VIOLATIONS, MEASURED) }
+
+        containing the coverage information for every
+        `<class>` element in the document.
+        """
+        for xml_document in self._xml_roots:
+            class_elements = list(xml_document.iter('class'))
+            instrumentation.count('XML classes scanned', len(class_elements))
+            yield self._class_line_info(class_elements)
+
+    @staticmethod
+    def _class_line_info(class_elements):
+        """
+        Collect the `<line>` information from an iterable of
+        `<class>` elements into a dict of the form:
 
-            self._info_cache[src_path] = (violations, measured)
+            { SRC_PATH: (VIOLATIONS, MEASURED) }
+
+        If several `<class>` elements share a filename,
+        their lines are combined.
+        """
+        line_info = dict()
+
+        for class_element in class_elements:
+            src_path = class_element.get('filename')
+            violations, measured = line_info.setdefault(
+                src_path, (set(), set())
+            )
+
+            for line in class_element.iterfind('lines/line'):
+                line_num = int(line.get('number'))
+                measured.add(line_num)
+
+                if int(line.get('hits', 0)) == 0:
+                    violations.add(Violation(line_num, None))
+
+        return line_info
 
     def violations(self, src_path):
         """
@@ -150,6 +198,58 @@ class XmlCoverageReporter(BaseViolationReporter):
         return self._info_cache[src_path][1]
 
 
+class StreamingXmlCoverageReporter(XmlCoverageReporter):
+    """
+    Query information from Cobertura XML coverage reports,
+    reading them incrementally and keeping only the source
+    files we are interested in.
+    """
+
+    def __init__(self, xml_files, src_paths):
+        """
+        Load the Cobertura XML coverage reports in `xml_files`
+        (a list of paths or file-like objects).
+
+        Only `<class>` elements whose filename is in `src_paths`
+        are kept; everything else is discarded as the reports
+        are parsed, so memory use depends on the size of the diff
+        rather than the size of the reports.
+        """
+        super(StreamingXmlCoverageReporter, self).__init__(xml_files)
+        self._src_paths = set(src_paths)
+
+    def _document_line_info(self):
+        """
+        See base class docstring.
+        """
+        for xml_file in self._xml_roots:
+            yield self._class_line_info(self._iter_classes(xml_file))
+
+    def _iter_classes(self, xml_file):
+        """
+        Yield the `<class>` elements in `xml_file` for
+        source files in `self._src_paths`.
+
+        Each element is cleared once the caller is done with it.
+        """
+        from lxml import etree
+
+        num_scanned = 0
+
+        for _, element in etree.iterparse(xml_file, tag='class'):
+            num_scanned += 1
+
+            if element.get('filename') in self._src_paths:
+                yield element
+
+            # Free the element and any siblings we've already seen
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+        instrumentation.count('XML classes scanned', num_scanned)
+
+
 class BaseQualityReporter(BaseViolationReporter):
     """
     Abstract class to report code quality
@@ -166,7 +266,17 @@ class BaseQualityReporter(BaseViolationReporter):
     # A list of filetypes to run on.
     EXTENSIONS = []
 
-    def __init__(self, name, input_reports):
+    # Maximum length of the command line for a single invocation
+    # of the tool, including the source paths.  This leaves room
+    # under the shortest common limit on command line length
+    # (32767 characters for `CreateProcess` on Windows).
+    MAX_COMMAND_LENGTH = 8000
+
+    # Configuration files that affect the output of the tool
+    CONFIG_FILES = []
+
+    def __init__(self, name, input_reports, src_paths=None, jobs=1,
+                 result_cache=None, line_ranges=None):
         """
         Create a new quality reporter.
 
@@ -181,9 +291,51 @@ class BaseQualityReporter(BaseViolationReporter):
         If these are provided, the reporter will
         use the pre-generated reports instead of invoking
         the tool directly.
+
+        `src_paths` is an optional list of the source paths
+        that will be queried.  If provided, the first time
+        one of them is queried the tool runs once on all of
+        them (or a few times, if there are too many paths for
+        one command line) instead of once per source file.
+
+        `jobs` is the number of tool processes to run
+        concurrently on a batch.  The batch is split into
+        at least this many chunks.
+
+        `result_cache` is an optional `DiskCache` used to store
+        the violations found by the tool across runs.  Results
+        are keyed by the contents of the source file as well as
+        the tool, its version, its options, and its configuration
+        files, so the tool only runs on files that have changed.
+
+        `line_ranges` is an optional dict mapping each source path
+        in the diff to its list of changed `(start, end)` line ranges
+        (see `BaseDiffReporter.line_ranges()`).  If provided,
+        violations outside those ranges are dropped as the output
+        is parsed, instead of being stored and filtered later.
         """
         super(BaseQualityReporter, self).__init__(name)
         self._info_cache = defaultdict(list)
+        self._jobs = max(1, jobs)
+        self._result_cache = result_cache
+        self._line_ranges = line_ranges
+
+        # Start of each changed range, for looking up lines
+        if line_ranges is not None:
+            self._range_starts = dict(
+                (src_path, [start for (start, _) in ranges])
+                for src_path, ranges in line_ranges.iteritems()
+            )
+
+        # Key components shared by every file, loaded the
+        # first time we need them
+        self._tool_key = None
+
+        # Source paths to run the tool on in a batch
+        self._batch_paths = set(
+            src_path for src_path in (src_paths or [])
+            if self._has_extension(src_path)
+        )
 
         # If we've been given input report files, use those
         # to get the source information
@@ -201,16 +353,241 @@ class BaseQualityReporter(BaseViolationReporter):
         # then we've already loaded everything we need into the cache.
         # Otherwise, call pylint/pep8 ourselves
         if self.use_tool:
-            if not any(src_path.endswith(ext) for ext in self.EXTENSIONS):
+            if not self._has_extension(src_path):
                 return []
             if src_path not in self._info_cache:
-                output = self._run_command(src_path)
-                violations_dict = self._parse_output(output, src_path)
-                self._update_cache(violations_dict)
+                if src_path in self._batch_paths:
+                    src_paths = sorted(self._batch_paths)
+                    self._batch_paths = set()
+                else:
+                    src_paths = [src_path]
+
+                self._run_tool(src_paths)
 
         # Return the cached violation info
         return self._info_cache[src_path]
 
+    def _has_extension(self, src_path):
+        """
+        Return True if `src_path` has one of the
+        extensions this reporter runs on.
+        """
+        return any(src_path.endswith(ext) for ext in self.EXTENSIONS)
+
+    def _in_diff(self, src_path, line):
+        """
+        Return True if `line` of `src_path` is one of the
+        changed lines we were given (or if we weren't
+        given any changed lines).
+        """
+        if self._line_ranges is None:
+            return True
+
+        ranges = self._line_ranges.get(src_path)
+        if not ranges:
+            return False
+
+        index = bisect_right(self._range_starts[src_path], line) - 1
+        return index >= 0 and line <= ranges[index][1]
+
+    def _run_tool(self, src_paths):
+        """
+        Run the tool on the list of paths `src_paths`,
+        splitting them into chunks so each command line
+        stays short enough, and load the results into the cache.
+
+        Results found in the persistent result cache are used
+        instead of running the tool.
+        """
+        with instrumentation.stage('quality tool'):
+            result_keys = self._load_cached_results(src_paths)
+            uncached_paths = [
+                src_path for src_path in src_paths
+                if src_path not in self._info_cache
+            ]
+
+            chunks = self._chunk_paths(uncached_paths)
+            instrumentation.count('files checked', len(uncached_paths))
+            instrumentation.count(
+                'cached results', len(src_paths) - len(uncached_paths)
+            )
+
+            # Load the results in order, so the cache
+            # is filled the same way every time
+            for violations_dict in self._check_chunks(chunks):
+                self._update_cache(violations_dict)
+
+            # Files with no violations are cached as empty lists,
+            # so we don't run the tool on them again
+            for src_path in uncached_paths:
+                if src_path not in self._info_cache:
+                    self._info_cache[src_path] = []
+
+            self._store_cached_results(result_keys)
+
+    def _check_chunks(self, chunks):
+        """
+        Run the tool on each of `chunks` (lists of source paths)
+        and return a list of violation dicts (see `_parse_output()`),
+        one for each chunk, in the same order.
+        """
+        # Run the tool on each chunk, several at a time.
+        # The work happens in the tool processes, so threads
+        # are enough to keep them running concurrently.
+        if self._jobs > 1 and len(chunks) > 1:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(min(self._jobs, len(chunks)))
+            try:
+                outputs = pool.map(self._run_command, chunks)
+            except:
+                pool.terminate()
+                raise
+            else:
+                pool.close()
+            finally:
+                pool.join()
+        else:
+            outputs = [self._run_command(chunk) for chunk in chunks]
+
+        return [self._parse_output(output) for output in outputs]
+
+    def _load_cached_results(self, src_paths):
+        """
+        Load the violations for each of `src_paths` stored in the
+        persistent result cache into `self._info_cache`.
+
+        Returns a dict mapping each path not found in the result
+        cache to the key its results should be stored under.
+        """
+        result_keys = dict()
+
+        if self._result_cache is None:
+            return result_keys
+
+        for src_path in src_paths:
+            key = self._result_key(src_path)
+
+            # If we can't read the source file, don't cache its results
+            if key is None:
+                continue
+
+            cached = self._result_cache.get(key)
+
+            if cached is None:
+                result_keys[src_path] = key
+            else:
+                self._info_cache[src_path] = [
+                    Violation(line, message) for (line, message) in cached
+                ]
+
+        return result_keys
+
+    def _store_cached_results(self, result_keys):
+        """
+        Store the violations for each source path in `result_keys`
+        (a dict mapping source paths to keys) in the persistent
+        result cache.
+        """
+        if self._result_cache is None or not result_keys:
+            return
+
+        for src_path, key in result_keys.iteritems():
+            violations = self._info_cache[src_path]
+            self._result_cache.set(
+                key, [list(violation) for violation in violations]
+            )
+
+        self._result_cache.evict()
+
+    def _result_key(self, src_path):
+        """
+        Return the persistent result cache key for `src_path`,
+        or `None` if the source file could not be read.
+        """
+        try:
+            content_hash = DiskCache.hash_file(src_path)
+        except IOError:
+            return None
+
+        if self._tool_key is None:
+            self._tool_key = self._load_tool_key()
+
+        key_components = [self._tool_key, src_path, content_hash]
+
+        # We only store violations on changed lines,
+        # so the results also depend on which lines changed
+        if self._line_ranges is not None:
+            key_components.append(repr(self._line_ranges.get(src_path)))
+
+        return DiskCache.make_key(*key_components)
+
+    def _load_tool_key(self):
+        """
+        Return a key identifying the tool, its version,
+        its options, and the contents of its configuration files.
+        """
+        version = self._tool_version()
+
+        config_hashes = []
+        for config_path in self.CONFIG_FILES:
+            try:
+                config_hashes.append(DiskCache.hash_file(config_path))
+            except IOError:
+                config_hashes.append('')
+
+        return DiskCache.make_key(
+            self.COMMAND, version, *(self.OPTIONS + config_hashes)
+        )
+
+    def _tool_version(self):
+        """
+        Return the version output of the tool,
+        or an empty string if we can't get it.
+        """
+        try:
+            process = subprocess.Popen(
+                [self.COMMAND, '--version'],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+            return ''.join(process.communicate())
+        except OSError:
+            return ''
+
+    def _chunk_paths(self, src_paths):
+        """
+        Split `src_paths` into a list of chunks (lists of paths),
+        one for each job, further splitting any chunk that would
+        make the command line longer than `MAX_COMMAND_LENGTH`.
+        Every chunk contains at least one path.
+        """
+        chunks = []
+        chunk_length = 0
+
+        # Leave room for the command and its options,
+        # each followed by a space
+        max_paths_length = self.MAX_COMMAND_LENGTH - sum(
+            len(arg) + 1 for arg in [self.COMMAND] + self.OPTIONS
+        )
+
+        # Number of paths to give each job
+        job_size = -(-len(src_paths) // self._jobs)
+
+        for index, src_path in enumerate(src_paths):
+
+            # Start a new chunk for the next job, or if this path
+            # would make the current chunk too long
+            if (not chunks or index % job_size == 0 or
+                    chunk_length + len(src_path) > max_paths_length):
+                chunks.append([])
+                chunk_length = 0
+
+            chunks[-1].append(src_path)
+
+            # Include the space separating arguments
+            chunk_length += len(src_path) + 1
+
+        return chunks
+
     def _load_reports(self, report_files):
         """
         Load pre-generated pep8/pylint reports into
@@ -218,10 +595,16 @@ class BaseQualityReporter(BaseViolationReporter):
 
         `report_files` is a list of open file-like objects.
         """
+        instrumentation.count('quality reports loaded', len(report_files))
+
         for file_handle in report_files:
-            # Convert to unicode, replacing unreadable chars
-            contents = unicode(file_handle.read(), self.STDOUT_ENCODING, 'replace')
-            violations_dict = self._parse_output(contents)
+            # Read the report a line at a time, converting to unicode
+            # and replacing unreadable chars, so we never hold
+            # a whole report in memory
+            lines = codecs.iterdecode(
+                file_handle, self.STDOUT_ENCODING, 'replace'
+            )
+            violations_dict = self._parse_output(lines)
             self._update_cache(violations_dict)
 
     def _update_cache(self, violations_dict):
@@ -236,28 +619,56 @@ class BaseQualityReporter(BaseViolationReporter):
         for src_path, violations in violations_dict.iteritems():
             self._info_cache[src_path].extend(violations)
 
-    def _run_command(self, src_path):
+    def _run_command(self, src_paths):
         """
-        Run the quality command and return its output as a unicode string.
+        Run the quality command on the list of paths `src_paths`
+        and return its output as a unicode string.
         """
-        # Encode the path using the filesystem encoding, determined at runtime
-        command = [self.COMMAND] + self.OPTIONS + [src_path.encode(sys.getfilesystemencoding())]
+        # Encode the paths using the filesystem encoding, determined at runtime
+        command = [self.COMMAND] + self.OPTIONS + [
+            src_path.encode(sys.getfilesystemencoding())
+            for src_path in src_paths
+        ]
 
-        process = subprocess.Popen(
-            command, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
-        stdout, stderr = process.communicate()
+        instrumentation.count('quality tool processes')
+
+        with instrumentation.stage('quality command'):
+            process = subprocess.Popen(
+                command, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            )
+            stdout, stderr = process.communicate()
 
         if stderr:
             raise QualityReporterError(stderr)
 
         return unicode(stdout.strip(), self.STDOUT_ENCODING, 'replace')
 
+    def _output_lines(self, output):
+        """
+        Iterate over the lines of `output`, a unicode string or
+        an iterable of lines.
+
+        If we were given the changed lines, skip lines that don't
+        start with the path of a source file in the diff, which saves
+        matching them against the violation regex.
+        """
+        if isinstance(output, basestring):
+            output = output.split('\n')
+
+        if self._line_ranges is None:
+            return output
+
+        return (
+            line for line in output
+            if line.partition(':')[0] in self._line_ranges
+        )
+
     @abstractmethod
     def _parse_output(self, output, src_path=None):
         """
         Parse the output of this reporter
-        command into a dict of the form:
+        command (a unicode string, or an iterable
+        of lines) into a dict of the form:
 
             {
                 SRC_PATH: [Violation, ]
@@ -269,6 +680,9 @@ class BaseQualityReporter(BaseViolationReporter):
 
         If `src_path` is provided, return information
         just for that source.
+
+        Implementations should skip violations for which
+        `_in_diff()` returns False.
         """
         pass
 
@@ -280,6 +694,7 @@ class Pep8QualityReporter(BaseQualityReporter):
     COMMAND = 'pep8'
 
     EXTENSIONS = ['py']
+    CONFIG_FILES = ['setup.cfg', 'tox.ini', '.pep8']
     VIOLATION_REGEX = re.compile(r'^([^:]+):(\d+).*([EW]\d{3}.*)$')
 
     def _parse_output(self, output, src_path=None):
@@ -288,7 +703,7 @@ class Pep8QualityReporter(BaseQualityReporter):
         """
         violations_dict = defaultdict(list)
 
-        for line in output.split('\n'):
+        for line in self._output_lines(output):
 
             match = self.VIOLATION_REGEX.match(line)
 
@@ -296,15 +711,141 @@ class Pep8QualityReporter(BaseQualityReporter):
             if match is not None:
                 pep8_src, line_number, message = match.groups()
 
+                line_number = int(line_number)
+
                 # If we're looking for a particular source,
-                # filter out all other sources
-                if src_path is None or src_path == pep8_src:
-                    violation = Violation(int(line_number), message)
+                # filter out all other sources, and any lines
+                # outside the diff
+                if ((src_path is None or src_path == pep8_src) and
+                        self._in_diff(pep8_src, line_number)):
+                    violation = Violation(line_number, message)
                     violations_dict[pep8_src].append(violation)
 
         return violations_dict
 
 
+class Pep8LibraryQualityReporter(Pep8QualityReporter):
+    """
+    Report PEP8 violations, running the checks in-process
+    using the `pep8` library instead of the `pep8` command.
+
+    Pre-generated reports are parsed the same way as
+    `Pep8QualityReporter`.
+    """
+
+    def _check_chunks(self, chunks):
+        """
+        See base class docstring.
+        """
+        # The checks run in the Python interpreter, so use
+        # processes to spread them across CPUs.
+        if self._jobs > 1 and len(chunks) > 1:
+            import multiprocessing
+            pool = multiprocessing.Pool(min(self._jobs, len(chunks)))
+            try:
+                results = pool.map(_pep8_check_files, chunks)
+            except:
+                pool.terminate()
+                raise
+            else:
+                pool.close()
+            finally:
+                pool.join()
+        else:
+            results = [_pep8_check_files(chunk) for chunk in chunks]
+
+        # Only keep violations on changed lines
+        return [
+            dict(
+                (src_path, [
+                    violation for violation in violations
+                    if self._in_diff(src_path, violation.line)
+                ])
+                for src_path, violations in violations_dict.iteritems()
+            )
+            for violations_dict in results
+        ]
+
+    def _tool_version(self):
+        """
+        See base class docstring.
+        """
+        return _import_pep8().__version__
+
+
+def _import_pep8():
+    """
+    Import and return the `pep8` module.
+
+    Raises a `QualityReporterError` if it is not installed.
+    """
+    try:
+        import pep8
+    except ImportError:
+        raise QualityReporterError("Could not import the pep8 library")
+
+    return pep8
+
+
+def _pep8_check_files(src_paths):
+    """
+    Check the list of paths `src_paths` for PEP8 violations
+    using the `pep8` library, and return a dict of the form:
+
+        {
+            SRC_PATH: [Violation, ]
+        }
+
+    This is a module-level function so that it can
+    run in a `multiprocessing.Pool`.
+    """
+    pep8 = _import_pep8()
+    violations_dict = defaultdict(list)
+
+    class ViolationReport(pep8.BaseReport):
+        """
+        Record each violation reported by the checker.
+        """
+
+        def __init__(self, options):
+            super(ViolationReport, self).__init__(options)
+            self._repeat = options.repeat
+
+        def error(self, line_number, offset, text, check):
+            """
+            See `pep8.BaseReport.error()`.
+            """
+            code = super(ViolationReport, self).error(
+                line_number, offset, text, check
+            )
+
+            # Like the `pep8` command, report each code only once
+            # unless the configuration asks for every occurrence
+            if code and (self.counters[code] == 1 or self._repeat):
+                violations_dict[self.filename].append(
+                    (self.line_offset + line_number, offset, text)
+                )
+
+            return code
+
+    # Read the user and project configuration the same way
+    # the `pep8` command does for these paths
+    options, _ = pep8.process_options(list(src_paths), config_file=True)
+    options.reporter = ViolationReport
+
+    style = pep8.StyleGuide(**vars(options))
+    style.check_files(src_paths)
+
+    # Sort by position, like the `pep8` command output
+    return dict(
+        (src_path, [
+            Violation(line_number, text)
+            for (line_number, _, text) in sorted(errors)
+        ])
+        for src_path, errors in violations_dict.iteritems()
+    )
+
+
 class PylintQualityReporter(BaseQualityReporter):
     """
     Report Pylint violations.
@@ -313,6 +854,7 @@ class PylintQualityReporter(BaseQualityReporter):
     OPTIONS = ['-f', 'parseable', '--reports=no', '--include-ids=y']
 
     EXTENSIONS = ['py']
+    CONFIG_FILES = ['pylintrc', '.pylintrc']
 
     # Match lines of the form:
     # path/to/file.py:123: [C0111] Missing docstring
@@ -325,7 +867,7 @@ class PylintQualityReporter(BaseQualityReporter):
         """
         violations_dict = defaultdict(list)
 
-        for line in output.split('\n'):
+        for line in self._output_lines(output):
             match = self.VIOLATION_REGEX.match(line)
 
             # Ignore any line that isn't matched
@@ -333,17 +875,20 @@ class PylintQualityReporter(BaseQualityReporter):
             if match is not None:
 
                 pylint_src_path, line_number, pylint_code, function_name, message = match.groups()
+                line_number = int(line_number)
 
                 # If we're looking for a particular source file,
-                # ignore any other source files.
-                if src_path is None or src_path == pylint_src_path:
+                # ignore any other source files, and any lines
+                # outside the diff.
+                if ((src_path is None or src_path == pylint_src_path) and
+                        self._in_diff(pylint_src_path, line_number)):
 
                     if function_name:
                         error_str = u"{0}: {1}: {2}".format(pylint_code, function_name, message)
                     else:
                         error_str = u"{0}: {1}".format(pylint_code, message)
 
-                    violation = Violation(int(line_number), error_str)
+                    violation = Violation(line_number, error_str)
                     violations_dict[pylint_src_path].append(violation)
 
         return violations_dict